@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# ------------------ Offline Replay Benchmark ------------------
+# Replays benchmarks/corpus.json through the /home routes of both apps against
+# the stub servers in stubs.py and reports latency percentiles, upstream calls
+# and prompt sizes per query, compared with the stored baselines.
+#
+#   python benchmarks/replay.py                       # both apps, Flask mode
+#   python benchmarks/replay.py --apps nms --server asgi
+#   python benchmarks/replay.py --save-baseline       # record new baselines
+#
+# Each app runs in its own process (both are imported as "app") from its own
+# directory, with the stubs started in that process so calls can be counted per query.
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+BASELINE_DIR = BENCH_DIR / "baselines"
+APP_DIRS = {"nms": REPO_DIR / "nms-ai_tested", "iot": REPO_DIR / "iot-ai_tested"}
+
+# Fixed "now" of the stub Zabbix and of the apps' history windows, so that
+# history prompts do not depend on when (or in which time zone) a run happens
+BENCH_NOW = 1700000000
+
+# Latencies may be this many milliseconds above the baseline before the tolerance applies
+LATENCY_SLACK_MS = 5.0
+
+# Summary values compared with the baseline: (path, "latency" or "count")
+CHECKS = [
+    ("latency_ms.p50", "latency"),
+    ("latency_ms.p95", "latency"),
+    ("latency_ms.p99", "latency"),
+    ("upstream_per_query.zabbix_calls", "count"),
+    ("upstream_per_query.zabbix_requests", "count"),
+    ("upstream_per_query.thingsboard_requests", "count"),
+    ("upstream_per_query.llm_calls", "count"),
+    ("prompt_tokens_per_query.mean", "count"),
+    ("prompt_tokens_per_query.max", "count"),
+    ("errors", "count")
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the query corpus through the apps against stub upstreams.")
+    parser.add_argument("--apps", nargs="+", choices=sorted(APP_DIRS), default=sorted(APP_DIRS), help="Apps to benchmark")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask", help="Serve with app.py or asgi.py")
+    parser.add_argument("--corpus", default=str(BENCH_DIR / "corpus.json"), help="Query corpus")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the corpus (later passes hit warm caches)")
+    parser.add_argument("--stream", action="store_true", help="Ask for streamed (Server-Sent Events) answers")
+    parser.add_argument("--zabbix-ms", type=float, default=10, help="Stub Zabbix latency per HTTP request")
+    parser.add_argument("--tb-ms", type=float, default=10, help="Stub ThingsBoard latency per HTTP request")
+    parser.add_argument("--llm-ms", type=float, default=200, help="Stub LLM latency before the first byte")
+    parser.add_argument("--llm-chunk-ms", type=float, default=2, help="Stub LLM delay between streamed chunks")
+    parser.add_argument("--output", help="Write the per-query results and summaries to this JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the summaries as the new baselines")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25, help="Allowed relative latency increase")
+    parser.add_argument("--count-tolerance", type=float, default=0.05, help="Allowed relative increase of calls and tokens")
+    parser.add_argument("--worker", nargs=2, metavar=("APP", "RESULT"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+# ---- Statistics ----
+
+def percentile(values, q):
+    """Percentile `q` (0-100) of `values` with linear interpolation, 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def summarize(records):
+    """
+    Summarize per-query results.
+
+    Args:
+        records: Per-query results (see replay)
+
+    Returns:
+        dict: {"queries", "errors", "latency_ms", "upstream_per_query", "prompt_tokens_per_query"}
+    """
+    latencies = [record["latency_ms"] for record in records]
+    tokens = [record["prompt_tokens"] for record in records]
+    return {
+        "queries": len(records),
+        "errors": sum(1 for record in records if record["status"] >= 400),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "mean": round(mean(latencies), 1),
+            "max": round(max(latencies, default=0), 1)
+        },
+        "upstream_per_query": {
+            key: round(mean([record[key] for record in records]), 2)
+            for key in ("zabbix_calls", "zabbix_requests", "thingsboard_requests", "llm_calls")
+        },
+        "prompt_tokens_per_query": {
+            "mean": round(mean(tokens), 1),
+            "p95": round(percentile(tokens, 95), 1),
+            "max": max(tokens, default=0),
+            "answer_mean": round(mean([record["answer_prompt_tokens"] for record in records]), 1)
+        }
+    }
+
+
+def summarize_run(records):
+    """Summarize a whole run, overall and by query kind."""
+    summary = summarize(records)
+    kinds = sorted({record["kind"] for record in records})
+    summary["by_kind"] = {kind: summarize([record for record in records if record["kind"] == kind]) for kind in kinds}
+    return summary
+
+
+# ---- Worker (runs inside one app's process) ----
+
+def start_stubs(options):
+    """Start the stub servers and point the app configuration at them."""
+    sys.path.insert(0, str(BENCH_DIR))
+    from stubs import OpenAIStub, ThingsBoardStub, ZabbixStub
+
+    stubs = {
+        "zabbix": ZabbixStub(latency=options.zabbix_ms / 1000, now=BENCH_NOW).start(),
+        "thingsboard": ThingsBoardStub(latency=options.tb_ms / 1000).start(),
+        "openai": OpenAIStub(latency=options.llm_ms / 1000, chunk_delay=options.llm_chunk_ms / 1000).start()
+    }
+    os.environ.update({
+        "ZABBIX_URL": stubs["zabbix"].url + "/api_jsonrpc.php",
+        "ZABBIX_API_TOKEN": "bench",
+        "TB_URL": stubs["thingsboard"].url,
+        "TB_WS_URL": stubs["thingsboard"].ws_url,
+        "TB_USERNAME": "bench@example.com",
+        "TB_PASSWORD": "bench",
+        "OPENAI_API_TYPE": "azure",
+        "OPENAI_AZURE_ENDPOINT": stubs["openai"].url,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_API_VERSION": "2024-02-01",
+        "FLASK_SECRET_KEY": "bench",
+        "HISTORY_NOW": str(BENCH_NOW),
+        # The background snapshot would make call counts depend on timing
+        "FLEET_SNAPSHOT_INTERVAL": "0",
+        # Start every run on cold caches, not on answers left on disk by an earlier run
+        "CACHE_DIR": tempfile.mkdtemp(prefix="lucy-bench-cache-")
+    })
+    return stubs
+
+
+class AppClient:
+    """Drive the Flask or Quart test client of an app through one async interface."""
+
+    def __init__(self, module, server):
+        self.module = module
+        self.server = server
+        self._client = None
+        self._test_app = None
+
+    async def __aenter__(self):
+        if self.server == "asgi":
+            self._test_app = self.module.app.test_app()
+            await self._test_app.__aenter__()
+            self._client = self._test_app.test_client()
+        else:
+            self._client = self.module.app.test_client()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._test_app is not None:
+            await self._test_app.__aexit__(*exc_info)
+
+    async def get(self, path, query_string):
+        if self.server == "asgi":
+            response = await self._client.get(path, query_string=query_string)
+            return response.status_code, await response.get_data()
+        response = self._client.get(path, query_string=query_string)
+        return response.status_code, response.get_data()
+
+    async def post(self, path, body):
+        if self.server == "asgi":
+            response = await self._client.post(path, json=body)
+            return response.status_code, await response.get_data()
+        response = self._client.post(path, json=body)
+        return response.status_code, response.get_data()
+
+
+async def replay(app_name, options):
+    """
+    Replay the corpus of one app and return the per-query results.
+
+    Must run in the app's own process; see run_worker.
+    """
+    stubs = start_stubs(options)
+    corpus = json.loads(Path(options.corpus).read_text(encoding="utf-8"))[app_name]
+
+    app_dir = APP_DIRS[app_name]
+    os.chdir(app_dir)
+    sys.path.insert(0, str(app_dir))
+    module = __import__("asgi" if options.server == "asgi" else "app")
+    from prompt_encoding import estimate_tokens
+
+    # The apps log and print every prompt; keep the worker log readable
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if app_name == "nms":
+        dashboard_id = corpus["dashboard_id"]
+        hostids = stubs["zabbix"].devices(dashboard_id)
+    else:
+        dashboard_id = stubs["thingsboard"].dashboard_id
+        hostids = {}
+
+    records = []
+    async with AppClient(module, options.server) as client:
+        # Open the dashboard first, as a user would before chatting
+        status, _ = await client.get("/home", {"dashboard_id": dashboard_id})
+        if status != 200:
+            raise RuntimeError(f"GET /home returned {status}")
+
+        for repetition in range(options.repeat):
+            for entry in corpus["queries"]:
+                stubs["openai"].expect = {
+                    "need_data": entry.get("need_data", True),
+                    "hostid": hostids.get(entry.get("device")),
+                    "data": entry.get("data", ["metrics"])
+                }
+                before = {name: stub.counts() for name, stub in stubs.items()}
+
+                started = time.perf_counter()
+                status, body = await client.post("/home", {"query": entry["query"], "stream": options.stream})
+                latency = time.perf_counter() - started
+
+                after = {name: stub.counts() for name, stub in stubs.items()}
+                prompts = stubs["openai"].calls[before["openai"][1]:after["openai"][1]]
+                prompt_tokens = [
+                    sum(estimate_tokens(message["content"]) for message in prompt["messages"])
+                    for prompt in prompts
+                ]
+                records.append({
+                    "query": entry["query"],
+                    "kind": entry.get("kind", ""),
+                    "pass": repetition + 1,
+                    "status": status,
+                    "latency_ms": round(latency * 1000, 2),
+                    "zabbix_calls": after["zabbix"][1] - before["zabbix"][1],
+                    "zabbix_requests": after["zabbix"][0] - before["zabbix"][0],
+                    "thingsboard_requests": after["thingsboard"][0] - before["thingsboard"][0],
+                    "llm_calls": len(prompts),
+                    "prompt_tokens": sum(prompt_tokens),
+                    "answer_prompt_tokens": prompt_tokens[-1] if prompt_tokens else 0,
+                    "response_bytes": len(body)
+                })
+
+    for stub in stubs.values():
+        stub.stop()
+    return records
+
+
+def run_worker(options):
+    app_name, result_path = options.worker
+    records = asyncio.run(replay(app_name, options))
+    Path(result_path).write_text(json.dumps(records), encoding="utf-8")
+
+
+# ---- Baselines and reporting ----
+
+def lookup(summary, path):
+    value = summary
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(summary, baseline, options, check_latency=True):
+    """
+    Compare a summary with its baseline.
+
+    Latencies may grow by `latency_tolerance` (plus LATENCY_SLACK_MS); call counts,
+    prompt tokens and errors by `count_tolerance`, overall and for every query kind.
+
+    Args:
+        summary: The current summary (see summarize_run)
+        baseline: The baseline summary
+        options: Parsed command-line options
+        check_latency: Compare latencies too (only meaningful with the same stub settings)
+
+    Returns:
+        list: Descriptions of the regressions, empty if there are none
+    """
+    pairs = [("", summary, baseline)]
+    pairs.extend(
+        (f"{kind}: ", summary["by_kind"][kind], baseline.get("by_kind", {})[kind])
+        for kind in summary.get("by_kind", {}) if kind in baseline.get("by_kind", {})
+    )
+
+    regressions = []
+    for prefix, current, previous in pairs:
+        for path, kind in CHECKS:
+            # Per-kind latency percentiles over a handful of queries are too noisy to gate on
+            if kind == "latency" and (prefix or not check_latency):
+                continue
+            old, new = lookup(previous, path), lookup(current, path)
+            if old is None or new is None:
+                continue
+            if kind == "latency":
+                limit = old * (1 + options.latency_tolerance) + LATENCY_SLACK_MS
+            else:
+                limit = old * (1 + options.count_tolerance)
+            if new > limit:
+                regressions.append(f"{prefix}{path}: {old} -> {new}")
+    return regressions
+
+
+def stub_config(options):
+    return {
+        "repeat": options.repeat,
+        "stream": options.stream,
+        "zabbix_ms": options.zabbix_ms,
+        "tb_ms": options.tb_ms,
+        "llm_ms": options.llm_ms,
+        "llm_chunk_ms": options.llm_chunk_ms
+    }
+
+
+def report(name, summary):
+    latency = summary["latency_ms"]
+    upstream = summary["upstream_per_query"]
+    tokens = summary["prompt_tokens_per_query"]
+    print(f"{name}: {summary['queries']} queries, {summary['errors']} errors")
+    print(f"  latency ms   p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    print(
+        f"  per query    zabbix calls {upstream['zabbix_calls']} in {upstream['zabbix_requests']} requests, "
+        f"thingsboard requests {upstream['thingsboard_requests']}, llm calls {upstream['llm_calls']}"
+    )
+    print(f"  prompt tok   mean {tokens['mean']}  p95 {tokens['p95']}  max {tokens['max']}  answer mean {tokens['answer_mean']}")
+    print(f"  {'kind':<12}{'n':>4}{'p50 ms':>10}{'p95 ms':>10}{'zabbix':>8}{'tb':>6}{'llm':>6}{'tokens':>8}")
+    for kind, part in summary["by_kind"].items():
+        print(
+            f"  {kind:<12}{part['queries']:>4}{part['latency_ms']['p50']:>10}{part['latency_ms']['p95']:>10}"
+            f"{part['upstream_per_query']['zabbix_calls']:>8}{part['upstream_per_query']['thingsboard_requests']:>6}"
+            f"{part['upstream_per_query']['llm_calls']:>6}{part['prompt_tokens_per_query']['mean']:>8}"
+        )
+
+
+def run_app(app_name, options, workdir):
+    """Replay one app in a child process and return its per-query results."""
+    result_path = Path(workdir) / f"{app_name}.json"
+    log_path = Path(workdir) / f"{app_name}.log"
+    # The child runs from the app directory
+    argv = [*sys.argv[1:], "--corpus", str(Path(options.corpus).resolve())]
+    with open(log_path, "w", encoding="utf-8") as log:
+        completed = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), *argv, "--worker", app_name, str(result_path)],
+            cwd=APP_DIRS[app_name], stdout=log, stderr=subprocess.STDOUT
+        )
+    if completed.returncode != 0:
+        print(log_path.read_text(encoding="utf-8")[-4000:], file=sys.stderr)
+        raise RuntimeError(f"{app_name} replay failed with exit code {completed.returncode}")
+    return json.loads(result_path.read_text(encoding="utf-8"))
+
+
+def main():
+    options = parse_args()
+    if options.worker:
+        run_worker(options)
+        return 0
+
+    output = {}
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="lucy-bench-") as workdir:
+        for app_name in options.apps:
+            name = f"{app_name}-{options.server}"
+            try:
+                records = run_app(app_name, options, workdir)
+            except RuntimeError as e:
+                print(e, file=sys.stderr)
+                return 2
+
+            summary = summarize_run(records)
+            output[name] = {"config": stub_config(options), "summary": summary, "results": records}
+            report(name, summary)
+
+            baseline_path = BASELINE_DIR / f"{name}.json"
+            if options.save_baseline:
+                BASELINE_DIR.mkdir(exist_ok=True)
+                baseline_path.write_text(
+                    json.dumps({"config": stub_config(options), "summary": summary}, indent=2) + "\n",
+                    encoding="utf-8"
+                )
+                print(f"  baseline saved to {baseline_path.relative_to(REPO_DIR)}")
+            elif baseline_path.exists():
+                baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+                same_config = baseline.get("config") == stub_config(options)
+                if not same_config:
+                    print("  note: stub settings differ from the baseline's; latencies are not compared")
+                regressions = compare(summary, baseline["summary"], options, check_latency=same_config)
+                for regression in regressions:
+                    print(f"  REGRESSION {regression}")
+                if not regressions:
+                    print("  no regressions against the baseline")
+                failed = failed or bool(regressions)
+            else:
+                print("  no baseline (run with --save-baseline to record one)")
+            print()
+
+    if options.output:
+        Path(options.output).write_text(json.dumps(output, indent=2) + "\n", encoding="utf-8")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
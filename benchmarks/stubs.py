@@ -0,0 +1,667 @@
+import base64
+import json
+import math
+import re
+import socket
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from websockets.sync.server import serve as serve_websocket
+
+# ------------------ Stub Upstream Servers ------------------
+# Local stand-ins for Zabbix, ThingsBoard and OpenAI. Each one serves a fixed,
+# generated fleet, waits a configurable latency before every response and logs
+# the calls it receives, so a replay measures the apps and not the network.
+
+# Device pages of every stub Zabbix dashboard, named like the real infrastructures
+NMS_DEVICES = ["VSAT", "UPS", "VOIP VSAT", "OneICTbox", "BE6K", "OpenDNS", "MSS-3", "AnyConnect-VPN"]
+NMS_WIDGET_TYPES = ["graph", "problems", "item", "plaintext"]
+
+# Items every stub host has, as (name, key, units, base value); the rest are numbered fillers
+NMS_ITEMS = [
+    ("ICMP ping", "icmpping", "", 1),
+    ("ICMP loss", "icmppingloss", "%", 0.5),
+    ("ICMP response time", "icmppingsec", "s", 0.25),
+    ("CPU utilization", "system.cpu.util", "%", 35),
+    ("Memory utilization", "vm.memory.util", "%", 60),
+    ("Interface eth0: Bits received", "net.if.in[eth0]", "bps", 2.5e6),
+    ("Interface eth0: Bits sent", "net.if.out[eth0]", "bps", 1.2e6),
+    ("Battery capacity", "ups.battery.capacity", "%", 98),
+    ("Input voltage", "ups.input.voltage", "V", 229),
+    ("Uptime", "system.uptime", "s", 864000)
+]
+
+# ThingsBoard device types and the room or place their titles name
+TB_DEVICES = [
+    ("Door Sensor", "Main Door", ["open", "battery"]),
+    ("Temperature Sensor", "Server Room", ["temperature", "humidity", "battery"]),
+    ("Smart Meter", "Main Meter", ["power", "energy", "voltage"]),
+    ("Water Leak Sensor", "Kitchen", ["leak", "battery"]),
+    ("Motion Sensor", "Hall", ["occupancy", "battery"]),
+    ("Air Quality Sensor", "Meeting Room", ["co2", "pm25", "temperature", "humidity"])
+]
+
+# Default answer of the stub LLM (about 60 tokens)
+ANSWER_TEXT = (
+    "The device is online and its recent readings are within the expected range. "
+    "Response time averaged 0.25 seconds with no packet loss, and there are no open "
+    "problems that need attention. Keep monitoring the link during peak hours."
+)
+
+
+def uuid_for(kind, index):
+    """Deterministic UUID-shaped ID for a stub ThingsBoard entity."""
+    return f"{kind:08x}-0000-4000-8000-{index:012x}"
+
+
+class StubServer:
+    """
+    Threaded HTTP server that logs calls and delays every response.
+
+    Args:
+        latency: Seconds to wait before answering each HTTP request
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        """Start serving on a free local port in a background thread."""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; do not let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._dispatch(self, "GET", None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"null")
+                stub._dispatch(self, "POST", body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def counts(self):
+        """
+        Snapshot of the call counters.
+
+        Returns:
+            tuple: (HTTP requests served, API calls logged)
+        """
+        with self._lock:
+            return self.requests, len(self.calls)
+
+    def log(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def _dispatch(self, handler, method, body):
+        try:
+            self._respond(handler, method, body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped waiting (a timeout or an exceeded deadline)
+            pass
+
+    def _respond(self, handler, method, body):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        parsed = urllib.parse.urlparse(handler.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        status, payload = self.handle(method, parsed.path, query, body)
+        if callable(payload):
+            payload(handler)
+            return
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def handle(self, method, path, query, body):
+        """Answer one request; returns (status, JSON payload or a callable writing the response)."""
+        raise NotImplementedError
+
+
+class ZabbixStub(StubServer):
+    """
+    Zabbix JSON-RPC stub: dashboard.get, host.get, problem.get, item.get, history.get and trend.get.
+
+    Every dashboard ID has one page per NMS_DEVICES entry. The host behind the UPS
+    page is unavailable, and every third host has open problems.
+
+    Args:
+        latency: Seconds to wait before answering each HTTP request (one batch is one request)
+        items_per_host: Items on every host
+        now: Unix time of the latest item values and problems (the app's HISTORY_NOW)
+    """
+
+    def __init__(self, latency=0.0, items_per_host=40, now=1700000000):
+        super().__init__(latency)
+        self.items_per_host = items_per_host
+        self.now = now
+
+    @staticmethod
+    def hostid(dashboard_id, index):
+        return f"{dashboard_id}{index + 1:02d}"
+
+    def devices(self, dashboard_id):
+        """Device page names mapped to host IDs for a dashboard."""
+        return {name: self.hostid(dashboard_id, index) for index, name in enumerate(NMS_DEVICES)}
+
+    def handle(self, method, path, query, body):
+        if isinstance(body, list):
+            return 200, [self.call(request) for request in body]
+        return 200, self.call(body)
+
+    def call(self, request):
+        method, params = request["method"], request.get("params") or {}
+        self.log(method)
+        handler = getattr(self, "_" + method.replace(".", "_"), None)
+        if handler is None:
+            return {"jsonrpc": "2.0", "error": {"code": -32601, "message": "Method not found.", "data": method}, "id": request["id"]}
+        return {"jsonrpc": "2.0", "result": handler(params), "id": request["id"]}
+
+    def _dashboard_get(self, params):
+        return [
+            {
+                "dashboardid": str(dashboard_id),
+                "name": f"Dashboard {dashboard_id}",
+                "pages": [
+                    {
+                        "name": name,
+                        "widgets": [{
+                            "type": NMS_WIDGET_TYPES[index % len(NMS_WIDGET_TYPES)],
+                            "fields": [{"name": "hostid.0", "value": hostid}]
+                        }]
+                    }
+                    for index, (name, hostid) in enumerate(self.devices(dashboard_id).items())
+                ]
+            }
+            for dashboard_id in params.get("dashboardids", [])
+        ]
+
+    def _host_get(self, params):
+        hostids = params.get("hostids") or []
+        hostids = hostids if isinstance(hostids, list) else [hostids]
+        return [self._host(str(hostid), params) for hostid in hostids]
+
+    def _host(self, hostid, params):
+        index = int(hostid[-2:]) - 1
+        name = NMS_DEVICES[index % len(NMS_DEVICES)]
+        host = {
+            "hostid": hostid,
+            "host": f"{name.lower().replace(' ', '-')}-{hostid}",
+            "name": f"{name} {hostid}",
+            "description": f"{name} at site {hostid[:-2]}"
+        }
+        if "selectInventory" in params:
+            host["inventory"] = {"name": name, "model": "Model X", "location": f"Site {hostid[:-2]}", "notes": ""}
+        if "selectItems" in params:
+            host["items"] = self._items(hostid)
+        if "selectTriggers" in params:
+            host["triggers"] = [{"triggerid": f"{hostid}1"}, {"triggerid": f"{hostid}2"}]
+        if "selectInterfaces" in params:
+            host["interfaces"] = [{"available": "2" if name == "UPS" else "1"}]
+        return host
+
+    def _items(self, hostid):
+        items = []
+        for index in range(self.items_per_host):
+            if index < len(NMS_ITEMS):
+                name, key, units, base = NMS_ITEMS[index]
+            else:
+                name, key, units, base = f"Sensor {index}", f"sensor.{index}", "", index
+            items.append({
+                "itemid": f"{hostid}{index:03d}",
+                "name": name,
+                "name_resolved": name,
+                "key_": key,
+                "description": "" if index % 2 else f"{name} measured by the agent",
+                "lastvalue": str(base),
+                "lastclock": str(self.now),
+                "units": units,
+                "value_type": "0"
+            })
+        return items
+
+    def _problem_get(self, params):
+        problems = []
+        for hostid in params.get("hostids") or []:
+            hostid = str(hostid)
+            index = int(hostid[-2:]) - 1
+            if NMS_DEVICES[index % len(NMS_DEVICES)] == "UPS":
+                names = ["Unavailable by ICMP ping"]
+            elif index % 3 == 0:
+                names = ["High ICMP ping response time", "High CPU utilization"]
+            else:
+                continue
+            for number, name in enumerate(names, 1):
+                problems.append({
+                    "eventid": f"{hostid}{number}",
+                    "objectid": f"{hostid}{number}",
+                    "name": name,
+                    "severity": "4" if name.startswith("Unavailable") else "3",
+                    "clock": str(self.now),
+                    "acknowledged": "0",
+                    "acknowledges": []
+                })
+        return problems
+
+    def _item_get(self, params):
+        return []
+
+    def _history_get(self, params):
+        # Incremental snapshot refreshes ask for new values only
+        if "time_till" not in params:
+            return []
+        return [
+            {"itemid": itemid, "clock": str(clock), "value": str(self._value(itemid, clock))}
+            for itemid in params.get("itemids", [])
+            for clock in range(int(params["time_from"]), int(params["time_till"]), 60)
+        ]
+
+    def _trend_get(self, params):
+        return [
+            {
+                "itemid": itemid,
+                "clock": str(clock),
+                "num": "60",
+                "value_min": str(self._value(itemid, clock) * 0.8),
+                "value_avg": str(self._value(itemid, clock)),
+                "value_max": str(self._value(itemid, clock) * 1.2)
+            }
+            for itemid in params.get("itemids", [])
+            for clock in range(int(params["time_from"]), int(params["time_till"]), 3600)
+        ]
+
+    @staticmethod
+    def _value(itemid, clock):
+        # A daily cycle around a per-item level
+        level = 10 + int(itemid[-3:]) % 50
+        return round(level * (1 + 0.2 * math.sin(clock / 13751)), 4)
+
+
+class ThingsBoardStub(StubServer):
+    """
+    ThingsBoard REST stub: login, token refresh, dashboards, devices, attributes, latest telemetry,
+    entity data queries and alarm data queries, plus the telemetry WebSocket API on `ws_url`.
+
+    Serves one site dashboard with `devices` devices and `alarms` alarms spread
+    over them, half of them active. `push` sends a telemetry update to the
+    WebSocket subscribers of a device and `drop_websockets` closes their
+    connections.
+
+    Args:
+        latency: Seconds to wait before answering each HTTP request
+        devices: Devices on the site dashboard
+        alarms: Alarms in the tenant
+        token_ttl: Seconds until the tokens it issues expire
+    """
+
+    def __init__(self, latency=0.0, devices=12, alarms=60, token_ttl=9000):
+        super().__init__(latency)
+        self.token_ttl = token_ttl
+        self.dashboard_id = uuid_for(1, 1)
+        self.devices = {}
+        for index in range(devices):
+            device_type, place, keys = TB_DEVICES[index % len(TB_DEVICES)]
+            number = index // len(TB_DEVICES)
+            self.devices[uuid_for(2, index + 1)] = {
+                "name": f"{device_type.split()[0].upper()}-{index + 1:03d}",
+                "type": device_type,
+                "title": place if number == 0 else f"{place} {number + 1}",
+                "keys": keys,
+                "index": index
+            }
+        self.alarms = [self._alarm(index) for index in range(alarms)]
+        self._websocket_server = None
+        # Open WebSocket connections -> {command ID: (device ID, "tsSubCmds" or "attrSubCmds")}
+        self._websockets = {}
+
+    @property
+    def ws_url(self):
+        return f"ws://127.0.0.1:{self._websocket_server.socket.getsockname()[1]}/api/ws/plugins/telemetry"
+
+    def start(self):
+        """Start the REST server and the telemetry WebSocket server."""
+        super().start()
+        self._websocket_server = serve_websocket(self._serve_websocket, "127.0.0.1", 0)
+        threading.Thread(target=self._websocket_server.serve_forever, name="ThingsBoardStubWS", daemon=True).start()
+        return self
+
+    def stop(self):
+        super().stop()
+        if self._websocket_server is not None:
+            self._websocket_server.shutdown()
+
+    def push(self, device_id, key, value, ts=None):
+        """Send a new telemetry value to every WebSocket subscriber of a device."""
+        ts = ts or int(time.time() * 1000)
+        with self._lock:
+            subscribers = [
+                (connection, command_id) for connection, commands in self._websockets.items()
+                for command_id, (subscribed, kind) in commands.items() if subscribed == device_id and kind == "tsSubCmds"
+            ]
+        for connection, command_id in subscribers:
+            connection.send(json.dumps({"subscriptionId": command_id, "errorCode": 0, "data": {key: [[ts, str(value)]]}}))
+
+    def drop_websockets(self):
+        """Close every WebSocket connection, as a ThingsBoard restart would."""
+        with self._lock:
+            connections = list(self._websockets)
+        for connection in connections:
+            connection.close()
+
+    def titles(self):
+        """Device titles mapped to device IDs."""
+        return {device["title"]: device_id for device_id, device in self.devices.items()}
+
+    def handle(self, method, path, query, body):
+        self.log(f"{method} " + re.sub(r"[0-9a-f]{8}-[0-9a-f-]{27}", "{id}", path))
+
+        if method == "POST" and path in ("/api/auth/login", "/api/auth/token"):
+            return 200, {"token": self._token(self.token_ttl), "refreshToken": "bench-refresh"}
+        if method == "GET" and path == "/api/user/dashboards":
+            return 200, self._page([{
+                "id": {"id": self.dashboard_id, "entityType": "DASHBOARD"},
+                "title": "Bench Site", "name": "Bench Site", "createdTime": 0
+            }], query)
+        if method == "GET" and (match := re.fullmatch(r"/api/dashboard/([^/]+)", path)):
+            return 200, self._dashboard(match.group(1))
+        if method == "GET" and (match := re.fullmatch(r"/api/device/([^/]+)", path)):
+            return self._device(match.group(1))
+        if method == "GET" and (match := re.fullmatch(r"/api/plugins/telemetry/DEVICE/([^/]+)/values/timeseries", path)):
+            return 200, self._latest(match.group(1))
+        if method == "GET" and (match := re.fullmatch(r"/api/plugins/telemetry/DEVICE/([^/]+)/values/attributes", path)):
+            device = self.devices.get(match.group(1))
+            return 200, [{"key": "title", "value": device["title"], "lastUpdateTs": 0}] if device else []
+        if method == "GET" and path == "/api/alarms":
+            return 200, self._page(self.alarms, query)
+        if method == "POST" and path == "/api/entitiesQuery/find/keys":
+            devices = [self.devices[device_id] for device_id in self._entity_ids(body)]
+            keys = sorted({key for device in devices for key in device["keys"]}) if query.get("timeseries", "").lower() == "true" else []
+            return 200, {"timeseries": keys, "attribute": []}
+        if method == "POST" and path == "/api/entitiesQuery/find":
+            return 200, self._entity_data(body)
+        if method == "POST" and path == "/api/alarmsQuery/find":
+            return 200, self._alarm_data(body)
+        return 404, {"status": 404, "message": f"Not found: {method} {path}"}
+
+    def _serve_websocket(self, connection):
+        if not connection.request.path.startswith("/api/ws/plugins/telemetry?token="):
+            connection.close(1008, "Unauthorized")
+            return
+        with self._lock:
+            self._websockets[connection] = {}
+        try:
+            for message in connection:
+                commands = json.loads(message)
+                for kind in ("tsSubCmds", "attrSubCmds"):
+                    for command in commands.get(kind, []):
+                        self.log(f"WS {kind} {'unsubscribe' if command.get('unsubscribe') else 'subscribe'}")
+                        with self._lock:
+                            if command.get("unsubscribe"):
+                                self._websockets[connection].pop(command["cmdId"], None)
+                                continue
+                            self._websockets[connection][command["cmdId"]] = (command["entityId"], kind)
+                        connection.send(json.dumps(self._subscription_data(command, kind)))
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._websockets.pop(connection, None)
+
+    def _subscription_data(self, command, kind):
+        device = self.devices.get(command["entityId"])
+        if device is None:
+            return {"subscriptionId": command["cmdId"], "errorCode": 2, "errorMsg": "Device not found", "data": {}}
+        if kind == "attrSubCmds":
+            data = {"title": [[1700000000000, device["title"]]]}
+        else:
+            data = {key: [[1700000000000, str(self._reading(key, device["index"]))]] for key in device["keys"]}
+        return {"subscriptionId": command["cmdId"], "errorCode": 0, "errorMsg": None, "data": data}
+
+    @staticmethod
+    def _token(ttl):
+        def encode(part):
+            return base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b"=").decode()
+        payload = {"sub": "bench@example.com", "exp": int(time.time()) + ttl}
+        return f"{encode({'alg': 'HS512'})}.{encode(payload)}.c2lnbmF0dXJl"
+
+    @staticmethod
+    def _page(data, query):
+        size = int(query.get("pageSize", len(data) or 1))
+        page = int(query.get("page", 0))
+        return {
+            "data": data[page * size:(page + 1) * size],
+            "totalPages": (len(data) + size - 1) // size,
+            "totalElements": len(data),
+            "hasNext": (page + 1) * size < len(data)
+        }
+
+    def _dashboard(self, dashboard_id):
+        aliases = {
+            f"alias-{device['index']}": {
+                "id": f"alias-{device['index']}",
+                "alias": device["title"],
+                "filter": {"type": "singleEntity", "singleEntity": {"entityType": "DEVICE", "id": device_id}}
+            }
+            for device_id, device in self.devices.items()
+        }
+        return {
+            "id": {"id": dashboard_id, "entityType": "DASHBOARD"},
+            "title": "Bench Site",
+            "name": "Bench Site",
+            "createdTime": 0,
+            "configuration": {"entityAliases": aliases}
+        }
+
+    def _device(self, device_id):
+        device = self.devices.get(device_id)
+        if device is None:
+            return 404, {"status": 404, "message": "Requested item wasn't found!"}
+        return 200, {
+            "id": {"id": device_id, "entityType": "DEVICE"},
+            "name": device["name"],
+            "type": device["type"],
+            "label": device["title"],
+            "createdTime": 0,
+            "deviceProfileId": {"id": uuid_for(3, 1), "entityType": "DEVICE_PROFILE"}
+        }
+
+    def _latest(self, device_id):
+        device = self.devices.get(device_id)
+        if device is None:
+            return {}
+        return {
+            key: [{"ts": 1700000000000, "value": str(self._reading(key, device["index"]))}]
+            for key in device["keys"]
+        }
+
+    def _entity_ids(self, body):
+        return [device_id for device_id in body["entityFilter"].get("entityList", []) if device_id in self.devices]
+
+    def _entity_data(self, body):
+        data = []
+        for device_id in self._entity_ids(body):
+            device = self.devices[device_id]
+            latest = {
+                "ENTITY_FIELD": {
+                    key["key"]: {"ts": 0, "value": str(device.get(key["key"], ""))} for key in body.get("entityFields", [])
+                },
+                "ATTRIBUTE": {},
+                "TIME_SERIES": {}
+            }
+            for key in body.get("latestValues", []):
+                if key["type"] == "ATTRIBUTE":
+                    value = device["title"] if key["key"] == "title" else ""
+                    latest["ATTRIBUTE"][key["key"]] = {"ts": 1700000000000 if value else 0, "value": value}
+                elif key["key"] in device["keys"]:
+                    value = str(self._reading(key["key"], device["index"]))
+                    latest["TIME_SERIES"][key["key"]] = {"ts": 1700000000000, "value": value}
+                else:
+                    latest["TIME_SERIES"][key["key"]] = {"ts": 0, "value": ""}
+            data.append({"entityId": {"id": device_id, "entityType": "DEVICE"}, "latest": latest, "timeseries": {}})
+        page_link = body.get("pageLink", {})
+        return self._page(data, {"pageSize": page_link.get("pageSize", 10), "page": page_link.get("page", 0)})
+
+    def _alarm_data(self, body):
+        # As in ThingsBoard, every status in the list must match: ACTIVE and UNACK is ACTIVE_UNACK
+        device_ids = set(self._entity_ids(body))
+        page_link = body.get("pageLink", {})
+        statuses = set(page_link.get("statusList") or ["ANY"])
+        checks = {
+            "ACTIVE": lambda alarm: not alarm["cleared"], "CLEARED": lambda alarm: alarm["cleared"],
+            "ACK": lambda alarm: alarm["acknowledged"], "UNACK": lambda alarm: not alarm["acknowledged"]
+        }
+        data = [
+            dict(alarm, entityId=alarm["originator"], latest={})
+            for alarm in self.alarms
+            if alarm["originator"]["id"] in device_ids
+            and ("ANY" in statuses or all(checks[status](alarm) for status in statuses))
+        ]
+        if page_link.get("sortOrder", {}).get("key", {}).get("key") == "createdTime":
+            data.sort(key=lambda alarm: alarm["createdTime"], reverse=page_link["sortOrder"].get("direction") == "DESC")
+        return self._page(data, {"pageSize": page_link.get("pageSize", 10), "page": page_link.get("page", 0)})
+
+    @staticmethod
+    def _reading(key, index):
+        readings = {
+            "open": "false", "battery": 97 - index, "temperature": 21.5 + index * 0.37,
+            "humidity": 41.25 + index, "power": 1234.5, "energy": 98231.7, "voltage": 229.4,
+            "leak": "false", "occupancy": index % 2 == 0, "co2": 612, "pm25": 8.4
+        }
+        return readings.get(key, 0)
+
+    def _alarm(self, index):
+        device_ids = list(self.devices)
+        device_id = device_ids[index % len(device_ids)] if device_ids else uuid_for(2, 0)
+        device = self.devices.get(device_id, {"name": "", "title": ""})
+        active = index % 2 == 0
+        name = ["High Temperature", "Low Battery", "Door Open Too Long", "Water Leak"][index % 4]
+        return {
+            "id": {"id": uuid_for(4, index + 1), "entityType": "ALARM"},
+            "createdTime": 1700000000000 + index * 60000,
+            "name": name,
+            "type": name,
+            "severity": ["CRITICAL", "MAJOR", "MINOR", "WARNING"][index % 4],
+            "status": "ACTIVE_UNACK" if active else "CLEARED_ACK",
+            "acknowledged": not active,
+            "cleared": not active,
+            "originator": {"id": device_id, "entityType": "DEVICE"},
+            "originatorName": device["name"],
+            "originatorLabel": device["title"]
+        }
+
+
+class OpenAIStub(StubServer):
+    """
+    OpenAI-compatible chat completions stub (plain and Azure deployment paths).
+
+    Routing prompts are answered from `expect`, the expected routing of the
+    query being replayed; every other prompt gets ANSWER_TEXT. Streamed
+    answers are sent a few words per chunk.
+
+    Args:
+        latency: Seconds to wait before the first byte of each completion
+        chunk_delay: Seconds between streamed chunks
+    """
+
+    def __init__(self, latency=0.0, chunk_delay=0.0):
+        super().__init__(latency)
+        self.chunk_delay = chunk_delay
+        self.expect = {}
+
+    def handle(self, method, path, query, body):
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, {"error": {"message": f"Not found: {method} {path}"}}
+
+        self.log(body)
+        text = self.respond(body["messages"])
+        usage = {
+            "prompt_tokens": sum(len(message["content"]) // 4 for message in body["messages"]),
+            "completion_tokens": len(text) // 4
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if body.get("stream"):
+            return 200, lambda handler: self._stream(handler, text, usage)
+        return 200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    def respond(self, messages):
+        """Answer a conversation the way the apps' prompts expect."""
+        prompt = messages[-1]["content"]
+        need_data = self.expect.get("need_data", True)
+        hostid = self.expect.get("hostid") or "-1"
+
+        if '"need_nms"' in prompt:
+            return json.dumps({"need_nms": need_data, "hostid": hostid, "data": self.expect.get("data", ["metrics"])})
+        if "Return ONLY the HostID" in prompt:
+            return hostid
+        if "ONLY 'YES'" in prompt:
+            return "YES" if need_data else "NO"
+        return ANSWER_TEXT
+
+    def _stream(self, handler, text, usage):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def write(payload):
+            data = f"data: {payload}\n\n".encode()
+            handler.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            handler.wfile.flush()
+
+        words = text.split(" ")
+        for start in range(0, len(words), 3):
+            piece = " ".join(words[start:start + 3]) + ("" if start + 3 >= len(words) else " ")
+            write(json.dumps({
+                "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+            }))
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+        write(json.dumps({
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage
+        }))
+        write("[DONE]")
+        handler.wfile.write(b"0\r\n\r\n")
@@ -1,11 +1,30 @@
+import hashlib
+import itertools
 import json
 import logging
 import os
-from flask import Flask, jsonify, request, render_template, session
+import tempfile
+from flask import Flask, Response, g, jsonify, request, render_template, session, stream_with_context
 from tb_rest_client.rest_client_pe import *
+from tb_rest_client.rest import ApiException
 import re
 import openai
 from dotenv import load_dotenv
+from rapidfuzz import fuzz, process
+from cache import LastGoodData, TieredCache
+from instrumentation import (
+    CONTENT_TYPE, Collector, Counter, install_request_id_logging, register_cache, render, timed
+)
+from pipeline import run_steps, upstream
+from prompt_encoding import encode_rows, format_value
+from resilience import CircuitBreaker, call_with_timeout, register_breakers, stage_deadline, stage_timeout
+from serving import (
+    SSE_HEADERS, answer_events, answer_payload, chat_request, complete, register_request_hooks, stream_completion,
+    wants_stream
+)
+from singleflight import SingleFlight, flight_key
+from telemetry_stream import TelemetryStore
+from thingsboard_client import ThingsBoardSession
 
 # 
 load_dotenv()
@@ -19,30 +38,267 @@ openai.api_version = os.getenv('OPENAI_API_VERSION')
 
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s'
 )
+install_request_id_logging()
 
 
 TB_URL = os.getenv('TB_URL')
 USERNAME = os.getenv('TB_USERNAME')
 PASSWORD = os.getenv('TB_PASSWORD')
 
+# Circuit breakers: consecutive failures that open an upstream's circuit, and
+# the seconds before a trial call is let through again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+TB_BREAKER = CircuitBreaker("thingsboard", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+OPENAI_BREAKER = CircuitBreaker("openai", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+register_breakers(TB_BREAKER, OPENAI_BREAKER)
+
+# Latency budget of a request, the part of it each ThingsBoard stage (site
+# structure, then readings and alarms) may use, the longest single ThingsBoard
+# call, and the longest time an answer or a routing decision may wait for OpenAI
+REQUEST_BUDGET = float(os.getenv('REQUEST_BUDGET', 30))
+TB_STAGE_BUDGET = float(os.getenv('TB_STAGE_BUDGET', 10))
+TB_TIMEOUT = float(os.getenv('TB_TIMEOUT', 5))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 20))
+OPENAI_ROUTING_TIMEOUT = float(os.getenv('OPENAI_ROUTING_TIMEOUT', 8))
+
+# Process-wide ThingsBoard client, logged in once and renewed `TB_TOKEN_REFRESH_MARGIN`
+# seconds before its token expires (see ThingsBoardSession)
+TB_SESSION = ThingsBoardSession(
+    TB_URL,
+    USERNAME,
+    PASSWORD,
+    pool_size=int(os.getenv('TB_POOL_SIZE', 10)),
+    refresh_margin=float(os.getenv('TB_TOKEN_REFRESH_MARGIN', 300)),
+    timeout=TB_TIMEOUT,
+    breaker=TB_BREAKER
+)
+
+# Latest readings of the devices on opened dashboards, pushed by ThingsBoard's
+# WebSocket API (see dashboard_devices). TB_WS_URL defaults to the telemetry
+# endpoint on TB_URL; TB_TELEMETRY_STREAM=0 polls REST on every question instead.
+TELEMETRY_STORE = TelemetryStore(
+    os.getenv('TB_WS_URL') or re.sub(r'^http', 'ws', (TB_URL or '').rstrip('/')) + '/api/ws/plugins/telemetry',
+    lambda: TB_SESSION.client().get_token(),
+    max_reconnect_delay=float(os.getenv('TB_STREAM_MAX_RECONNECT_DELAY', 60)),
+    idle_timeout=float(os.getenv('TB_STREAM_IDLE_TIMEOUT', 3600)),
+    open_timeout=TB_TIMEOUT
+) if os.getenv('TB_TELEMETRY_STREAM', '1') == '1' else None
+if TELEMETRY_STORE is not None:
+    Collector(
+        "lucy_telemetry_stream_devices", "Devices watched by the telemetry stream, by whether their data is live.",
+        "gauge", ("live",), lambda: {
+            ("true",): TELEMETRY_STORE.stats()["live"],
+            ("false",): TELEMETRY_STORE.stats()["devices"] - TELEMETRY_STORE.stats()["live"]
+        }
+    )
+    Collector(
+        "lucy_telemetry_stream_connected", "Whether the telemetry WebSocket is connected.",
+        "gauge", (), lambda: {(): int(TELEMETRY_STORE.stats()["connected"])}
+    )
+
+# Devices per entity data query page (see fetch_devices)
+ENTITY_PAGE_SIZE = int(os.getenv('TB_ENTITY_PAGE_SIZE', 100))
+
+# Alarms put in the prompt: ThingsBoard status filters separated by ";". The
+# statuses within a filter must all match (e.g. "CLEARED,UNACK"), and an alarm
+# matching any filter is included. The default keeps active alarms and cleared
+# ones nobody has acknowledged yet.
+ALARM_STATUS_FILTERS = [
+    [status.strip().upper() for status in group.split(',') if status.strip()]
+    for group in os.getenv('TB_ALARM_STATUS_FILTERS', 'ACTIVE;CLEARED,UNACK').split(';') if group.strip()
+]
+# Alarms per alarm data query page, and the most alarms read per dashboard (see iter_alarms)
+ALARM_PAGE_SIZE = int(os.getenv('TB_ALARM_PAGE_SIZE', 100))
+ALARM_MAX_ROWS = int(os.getenv('TB_ALARM_MAX_ROWS', 500))
+
+# Token budgets for the device and alarm tables in the analysis prompt
+DEVICE_TOKEN_BUDGET = int(os.getenv('TB_DEVICE_TOKEN_BUDGET', 1500))
+ALARM_TOKEN_BUDGET = int(os.getenv('TB_ALARM_TOKEN_BUDGET', 800))
+
+# Prompt table columns: (field, header)
+DEVICE_COLUMNS = [("label", "Label"), ("device", "Device"), ("type", "Device Type"), ("readings", "Readings")]
+ALARM_COLUMNS = [
+    ("name", "Alarm"), ("type", "Type"), ("severity", "Severity"), ("status", "Status"),
+    ("originator", "Originator"), ("originator_label", "Originator Label"), ("entity_type", "Entity Type")
+]
+
+# Site-wide questions get one row per device type instead of one per device
+DEVICE_SUMMARY_COLUMNS = [("type", "Device Type"), ("count", "Devices"), ("labels", "Labels"), ("readings", "Readings")]
+
+# Device selection (see select_devices): minimum fuzzy score for a device to
+# match the query, words too generic to pick out a device, and query words
+# standing for the device types and readings they name
+DEVICE_MATCH_THRESHOLD = float(os.getenv('DEVICE_MATCH_THRESHOLD', 85))
+GENERIC_DEVICE_WORDS = {"sensor", "device", "main", "smart", "room", "unit", "the"}
+DEVICE_SYNONYMS = {
+    "temperature": ["temp", "warm", "hot", "cold", "heat", "thermostat"],
+    "humidity": ["humid", "moisture", "damp"],
+    "door": ["entrance", "entry", "gate"],
+    "leak": ["flood", "flooding", "leaking", "wet"],
+    "power": ["electricity", "consumption", "kwh", "watt"],
+    "motion": ["occupied", "presence", "movement", "people"],
+    "air": ["pollution", "ventilation"],
+    "battery": ["charge", "batteries"]
+}
+SYNONYM_TERMS = {word: term for term, words in DEVICE_SYNONYMS.items() for word in words}
+ORDINALS = {"first": "1", "second": "2", "third": "3", "fourth": "4", "fifth": "5"}
+
+# Directory of the cache tier shared by all worker processes on this host
+# (empty keeps every cache in-process), and the longest time a worker serves
+# an entry from memory before reading the shared tier again
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'lucy-iot-cache'))
+CACHE_LOCAL_TTL = float(os.getenv('CACHE_LOCAL_TTL', 60))
+
+# ThingsBoard dashboards (as dictionaries), keyed on the dashboard ID
+DASHBOARD_CACHE = TieredCache(
+    "dashboards",
+    ttl=float(os.getenv('TB_DASHBOARD_CACHE_TTL', 900)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+
+# Device titles and types of each dashboard (see site_info)
+DEVICE_CACHE = TieredCache(
+    "devices",
+    ttl=float(os.getenv('TB_DEVICE_CACHE_TTL', 300)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+
+# Alarm rows of each dashboard's devices, kept briefly (see get_alarm_information)
+ALARM_CACHE = TieredCache(
+    "alarms",
+    ttl=float(os.getenv('TB_ALARM_CACHE_TTL', 30)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+
+# Final answers keyed on the normalized query, dashboard and the device and alarm data in the prompt
+ANSWER_CACHE = TieredCache(
+    "answers",
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 300)),
+    maxsize=int(os.getenv('ANSWER_CACHE_SIZE', 512)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+
+# Last dashboard, device map and site data fetched for each dashboard, served
+# (marked stale) when a fresh fetch fails or misses its deadline
+LAST_GOOD_CACHE = TieredCache(
+    "last_good",
+    ttl=float(os.getenv('STALE_DATA_TTL', 24 * 3600)),
+    maxsize=int(os.getenv('STALE_DATA_SIZE', 1024)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+LAST_GOOD = LastGoodData(LAST_GOOD_CACHE)
+
+# Concurrent identical ThingsBoard reads share one request (see tb_fetch)
+TB_FLIGHT = SingleFlight("thingsboard")
+
+# Cache hit/miss counters on /metrics
+register_cache("alarm", ALARM_CACHE)
+register_cache("answer", ANSWER_CACHE)
+register_cache("dashboard", DASHBOARD_CACHE)
+register_cache("device", DEVICE_CACHE)
+register_cache("last_good", LAST_GOOD_CACHE)
+
+# Failed or late fetches answered with the last good data instead
+STALE_DATA = Counter("lucy_stale_data_total", "Fetches answered with the last good data, by kind.", ("kind",))
+
+# System messages for general answers and ThingsBoard analysis
+GENERAL_SYSTEM_CONTENT = "You are a LUCY, a helpful assistant for IoT (Internet of Things) monitoring."
+ANALYSIS_SYSTEM_CONTENT = "You are Lucy, an IoT monitoring assistant specialized in analyzing device telemetry and alarms from a ThingsBoard instance."
+
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY')  
 
+# Request IDs, latency budgets and request latency metrics
+register_request_hooks(app, request, g, REQUEST_BUDGET)
+
+def tb_fetch(operation, func, *args, **kwargs):
+    """
+    Make a timed ThingsBoard read, or wait for the identical read already in flight.
+    
+    Reads are keyed on the operation and its arguments, not on the client: every
+    client logs in as the same user, so they all see the same data. Each read
+    goes through the ThingsBoard circuit breaker and is bounded by TB_TIMEOUT,
+    cut to what is left of the request budget. A read rejected with 401 drops
+    the shared session, so the next request logs in again.
+    
+    Args:
+        operation (str): Operation name for metrics, e.g. "get_device_by_id"
+        func: The RestClientPE method
+        *args, **kwargs: Its arguments
+    
+    Returns:
+        The result of the call, shared with concurrent callers (do not modify it)
+    
+    Raises:
+        DeadlineExceeded: When the read does not finish within its timeout
+        CircuitOpenError: While ThingsBoard's circuit is open
+        ConnectionError: When ThingsBoard rejected the session token
+    """
+    def fetch():
+        timeout = stage_timeout(TB_TIMEOUT)
+        with timed("thingsboard", operation), TB_BREAKER.guard():
+            try:
+                # RestClientPE takes no per-call timeout, so stop waiting for it instead
+                return call_with_timeout(lambda: func(*args, **kwargs), timeout)
+            except ApiException as e:
+                if e.status != 401:
+                    raise
+                # The token was revoked or expired early: the next request logs in again
+                TB_SESSION.invalidate()
+                raise ConnectionError("ThingsBoard rejected the session token") from e
+
+    return TB_FLIGHT.do(flight_key(operation, args, kwargs), fetch, operation=operation)
+
+def tb_client():
+    """
+    Get the shared, logged-in ThingsBoard client (see ThingsBoardSession).
+    
+    A failed login is logged and not raised, so cached data can still be
+    served; reads that need the client then fail at once (see require_login)
+    and fall back to the last data fetched.
+    
+    Returns:
+        RestClientPE: The client, None if ThingsBoard cannot be logged in to
+    """
+    try:
+        return TB_SESSION.client()
+    except Exception as e:
+        logging.error(f"ThingsBoard login failed: {e!r}")
+        return None
+
+def require_login(rest_client):
+    """
+    Check that there is a logged-in ThingsBoard client to read with.
+    
+    Args:
+        rest_client: ThingsBoard REST client (see tb_client)
+    
+    Raises:
+        ConnectionError: When the login failed
+    """
+    if rest_client is None:
+        raise ConnectionError("Not logged in to ThingsBoard")
+
 def get_danshboard():
     
-    with RestClientPE(base_url=TB_URL) as rest_client:
-        
-        rest_client.login(username=USERNAME, password=PASSWORD) 
-        dashboard = rest_client.get_user_dashboards(page_size=100, page=0)
-        
-        dashboard_json = json.dumps(dashboard, default=lambda o: o.__dict__)
-        
-        print(dashboard_json)
-        
-        with open('./dashboards/data.json', 'w') as json_file:
-            json_file.write(dashboard_json)    
+    rest_client = tb_client()
+    require_login(rest_client)
+    dashboard = tb_fetch("get_user_dashboards", rest_client.get_user_dashboards, page_size=100, page=0)
+    
+    dashboard_json = json.dumps(dashboard, default=lambda o: o.__dict__)
+    
+    logging.debug("Dashboards: %s", dashboard_json)
+    
+    with open('./dashboards/data.json', 'w') as json_file:
+        json_file.write(dashboard_json)    
 
 
 def sanitize_filename(filename):
@@ -51,7 +307,7 @@ def sanitize_filename(filename):
     """
     return re.sub(r'[<>:"/\\|?*\n]', '_', filename)
 
-def get_openai_response(model, system_content, user_content):
+def get_openai_response(model, system_content, user_content, stage="answer", timeout=OPENAI_TIMEOUT):
     """
     Unified function to get responses from OpenAI API.
     
@@ -59,103 +315,375 @@ def get_openai_response(model, system_content, user_content):
         model (str): The OpenAI model to use
         system_content (str): The system message content
         user_content (str): The user message content
+        stage (str): Pipeline stage, used to label latency and token metrics
+        timeout (float): Longest time the call may take, cut to the request budget
+    
+    Returns:
+        str: The generated text response, empty on error
+    """
+    def create():
+        limit = stage_timeout(timeout)
+        with OPENAI_BREAKER.guard():
+            # The SDK timeout applies to each retry; the outer wait bounds them all
+            return call_with_timeout(lambda: openai.chat.completions.create(
+                **chat_request(system_content, user_content, timeout=limit)
+            ), limit)
+
+    return complete(create, stage)
+
+def stream_openai_response(model, system_content, user_content, stage="answer", timeout=OPENAI_TIMEOUT):
+    """
+    Stream a response from OpenAI API as it is generated.
+    
+    Args:
+        model (str): The OpenAI model to use
+        system_content (str): The system message content
+        user_content (str): The user message content
+        stage (str): Pipeline stage, used to label latency and token metrics
+        timeout (float): Longest wait for the stream or its next chunk, cut to the request budget
+    
+    Returns:
+        generator: Pieces of the generated text response, in order (see serving.stream_completion)
+    """
+    def create():
+        limit = stage_timeout(timeout)
+        with OPENAI_BREAKER.guard():
+            return call_with_timeout(lambda: openai.chat.completions.create(
+                **chat_request(system_content, user_content, timeout=limit, stream=True)
+            ), limit)
+
+    return stream_completion(create, system_content, user_content, stage)
+
+def answer_cache_key(query, dashboard_id, site_data):
+    """
+    Build the answer cache key for a query.
+    
+    The site data is the device and alarm text that goes into the prompt, so a
+    change in device readings or alarms produces a new key.
+    
+    Args:
+        query (str): The user's query
+        dashboard_id (str): The dashboard the query is about ("" when no data is involved)
+        site_data (str): The device and alarm data included in the prompt
     
     Returns:
-        str: The generated text response
+        str: The cache key
+    """
+    normalized = re.sub(r'[^a-zA-Z0-9]', '', query).lower()
+    fingerprint = hashlib.sha256(site_data.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{normalized}|{dashboard_id}|{fingerprint}".encode("utf-8")).hexdigest()
+
+def store_answer(cache_key, generated_text):
+    """Log a generated answer and keep it in ANSWER_CACHE when it has a key."""
+    logging.info("Decision AI Answer: %s", generated_text)
+    if cache_key and generated_text:
+        ANSWER_CACHE.set(cache_key, generated_text)
+
+def answer_response(model, system_content, user_content, data, extra=None, cache_key=None, stage="answer"):
     """
+    Answer the query with an OpenAI completion, streamed as Server-Sent Events when requested.
+    
+    The answer is sent as serving.answer_events or serving.answer_payload
+    describe, with ANSWER_ERROR when the model fails. When a cache key is given,
+    a cached answer is returned without calling OpenAI and new answers are stored.
+    
+    Args:
+        model (str): The OpenAI model to use
+        system_content (str): The system message content
+        user_content (str): The user query or prompt
+        data (dict): The parsed JSON request body
+        extra (dict): Additional fields for the response (optional)
+        cache_key (str): Key in ANSWER_CACHE (optional, see answer_cache_key)
+        stage (str): Pipeline stage, used to label latency and token metrics
+    
+    Returns:
+        Response: JSON or text/event-stream response
+    """
+    extra = extra or {}
+    cached_text = ANSWER_CACHE.get(cache_key) if cache_key else None
+
+    if wants_stream(data, request.headers):
+        events = answer_events(
+            lambda: stream_openai_response(model, system_content, user_content, stage=stage), extra, cached_text,
+            on_answer=lambda generated_text: store_answer(cache_key, generated_text)
+        )
+        return Response(stream_with_context(events), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+    if cached_text is not None:
+        return jsonify(answer_payload(cached_text, extra, cached=True))
+
+    generated_text = get_openai_response(model, system_content, user_content, stage=stage)
+    store_answer(cache_key, generated_text)
+    return jsonify(answer_payload(generated_text, extra))
+
+
+def dashboard_device_ids(dashboard_dict):
+    """
+    Get the IDs of the devices a dashboard's entity aliases point at.
+    
+    Args:
+        dashboard_dict (dict): ThingsBoard dashboard (see load_dashboard)
+    
+    Returns:
+        list: Device IDs in alias order, without repeats
+    """
+    device_ids = []
+    entity_aliases = dashboard_dict.get("configuration", {}).get("entityAliases", {})
+    for value in entity_aliases.values():
+        single_entity = value.get("filter", {}).get("singleEntity", {})
+        if single_entity.get("entityType") == "DEVICE" and single_entity.get("id") not in device_ids:
+            device_ids.append(single_entity.get("id"))
+    return device_ids
+
+def entity_timeseries_keys(rest_client, query):
+    """
+    Get the telemetry keys of the entities an entity data query matches.
+    
+    The client's response model for this endpoint drops the keys, so the JSON is read directly.
+    
+    Args:
+        rest_client: ThingsBoard REST client
+        query (dict): The entity data query
+    
+    Returns:
+        list: Telemetry keys of any of the entities
+    """
+    response = rest_client.entity_query_controller.find_entity_timeseries_and_attributes_keys_by_query_using_post(
+        timeseries=True, attributes=False, body=query, _preload_content=False
+    )
+    return json.loads(response.data).get("timeseries", [])
+
+def fetch_devices(rest_client, dashboard_dict):
+    """
+    Get the name, type, title and latest telemetry of every device on a dashboard.
+    
+    Uses ThingsBoard's entity data query API: one call for the devices'
+    telemetry keys, then one call per TB_ENTITY_PAGE_SIZE devices, instead of
+    three calls per device.
+    
+    Args:
+        rest_client: ThingsBoard REST client
+        dashboard_dict (dict): ThingsBoard dashboard (see load_dashboard)
+    
+    Returns:
+        list: {"id", "name", "type", "title", "data"} for each device, in alias order; "data" is
+            the latest telemetry, {key: [{"ts": ..., "value": ...}]}
+    """
+    device_ids = dashboard_device_ids(dashboard_dict)
+    if not device_ids:
+        return []
+
+    entity_filter = {"type": "entityList", "entityType": "DEVICE", "entityList": device_ids}
+    timeseries_keys = tb_fetch(
+        "find_entity_keys",
+        lambda query: entity_timeseries_keys(rest_client, query),
+        {"entityFilter": entity_filter, "pageLink": {"page": 0, "pageSize": len(device_ids)}}
+    )
+
+    entities = {}
+    page = 0
+    while True:
+        result = tb_fetch("find_entity_data", rest_client.find_entity_data_by_query, {
+            "entityFilter": entity_filter,
+            "pageLink": {"page": page, "pageSize": ENTITY_PAGE_SIZE},
+            "entityFields": [{"type": "ENTITY_FIELD", "key": "name"}, {"type": "ENTITY_FIELD", "key": "type"}],
+            "latestValues": [{"type": "ATTRIBUTE", "key": "title"}] + [
+                {"type": "TIME_SERIES", "key": key} for key in timeseries_keys
+            ]
+        })
+        for entity in result.data or []:
+            entities[entity.entity_id.id] = entity.latest or {}
+        if not result.has_next:
+            break
+        page += 1
+
+    devices = []
+    for device_id in device_ids:
+        latest = entities.get(device_id, {})
+        fields = latest.get("ENTITY_FIELD", {})
+        title = latest.get("ATTRIBUTE", {}).get("title")
+        # Keys a device has never reported come back with no timestamp
+        data = {
+            key: [{"ts": value.ts, "value": value.value}]
+            for key, value in latest.get("TIME_SERIES", {}).items() if value.ts
+        }
+        devices.append({
+            "id": device_id,
+            "name": fields["name"].value if "name" in fields else None,
+            "type": fields["type"].value if "type" in fields else None,
+            "title": title.value if title is not None else None,
+            "data": data
+        })
+    return devices
+
+def dashboard_devices(rest_client, dashboard_dict):
+    """
+    Get the devices on a dashboard with their latest telemetry, from the telemetry stream when it is live.
+    
+    Devices fetched over REST are handed to TELEMETRY_STORE, which subscribes
+    to their updates; later calls read them from memory, without REST calls,
+    for as long as the stream stays connected.
+    
+    Args:
+        rest_client: ThingsBoard REST client
+        dashboard_dict (dict): ThingsBoard dashboard (see load_dashboard)
+    
+    Returns:
+        list: {"name", "type", "title", "data"} for each device with a title, a type and telemetry,
+            in alias order (see fetch_devices)
+    """
+    devices = None
+    if TELEMETRY_STORE is not None:
+        devices = TELEMETRY_STORE.devices(dashboard_device_ids(dashboard_dict))
+    if devices is None:
+        devices = fetch_devices(rest_client, dashboard_dict)
+        if TELEMETRY_STORE is not None:
+            TELEMETRY_STORE.watch(devices)
+    return [device for device in devices if device["title"] and device["type"] and device["data"]]
+
+def load_dashboard(rest_client, dashboard_id):
+    """
+    Get a ThingsBoard dashboard, fetching it on a cache miss.
+    
+    Args:
+        rest_client: ThingsBoard REST client
+        dashboard_id (str): The ID of the dashboard
+    
+    Returns:
+        dict: The dashboard (see Dashboard.to_dict), the last one fetched if the fetch fails
+    """
+    key = str(dashboard_id)
+    dashboard_dict = DASHBOARD_CACHE.get(key)
+    if dashboard_dict is not None:
+        return dashboard_dict
+
     try:
-        completion = openai.chat.completions.create(
-            model="gpt-4o-itm-sicu",  
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": user_content}
-            ],  
-            temperature=0.7,
-            max_tokens=800,
-            top_p=0.95,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None
+        require_login(rest_client)
+        dashboard = tb_fetch(
+            "get_dashboard_by_id", rest_client.get_dashboard_by_id, DashboardId(id=dashboard_id, entity_type="DASHBOARD")
         )
-        return completion.choices[0].message.content
     except Exception as e:
-        print(f"Error with OpenAI API: {e}")
-        return ""
+        return stale_or_raise("dashboard", key, e)
+    dashboard_dict = dashboard.to_dict()
+    DASHBOARD_CACHE.set(key, dashboard_dict)
+    LAST_GOOD.remember("dashboard", key, dashboard_dict)
+    return dashboard_dict
+
+def load_site_devices(rest_client, dashboard_id, dashboard_dict):
+    """
+    Get the device titles and types of a dashboard, fetching them on a cache miss.
+    
+    Args:
+        rest_client: ThingsBoard REST client
+        dashboard_id (str): The ID of the dashboard
+        dashboard_dict (dict): The dashboard (see load_dashboard)
     
+    Returns:
+        dict: Dictionary mapping device titles to device types, the last one fetched if the fetch fails
+    """
+    key = str(dashboard_id)
+    available_devices = DEVICE_CACHE.get(key)
+    if available_devices is None:
+        try:
+            require_login(rest_client)
+            available_devices = site_info(dashboard_dict, rest_client)
+        except Exception as e:
+            return stale_or_raise("devices", key, e)
+        DEVICE_CACHE.set(key, available_devices)
+        LAST_GOOD.remember("devices", key, available_devices)
+    return available_devices
+
+def load_site(rest_client, dashboard_id):
+    """
+    Get a dashboard and the devices on it (cached, see load_dashboard).
     
+    Args:
+        rest_client: ThingsBoard REST client
+        dashboard_id (str): The ID of the dashboard
     
+    Returns:
+        tuple: (dashboard dictionary, dictionary mapping device titles to device types),
+            (None, None) if ThingsBoard is unavailable and the site was never fetched
+    """
+    try:
+        dashboard_dict = load_dashboard(rest_client, dashboard_id)
+        return dashboard_dict, load_site_devices(rest_client, dashboard_id, dashboard_dict)
+    except Exception as e:
+        logging.error(f"Error loading dashboard {dashboard_id}: {e!r}")
+        return None, None
 
-def get_device_info(rest_client, entity_type, entity_id):
+def load_site_data(rest_client, dashboard_id, dashboard_dict):
     """
-    Get device information including telemetry, title, and type.
+    Fetch the site alarms and the readings of every device on a dashboard.
     
     Args:
         rest_client: ThingsBoard REST client
-        entity_type (str): Type of entity (usually "DEVICE")
-        entity_id: Entity ID object
+        dashboard_id (str): The ID of the dashboard
+        dashboard_dict (dict): The dashboard (see load_dashboard)
     
     Returns:
-        tuple: (title, device_type, data, device_name) or (None, None, None, None) if error
+        tuple: (alarm_info, devices, available_devices, data age in seconds, whether the data is stale),
+            the last data fetched if the fetch fails, None if there is none
     """
+    key = str(dashboard_id)
     try:
-        data = rest_client.telemetry_controller.get_latest_timeseries_using_get(entity_type, entity_id)
-        device_id = DeviceId(entity_id.id, entity_type)
-        device = rest_client.get_device_by_id(device_id)
-        attributes = rest_client.telemetry_controller.get_attributes_using_get(entity_type, entity_id)
-        
-        title = "N/A"
-        for attr in attributes:
-            if attr['key'] == 'title':
-                title = attr['value']
-                break
-                
-        if data == {} or title == "N/A":
-            return None, None, None, None
-            
-        return title, device.type, data, device.name
+        require_login(rest_client)
+        alarm_info = get_alarm_information(rest_client, dashboard_id, dashboard_dict)
+        devices, available_devices = get_devices_information(rest_client, dashboard_dict)
     except Exception as e:
-        logging.error(f"Error getting device info: {e}")
-        return None, None, None, None
+        site_data, age = LAST_GOOD.get("site", key)
+        if site_data is None:
+            logging.error(f"Error loading the devices and alarms of dashboard {dashboard_id}: {e!r}")
+            return None
+        logging.warning("Site data of dashboard %s unavailable (%r), using data from %.0fs ago", dashboard_id, e, age)
+        STALE_DATA.inc(kind="site")
+        return (*site_data, age, True)
+
+    LAST_GOOD.remember("site", key, (alarm_info, devices, available_devices))
+    return alarm_info, devices, available_devices, 0, False
 
-def site_info(dashboard, rest_client):
+def stale_or_raise(kind, key, error):
+    """
+    Fall back to the data last stored in LAST_GOOD after a failed fetch.
+    
+    Args:
+        kind (str): "dashboard" or "devices"
+        key (str): The dashboard ID
+        error (Exception): Why the fetch failed, raised again when there is no fallback
+    
+    Returns:
+        The last data fetched
+    """
+    data, age = LAST_GOOD.get(kind, key)
+    if data is None:
+        raise error
+    logging.warning("ThingsBoard %s of dashboard %s unavailable (%r), using data from %.0fs ago", kind, key, error, age)
+    STALE_DATA.inc(kind=kind)
+    return data
+
+def site_info(dashboard_dict, rest_client):
     """
     Get information about all devices in a site/dashboard.
     
     Args:
-        dashboard: ThingsBoard dashboard object
+        dashboard_dict (dict): ThingsBoard dashboard (see load_dashboard)
         rest_client: ThingsBoard REST client
     
     Returns:
         dict: Dictionary mapping device titles to device types
     """
-    available_devices = {}
-    dashboard_dict = dashboard.to_dict()
-    entity_aliases = dashboard_dict.get("configuration", {}).get("entityAliases", {})
-
-    for key, value in entity_aliases.items():
-        filter_data = value.get("filter", {})
-        single_entity = filter_data.get("singleEntity", {})
-        if single_entity.get("entityType") == "DEVICE":
-            device_id = single_entity.get("id")
-            entity_type = single_entity.get("entityType")
-            entity_id = EntityId(device_id, entity_type)
-            
-            title, device_type, _, _ = get_device_info(rest_client, entity_type, entity_id)
-            if title and device_type:
-                available_devices[title] = device_type
-    
-    return available_devices
+    return {device["title"]: device["type"] for device in dashboard_devices(rest_client, dashboard_dict)}
     
-def need_tb(query, site_information):
+def need_tb_prompt(query, site_information):
     """
-    Use OpenAI to decide whether the user's query references or requires the Thingsboard IOT monitoring System.
+    Build the OpenAI prompt that decides whether a query needs ThingsBoard data.
     
     Args:
         query (str): User's query
         site_information (dict): Dictionary of device information
     
     Returns:
-        bool: True if the query needs ThingsBoard data, False otherwise
+        tuple: (system_content, prompt)
     """
     prompt = (
         "You are an intelligent IT and network assistant. "
@@ -178,78 +706,343 @@ def need_tb(query, site_information):
         "You are an intelligent IT assistant. Decide if the user's query references "
         "any of the listed locations or IoT devices (including partial or synonymous matches)."
     )
+    return system_content, prompt
+
+def need_tb_steps(query, site_information):
+    """
+    Use OpenAI to decide whether the user's query references or requires the Thingsboard IOT monitoring System (a pipeline).
     
+    Args:
+        query (str): User's query
+        site_information (dict): Dictionary of device information
+    
+    Returns:
+        bool: True if the query needs ThingsBoard data, False otherwise
+    """
+    system_content, prompt = need_tb_prompt(query, site_information)
     try:
-        answer = get_openai_response("gpt-4", system_content, prompt).strip().upper()
-        return answer == "YES"
+        answer = yield upstream("openai", "gpt-4", system_content, prompt, stage="need_tb", timeout=OPENAI_ROUTING_TIMEOUT)
+        return answer.strip().upper() == "YES"
     except Exception as e:
         logging.error(f"Error with OpenAI API: {e}")
         return False
 
-def get_alarm_information(rest_client):
+def build_tb_prompt(query, device_info, alarm_info):
     """
-    Get information about all alarms in the system.
+    Build the analysis prompt for a query that needs ThingsBoard data.
+    
+    Args:
+        query (str): User's query
+        device_info (str): Formatted device information and readings
+        alarm_info (str): Formatted site alarms
+    
+    Returns:
+        str: The prompt
+    """
+    return f"""
+            You are Lucy, an IoT monitoring assistant specialized in analyzing device telemetry and alarms from a ThingsBoard instance.
+            Below is the user's question, some information about the device(s), and any relevant alarm states.
+            User Question:
+            {query}
+            Device Information and Readings:
+            {device_info}
+            Site Alarms:
+            {alarm_info}
+            Please provide your best answer to the user's question by relevant metrics and alarms if appropriate.
+            Keep the response within 5 sentences
+            """
+
+def iter_alarms(rest_client, device_ids, status_filters):
+    """
+    Stream the alarms raised by some devices, newest first, one page at a time.
+    
+    Pages are fetched as the generator is consumed, so a caller that stops early
+    does not fetch the rest.
+    
+    Args:
+        rest_client: ThingsBoard REST client
+        device_ids (list): IDs of the originator devices
+        status_filters (list): Status lists, e.g. [["ACTIVE"], ["CLEARED", "UNACK"]] (see ALARM_STATUS_FILTERS)
+    
+    Yields:
+        dict: Alarm row with the ALARM_COLUMNS fields
+    """
+    if not device_ids:
+        return
+
+    for statuses in status_filters:
+        page = 0
+        while True:
+            result = tb_fetch("find_alarm_data", rest_client.find_alarm_data_by_query, {
+                "entityFilter": {"type": "entityList", "entityType": "DEVICE", "entityList": device_ids},
+                "pageLink": {
+                    "page": page,
+                    "pageSize": ALARM_PAGE_SIZE,
+                    "statusList": statuses,
+                    "searchPropagatedAlarms": False,
+                    "sortOrder": {"key": {"type": "ALARM_FIELD", "key": "createdTime"}, "direction": "DESC"}
+                }
+            })
+            for alarm_data in result.data or []:
+                originator = getattr(alarm_data, 'originator', None)
+                name = getattr(alarm_data, 'name', None)
+                alarm_type = getattr(alarm_data, 'type', None)
+                yield {
+                    "name": name,
+                    # The type usually repeats the name
+                    "type": alarm_type if alarm_type != name else None,
+                    "severity": getattr(alarm_data, 'severity', None),
+                    "status": getattr(alarm_data, 'status', None),
+                    "originator": getattr(alarm_data, 'originator_name', None),
+                    "originator_label": getattr(alarm_data, 'originator_label', None),
+                    "entity_type": getattr(originator, 'entity_type', None)
+                }
+            if not result.has_next:
+                break
+            page += 1
+
+def get_alarm_information(rest_client, dashboard_id, dashboard_dict):
+    """
+    Get the alarms raised by the devices on a dashboard, as a prompt table.
+    
+    Only alarms matching ALARM_STATUS_FILTERS are read, at most
+    TB_ALARM_MAX_ROWS of them, and the rows are cached for TB_ALARM_CACHE_TTL
+    seconds per dashboard.
     
     Args:
         rest_client: ThingsBoard REST client
+        dashboard_id (str): The ID of the dashboard
+        dashboard_dict (dict): The dashboard (see load_dashboard)
     
     Returns:
         str: Formatted string of alarm information
     """
-    alarms = rest_client.alarm_controller.get_all_alarms_using_get(10000, 0)
-    data = getattr(alarms, 'data', [])
-    
-    if not data:
+    key = str(dashboard_id)
+    rows = ALARM_CACHE.get(key)
+    if rows is None:
+        alarms = iter_alarms(rest_client, dashboard_device_ids(dashboard_dict), ALARM_STATUS_FILTERS)
+        rows = list(itertools.islice(alarms, ALARM_MAX_ROWS))
+        ALARM_CACHE.set(key, rows)
+
+    if not rows:
         return "No alarms found."
-        
-    alarm_info = ""
-    for alarm_data in data:
-        alarm_string = (
-            f"Alarm Name: {getattr(alarm_data, 'name', 'N/A')}, "
-            f"Alarm Type: {getattr(alarm_data, 'type', 'N/A')}, "
-            f"Severity: {getattr(alarm_data, 'severity', 'N/A')}, "
-            f"Status: {getattr(alarm_data, 'status', 'N/A')}, "
-            f"Originator Name: {getattr(alarm_data, 'originator_name', 'N/A')}, "
-            f"Originator Label: {getattr(alarm_data, 'originator_label', 'N/A')}, "
-            f"Originator Entity Type: {getattr(getattr(alarm_data, 'originator', {}), 'entity_type', 'N/A')}, "
-            f"Originator ID: {getattr(getattr(alarm_data, 'originator', {}), 'id', 'N/A')}.\n"
-        )
-        alarm_info += alarm_string
+
+    alarm_info, stats = encode_rows(rows, ALARM_COLUMNS, token_budget=ALARM_TOKEN_BUDGET, merge_duplicates=True)
+    logging.info("Prompt alarms: %d rows (%d omitted) in %d tokens", stats["rows"], stats["omitted"], stats["tokens"])
+    return alarm_info or "No alarms found."
+
+def format_readings(data):
+    """
+    Format latest telemetry as compact "key=value" pairs.
+    
+    Args:
+        data (dict): Latest timeseries, {key: [{"ts": ..., "value": ...}]}
+    
+    Returns:
+        str: The readings, e.g. "temperature=21.5; humidity=40"
+    """
+    readings = []
+    for key, values in data.items():
+        value = values[0].get("value") if values else None
+        if format_value(value):
+            readings.append(f"{key}={format_value(value)}")
+    return "; ".join(readings)
+
+def device_aliases(text, words=True):
+    """
+    Build the lowercase aliases a device title, name, type or reading can be referred to by.
+    
+    Args:
+        text (str): The title, name, type or reading key
+        words (bool): Also use each distinctive word on its own
     
-    return alarm_info
+    Returns:
+        set: Aliases such as "main door 2", "maindoor2", "door 2" and "door"
+    """
+    all_words = re.findall(r'[a-z0-9]+', (text or "").lower())
+    specific = [word for word in all_words if word not in GENERIC_DEVICE_WORDS]
+    aliases = {" ".join(all_words), "".join(all_words), " ".join(specific)}
+    if words:
+        aliases.update(word for word in specific if not word.isdigit())
+    aliases.discard("")
+    return aliases
 
-def get_devices_information(rest_client, entity_aliases, dashboard_dict):
+def query_terms(query, max_words):
     """
-    Get detailed information about all devices in a dashboard.
+    Split a query into the word n-grams devices are matched against.
+    
+    Ordinals become numbers, also moved after the words that follow them
+    ("second main door" -> "main door 2"), and words listed in
+    DEVICE_SYNONYMS add the term they stand for ("temp" -> "temperature").
+    
+    Args:
+        query (str): User's query
+        max_words (int): Longest n-gram to produce, in words
+    
+    Returns:
+        list: The n-grams, both space-separated and run together
+    """
+    words = [ORDINALS.get(word, word) for word in re.findall(r'[a-z0-9]+', query.lower())]
+    terms = set()
+    for n in range(1, max_words + 1):
+        for i in range(len(words) - n + 1):
+            chunk = words[i:i + n]
+            terms.add(" ".join(chunk))
+            terms.add("".join(chunk))
+            if i > 0 and words[i - 1] in ORDINALS.values() and n < max_words:
+                terms.add(" ".join(chunk + [words[i - 1]]))
+    for word in words:
+        term = SYNONYM_TERMS.get(word) or SYNONYM_TERMS.get(word.rstrip("s"))
+        if term:
+            terms.add(term)
+    return list(terms)
+
+def alias_score(alias, terms):
+    """
+    Score how well an alias matches the best of the query's terms (0-100).
+    
+    Aliases of four letters or fewer must match exactly (or as a plural), so
+    that "hall" does not match "all", and so must aliases with a number, so
+    that "sensor 12" does not match "sensor 13".
+    """
+    if alias in terms or alias + "s" in terms:
+        return 100
+    if len(alias) <= 4 or any(char.isdigit() for char in alias):
+        return 0
+    return process.extractOne(alias, terms, scorer=fuzz.ratio)[1]
+
+def select_devices(query, devices, threshold=DEVICE_MATCH_THRESHOLD):
+    """
+    Keep the devices a query is about.
+    
+    Devices are first matched on their title or name ("server room",
+    "Main Door 2"); if none match, on their type or readings ("door",
+    "battery", or a synonym such as "temp"). A query that matches no device
+    is about the whole site. A device matched only by words that another
+    device matches with more ("server room" against "server room 2") is left out.
+    
+    Args:
+        query (str): User's query
+        devices (list): The dashboard's devices (see dashboard_devices)
+        threshold (float): Minimum fuzzy score for a device to match
+    
+    Returns:
+        list: The matching devices in dashboard order, None for a site-wide query
+    """
+    located = [device_aliases(device["title"]) | device_aliases(device["name"], words=False) for device in devices]
+    described = [
+        set().union(device_aliases(device["type"]), *(device_aliases(key) for key in device["data"]))
+        for device in devices
+    ]
+    max_words = max((len(alias.split()) for aliases in located + described for alias in aliases), default=1)
+    terms = query_terms(query, max_words)
+    if not terms:
+        return None
+
+    for aliases_by_device in (located, described):
+        # Best matching alias of each matching device, by score then length
+        matched = {}
+        for index, aliases in enumerate(aliases_by_device):
+            scored = [(alias_score(alias, terms), len(alias), alias) for alias in aliases]
+            score, _, alias = max(scored, default=(0, 0, ""))
+            if score >= threshold:
+                matched[index] = alias
+        selected = [
+            devices[index] for index, alias in matched.items()
+            if not any(other != alias and f" {alias} " in f" {other} " for other in matched.values())
+        ]
+        if selected:
+            return selected
+    return None
+
+def summarize_readings(devices):
+    """
+    Summarize the latest telemetry of several devices: numeric ranges and counts of other values.
+    
+    Args:
+        devices (list): Devices with their latest telemetry (see dashboard_devices)
+    
+    Returns:
+        str: The readings, e.g. "temperature=21.5..23.4; open=false x5, true x1"
+    """
+    values = {}
+    for device in devices:
+        for key, samples in device["data"].items():
+            value = format_value(samples[0].get("value")) if samples else ""
+            if value:
+                values.setdefault(key, []).append(value)
+
+    readings = []
+    for key, key_values in values.items():
+        try:
+            numbers = sorted(float(value) for value in key_values)
+        except ValueError:
+            counts = {}
+            for value in key_values:
+                counts[value] = counts.get(value, 0) + 1
+            readings.append(f"{key}=" + ", ".join(f"{value} x{count}" for value, count in counts.items()))
+            continue
+        low, high = format_value(numbers[0]), format_value(numbers[-1])
+        readings.append(f"{key}={low}" if low == high else f"{key}={low}..{high}")
+    return "; ".join(readings)
+
+def device_information(query, devices):
+    """
+    Build the device table of the analysis prompt for a query.
+    
+    Only the devices the query is about are listed, with all their readings
+    (see select_devices). A site-wide query gets one summary row per device type.
+    
+    Args:
+        query (str): User's query
+        devices (list): The dashboard's devices (see dashboard_devices)
+    
+    Returns:
+        str: The device table
+    """
+    selected = select_devices(query, devices)
+    if selected is None:
+        by_type = {}
+        for device in devices:
+            by_type.setdefault(device["type"], []).append(device)
+        rows = [
+            {
+                "type": device_type, "count": len(typed), "labels": ", ".join(device["title"] for device in typed),
+                "readings": summarize_readings(typed)
+            }
+            for device_type, typed in by_type.items()
+        ]
+        columns = DEVICE_SUMMARY_COLUMNS
+    else:
+        rows = [
+            {
+                "label": device["title"], "device": device["name"], "type": device["type"],
+                "readings": format_readings(device["data"])
+            }
+            for device in selected
+        ]
+        columns = DEVICE_COLUMNS
+
+    device_info, stats = encode_rows(rows, columns, token_budget=DEVICE_TOKEN_BUDGET, max_chars=600)
+    logging.info(
+        "Prompt devices: %s of %d devices, %d rows (%d omitted) in %d tokens",
+        "summary" if selected is None else len(selected), len(devices), stats["rows"], stats["omitted"], stats["tokens"]
+    )
+    return device_info
+
+def get_devices_information(rest_client, dashboard_dict):
+    """
+    Get the devices in a dashboard with their latest readings.
     
     Args:
         rest_client: ThingsBoard REST client
-        entity_aliases: Entity aliases from dashboard
         dashboard_dict: Dashboard dictionary
     
     Returns:
-        tuple: (device_info_str, available_devices_list)
-    """
-    device_info = ""
-    available_devices = []
-    
-    for key, value in entity_aliases.items():
-        filter_data = value.get("filter", {})
-        single_entity = filter_data.get("singleEntity", {})
-        if single_entity.get("entityType") == "DEVICE":
-            alias = value.get("alias")
-            device_id = single_entity.get("id")
-            entity_type = single_entity.get("entityType")
-            dashboard_name = dashboard_dict.get('name', f"dashboard_{dashboard_id}")
-            sanitized_name = sanitize_filename(dashboard_name)
-            entity_id = EntityId(device_id, entity_type)
-            
-            title, device_type, data, device_name = get_device_info(rest_client, entity_type, entity_id)
-            if title and device_type and data:
-                available_devices.append(f"{title}, {device_type}")
-                device_info += f"Label: {title}, Device: {device_name}, Device Type: {device_type}, Readings: {data}\n\n"
-    
-    return device_info, available_devices
+        tuple: (devices (see dashboard_devices), available_devices_list)
+    """
+    devices = dashboard_devices(rest_client, dashboard_dict)
+    return devices, [f"{device['title']}, {device['type']}" for device in devices]
 
 def load_dashboards():
     """
@@ -266,87 +1059,113 @@ def load_dashboards():
         ]
         return dashboards
 
+# ------------------ Request Pipeline ------------------
+
+def run_pipeline(steps):
+    """
+    Run a pipeline (see pipeline.py) with blocking upstream calls.
+    
+    Args:
+        steps (generator): The pipeline generator
+    
+    Returns:
+        The pipeline's return value
+    """
+    return run_steps(steps, {
+        "openai": get_openai_response,
+        "thread": lambda func, *args: func(*args)
+    })
+
+def query_steps(rest_client, query, dashboard_id):
+    """
+    Route a query and gather the site data and prompt to answer it with (a pipeline).
+    
+    ThingsBoard reads are yielded as "thread" calls: tb_rest_client is synchronous,
+    so the async server runs them in worker threads.
+    
+    Args:
+        rest_client: Logged-in ThingsBoard REST client
+        query (str): The user's query
+        dashboard_id (str): The dashboard chosen in the session
+    
+    Returns:
+        dict: {"reply": response body} when the query is answered without OpenAI, otherwise the
+            answer_response arguments {"model", "system_content", "user_content", "extra", "cache_key", "stage"}
+    """
+    with stage_deadline(TB_STAGE_BUDGET):
+        dashboard_dict, site_information = yield upstream("thread", load_site, rest_client, dashboard_id)
+    if dashboard_dict is None:
+        return {"reply": {"response": "Could not retrieve the dashboard from ThingsBoard"}}
+
+    # Check if we need to use ThingsBoard data for this query
+    if not (yield from need_tb_steps(query, site_information)):
+        # Simple query that doesn't need ThingsBoard data
+        return {
+            "model": "gpt-4o-mini", "system_content": GENERAL_SYSTEM_CONTENT, "user_content": query,
+            "extra": {}, "cache_key": answer_cache_key(query, "", ""), "stage": "general_answer"
+        }
+
+    # Query needs ThingsBoard data: alarms and device readings
+    with stage_deadline(TB_STAGE_BUDGET):
+        site_data = yield upstream("thread", load_site_data, rest_client, dashboard_id, dashboard_dict)
+    if site_data is None:
+        return {"reply": {"response": "Could not retrieve the devices and alarms from ThingsBoard"}}
+    alarm_info, devices, available_devices, data_age, stale = site_data
+
+    # Create prompt for OpenAI, with only the devices the query is about
+    device_info = device_information(query, devices)
+    prompt = build_tb_prompt(query, device_info, alarm_info)
+    return {
+        "model": "gpt-4o-mini", "system_content": ANALYSIS_SYSTEM_CONTENT, "user_content": prompt,
+        "extra": {"devices": available_devices, "data_age_seconds": round(data_age), "stale": stale},
+        "cache_key": answer_cache_key(query, dashboard_id, device_info + alarm_info), "stage": "answer"
+    }
+
+# ------------------ Route Handlers ------------------
+
 @app.route('/', methods=['GET'])
 def landing_page():
     """Route for the landing page displaying available dashboards."""
-    get_danshboard()
+    try:
+        get_danshboard()
+    except Exception as e:
+        # dashboards/data.json still holds the list from the last successful fetch
+        logging.warning(f"Could not refresh the dashboard list: {e!r}")
     dashboards = load_dashboards()
     return render_template('landing.html', dashboards=dashboards)
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose latency histograms, token counts and error counters for Prometheus."""
+    return Response(render(), content_type=CONTENT_TYPE)
+
 @app.route('/home', methods=['GET', 'POST'])
 def home():
     """Route for the main home page handling both display and API queries."""
-    with RestClientPE(base_url=TB_URL) as rest_client:
-        rest_client.login(username=USERNAME, password=PASSWORD)
+    rest_client = tb_client()
+    
+    if request.method == 'GET':
+        dashboard_id = request.args.get('dashboard_id', '')
+        if dashboard_id:
+            session['dashboard_id'] = dashboard_id    
         
-        if request.method == 'GET':
-            dashboard_id = request.args.get('dashboard_id', '')
-            if dashboard_id:
-                session['dashboard_id'] = dashboard_id    
-            
-            dashboard = rest_client.get_dashboard_by_id(dashboard_id)
-            available_devices = site_info(dashboard, rest_client)
-            
-            return render_template(
-                'index.html', 
-                room_devices=available_devices
-            )  
-            
-        if request.method == 'POST':
-            data = request.get_json()  # Parse JSON data
-            query = data.get('query')  # Extract the 'query' field
-            logging.info("Logged in as: %s", USERNAME)
-
-            dashboard_id = session.get('dashboard_id')
-            dashboard_id = DashboardId(
-                id=dashboard_id,
-                entity_type="DASHBOARD"
-            )
-            dashboard = rest_client.get_dashboard_by_id(dashboard_id)
-            site_information = site_info(dashboard, rest_client)
-            
-            # Check if we need to use ThingsBoard data for this query
-            if not need_tb(query, site_information):
-                # Simple query that doesn't need ThingsBoard data
-                system_content = "You are a LUCY, a helpful assistant for IoT (Internet of Things) monitoring."
-                generated_text = get_openai_response("gpt-4o-mini", system_content, query)
-                return jsonify({
-                    "response": generated_text,
-                })
-            
-            # Query needs ThingsBoard data
-            dashboard_dict = dashboard.to_dict()
-            entity_aliases = dashboard_dict.get("configuration", {}).get("entityAliases", {})
-            
-            # Get alarm information
-            alarm_info = get_alarm_information(rest_client)
-            
-            # Get device information
-            device_info, available_devices = get_devices_information(rest_client, entity_aliases, dashboard_dict)
-            
-            # Create prompt for OpenAI
-            prompt = f"""
-            You are Lucy, an IoT monitoring assistant specialized in analyzing device telemetry and alarms from a ThingsBoard instance.
-            Below is the user's question, some information about the device(s), and any relevant alarm states.
-            User Question:
-            {query}
-            Device Information and Readings:
-            {device_info}
-            Site Alarms:
-            {alarm_info}
-            Please provide your best answer to the user's question by relevant metrics and alarms if appropriate.
-            Keep the response within 5 sentences
-            """
-            
-            system_content = "You are Lucy, an IoT monitoring assistant specialized in analyzing device telemetry and alarms from a ThingsBoard instance."
-            generated_text = get_openai_response("gpt-4o-mini", system_content, prompt)
-            
-            logging.info("Decision AI Answer: %s", generated_text)
-            
-            return jsonify({
-                "response": generated_text,
-                "devices": available_devices
-            })
+        with stage_deadline(TB_STAGE_BUDGET):
+            _, available_devices = load_site(rest_client, dashboard_id)
+        
+        return render_template(
+            'index.html', 
+            room_devices=available_devices or {}
+        )  
+        
+    if request.method == 'POST':
+        data = request.get_json()  # Parse JSON data
+        query = data.get('query')  # Extract the 'query' field
+        logging.info("Logged in as: %s", USERNAME)
+
+        answer = run_pipeline(query_steps(rest_client, query, session.get('dashboard_id')))
+        if "reply" in answer:
+            return jsonify(answer["reply"])
+        return answer_response(data=data, **answer)
 
 # ------------------ Application Entry Point ------------------
 
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+
+import openai
+from quart import Quart, Response, g, jsonify, render_template, request, session
+
+import app as iot
+from instrumentation import CONTENT_TYPE, render
+from pipeline import run_steps_async
+from resilience import stage_deadline, stage_timeout
+from serving import (
+    SSE_HEADERS, answer_events_async, answer_payload, chat_request, complete_async, register_request_hooks,
+    stream_completion_async, wants_stream
+)
+
+# ------------------ Async Serving Mode ------------------
+# Same routes and templates as app.py, served by an asyncio server. OpenAI calls
+# are awaited; tb_rest_client is synchronous only, so ThingsBoard calls run in
+# worker threads (asyncio.to_thread) and never block the event loop. The
+# threads inherit the request's context, so their logs carry its request ID.
+# Routing, prompts and caches come from app.py, whose request pipelines run
+# here with awaited upstream calls.
+
+_openai_client = None
+
+# Quart Application Setup
+app = Quart(__name__)
+app.secret_key = os.getenv('FLASK_SECRET_KEY')
+
+# Request IDs, latency budgets and request latency metrics
+register_request_hooks(app, request, g, iot.REQUEST_BUDGET, is_async=True)
+
+@app.after_serving
+async def close_clients():
+    """Close the pooled OpenAI connections."""
+    if _openai_client is not None:
+        await _openai_client.close()
+
+def openai_client():
+    """
+    Get the shared async OpenAI client, configured like the module-level client in app.py.
+
+    Returns:
+        AsyncOpenAI: AsyncAzureOpenAI when OPENAI_API_TYPE is "azure", AsyncOpenAI otherwise
+    """
+    global _openai_client
+    if _openai_client is None:
+        if openai.api_type == "azure":
+            _openai_client = openai.AsyncAzureOpenAI(
+                azure_endpoint=openai.azure_endpoint,
+                api_key=openai.api_key,
+                api_version=openai.api_version
+            )
+        else:
+            _openai_client = openai.AsyncOpenAI(api_key=openai.api_key)
+    return _openai_client
+
+async def get_openai_response(model, system_content, user_content, stage="answer", timeout=iot.OPENAI_TIMEOUT):
+    """
+    Get a response from OpenAI API without blocking the event loop.
+
+    Args:
+        model (str): The OpenAI model to use
+        system_content (str): The system message content
+        user_content (str): The user message content
+        stage (str): Pipeline stage, used to label latency and token metrics
+        timeout (float): Longest time the call may take, cut to the request budget
+
+    Returns:
+        str: The generated text response, empty on error
+    """
+    async def create():
+        limit = stage_timeout(timeout)
+        with iot.OPENAI_BREAKER.guard():
+            # The SDK timeout applies to each retry; wait_for bounds them all
+            return await asyncio.wait_for(openai_client().chat.completions.create(
+                **chat_request(system_content, user_content, timeout=limit)
+            ), limit)
+
+    return await complete_async(create, stage)
+
+def stream_openai_response(model, system_content, user_content, stage="answer", timeout=iot.OPENAI_TIMEOUT):
+    """
+    Stream a response from OpenAI API as it is generated.
+
+    Returns:
+        async generator: Pieces of the generated text response, in order (see serving.stream_completion)
+    """
+    async def create():
+        limit = stage_timeout(timeout)
+        with iot.OPENAI_BREAKER.guard():
+            return await asyncio.wait_for(openai_client().chat.completions.create(
+                **chat_request(system_content, user_content, timeout=limit, stream=True)
+            ), limit)
+
+    return stream_completion_async(create, system_content, user_content, stage)
+
+async def answer_response(model, system_content, user_content, data, extra=None, cache_key=None, stage="answer"):
+    """
+    Answer the query with an OpenAI completion, streamed as Server-Sent Events when requested.
+
+    Async counterpart of app.answer_response, sharing its answer cache. The
+    cache is read and written in worker threads, since its shared tier is on disk.
+
+    Args:
+        model (str): The OpenAI model to use
+        system_content (str): The system message content
+        user_content (str): The user query or prompt
+        data (dict): The parsed JSON request body
+        extra (dict): Additional fields for the response (optional)
+        cache_key (str): Key in ANSWER_CACHE (optional, see answer_cache_key)
+        stage (str): Pipeline stage, used to label latency and token metrics
+
+    Returns:
+        Response: JSON or text/event-stream response
+    """
+    extra = extra or {}
+    cached_text = await asyncio.to_thread(iot.ANSWER_CACHE.get, cache_key) if cache_key else None
+
+    if wants_stream(data, request.headers):
+        events = answer_events_async(
+            lambda: stream_openai_response(model, system_content, user_content, stage=stage), extra, cached_text,
+            on_answer=lambda generated_text: asyncio.to_thread(iot.store_answer, cache_key, generated_text)
+        )
+        return Response(events, mimetype="text/event-stream", headers=SSE_HEADERS)
+
+    if cached_text is not None:
+        return jsonify(answer_payload(cached_text, extra, cached=True))
+
+    generated_text = await get_openai_response(model, system_content, user_content, stage=stage)
+    await asyncio.to_thread(iot.store_answer, cache_key, generated_text)
+    return jsonify(answer_payload(generated_text, extra))
+
+async def run_pipeline(steps):
+    """
+    Run a pipeline of app.py (see pipeline.py), awaiting OpenAI and running ThingsBoard reads in worker threads.
+
+    Args:
+        steps (generator): The pipeline generator
+
+    Returns:
+        The pipeline's return value
+    """
+    return await run_steps_async(steps, {
+        "openai": get_openai_response,
+        "thread": asyncio.to_thread
+    })
+
+# ------------------ Route Handlers ------------------
+
+@app.route('/', methods=['GET'])
+async def landing_page():
+    """Route for the landing page displaying available dashboards."""
+    try:
+        await asyncio.to_thread(iot.get_danshboard)
+    except Exception as e:
+        # dashboards/data.json still holds the list from the last successful fetch
+        logging.warning(f"Could not refresh the dashboard list: {e!r}")
+    dashboards = iot.load_dashboards()
+    return await render_template('landing.html', dashboards=dashboards)
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Expose latency histograms, token counts and error counters for Prometheus."""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+@app.route('/home', methods=['GET', 'POST'])
+async def home():
+    """Route for the main home page handling both display and API queries."""
+    # Only a login or token renewal blocks; it runs in a worker thread like the reads
+    rest_client = await asyncio.to_thread(iot.tb_client)
+
+    if request.method == 'GET':
+        dashboard_id = request.args.get('dashboard_id', '')
+        if dashboard_id:
+            session['dashboard_id'] = dashboard_id
+
+        with stage_deadline(iot.TB_STAGE_BUDGET):
+            _, available_devices = await asyncio.to_thread(iot.load_site, rest_client, dashboard_id)
+
+        return await render_template(
+            'index.html',
+            room_devices=available_devices or {}
+        )
+
+    data = await request.get_json()  # Parse JSON data
+    query = data.get('query')  # Extract the 'query' field
+    logging.info("Logged in as: %s", iot.USERNAME)
+
+    answer = await run_pipeline(iot.query_steps(rest_client, query, session.get('dashboard_id')))
+    if "reply" in answer:
+        return jsonify(answer["reply"])
+    return await answer_response(data=data, **answer)
+
+# ------------------ Application Entry Point ------------------
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.environ.get("PORT", 8080))
+    uvicorn.run(app, host="0.0.0.0", port=port)
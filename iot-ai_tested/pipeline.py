@@ -0,0 +1,79 @@
+# ------------------ Sync/Async Request Pipelines ------------------
+# Request pipelines are written once, as generators, and run by app.py with
+# blocking upstream calls and by asgi.py with awaited ones. A pipeline yields
+# each upstream call it needs as upstream(kind, *args, **kwargs) and gets the
+# result back from the yield (or the exception the call raised, thrown at the
+# yield); its return value is the result of the run. Sub-pipelines are run
+# with `yield from`.
+#
+#     def status_steps(hostid):
+#         hosts = yield upstream("zabbix", "host.get", {"hostids": hostid})
+#         return hosts[0] if hosts else None
+#
+#     run_steps(status_steps("10084"), {"zabbix": zabbix.call})
+#     await run_steps_async(status_steps("10084"), {"zabbix": azabbix.call})
+
+
+def upstream(kind, *args, **kwargs):
+    """
+    Describe an upstream call for a pipeline to yield.
+
+    Args:
+        kind: Name of the handler that makes the call (e.g. "openai", "zabbix")
+        *args: Positional arguments of the handler
+        **kwargs: Keyword arguments of the handler
+
+    Returns:
+        tuple: (kind, args, kwargs)
+    """
+    return kind, args, kwargs
+
+
+def run_steps(steps, handlers):
+    """
+    Run a pipeline, making each call it yields with a blocking handler.
+
+    Args:
+        steps: The pipeline generator
+        handlers: Dictionary mapping each call kind to a function
+
+    Returns:
+        The pipeline's return value
+    """
+    result, error = None, None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        kind, args, kwargs = call
+        result, error = None, None
+        try:
+            result = handlers[kind](*args, **kwargs)
+        except Exception as e:
+            error = e
+
+
+async def run_steps_async(steps, handlers):
+    """
+    Run a pipeline, awaiting each call it yields with a coroutine handler.
+
+    Args:
+        steps: The pipeline generator
+        handlers: Dictionary mapping each call kind to a coroutine function
+
+    Returns:
+        The pipeline's return value
+    """
+    result, error = None, None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        kind, args, kwargs = call
+        result, error = None, None
+        try:
+            result = await handlers[kind](*args, **kwargs)
+        except Exception as e:
+            error = e
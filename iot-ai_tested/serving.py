@@ -0,0 +1,302 @@
+import json
+import logging
+import time
+
+from instrumentation import REQUEST_LATENCY, UPSTREAM_ERRORS, UPSTREAM_LATENCY, record_tokens, start_request
+from prompt_encoding import estimate_tokens
+from resilience import start_deadline
+
+# ------------------ Request Handling Shared by the Flask and ASGI Modes ------------------
+# What app.py (Flask, blocking) and asgi.py (Quart, awaited) do alike: request
+# hooks, OpenAI request arguments and accounting, and the JSON and
+# Server-Sent Events shapes of an answer. Functions that iterate or call an
+# upstream come in pairs, the second one (suffix _async) for asgi.py.
+
+# Azure deployment answering every chat completion
+CHAT_MODEL = "gpt-4o-itm-sicu"
+
+# Sent in place of an answer when the model cannot be reached or fails mid-answer
+ANSWER_ERROR = "Sorry, the answer could not be generated. Please try again."
+
+# Headers of streamed answers: no caching, and no buffering by a reverse proxy
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def register_request_hooks(app, request, g, budget, is_async=False):
+    """
+    Give every request an ID (used in logs), a latency budget and a latency measurement.
+
+    Args:
+        app: The Flask or Quart application
+        request: Its request proxy
+        g: Its application-context globals
+        budget: Seconds each request may take (see resilience.start_deadline)
+        is_async: Register coroutine hooks (Quart); Quart runs plain functions in
+            worker threads, where the request deadline would not be set
+    """
+    def begin_request():
+        g.request_id = start_request(request.headers.get("X-Request-ID"))
+        g.request_started = time.perf_counter()
+        start_deadline(budget)
+
+    def finish_request(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        duration = time.perf_counter() - g.get("request_started", time.perf_counter())
+        REQUEST_LATENCY.observe(duration, route=route, method=request.method, status=response.status_code)
+        response.headers["X-Request-ID"] = g.get("request_id", "")
+        logging.info("%s %s -> %s in %.3fs", request.method, route, response.status_code, duration)
+        return response
+
+    if is_async:
+        async def begin_request_async():
+            begin_request()
+
+        async def finish_request_async(response):
+            return finish_request(response)
+
+        app.before_request(begin_request_async)
+        app.after_request(finish_request_async)
+    else:
+        app.before_request(begin_request)
+        app.after_request(finish_request)
+
+
+def chat_request(system_content, user_content, temperature=0.7, max_tokens=800, timeout=None, stream=False):
+    """
+    Build the chat completion arguments shared by the sync and async OpenAI calls.
+
+    Args:
+        system_content: The system message for GPT
+        user_content: The user query for GPT
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens in the completion
+        timeout: SDK timeout of each attempt
+        stream: Whether to stream the completion
+
+    Returns:
+        dict: Keyword arguments for chat.completions.create
+    """
+    return dict(
+        model=CHAT_MODEL,
+        messages=[
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": user_content}
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=0.95,
+        frequency_penalty=0,
+        presence_penalty=0,
+        stop=None,
+        stream=stream,
+        timeout=timeout
+    )
+
+
+def _completion_text(completion, stage):
+    if completion.usage:
+        record_tokens(stage, completion.usage.prompt_tokens, completion.usage.completion_tokens)
+    return completion.choices[0].message.content
+
+
+def _chunk_text(chunk):
+    # Azure sends content-filter chunks without choices
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+
+def _openai_failed(stage, error):
+    UPSTREAM_ERRORS.inc(service="openai", operation=stage)
+    logging.error("Error with OpenAI API: %s", error)
+
+
+def complete(create, stage):
+    """
+    Make a chat completion, timing it and counting its tokens and errors.
+
+    Args:
+        create: Zero-argument callable making the completion call
+        stage: Pipeline stage, used to label latency and token metrics
+
+    Returns:
+        str: The generated text, or an empty string on error
+    """
+    started = time.perf_counter()
+    try:
+        return _completion_text(create(), stage)
+    except Exception as e:
+        _openai_failed(stage, e)
+        return ""
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service="openai", operation=stage)
+
+
+async def complete_async(create, stage):
+    """Await a chat completion (see complete); `create` is a coroutine function."""
+    started = time.perf_counter()
+    try:
+        return _completion_text(await create(), stage)
+    except Exception as e:
+        _openai_failed(stage, e)
+        return ""
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service="openai", operation=stage)
+
+
+def stream_completion(create, system_content, user_content, stage):
+    """
+    Stream a chat completion, timing it until the last chunk and counting its tokens and errors.
+
+    Token counts of streamed answers are estimated locally.
+
+    Args:
+        create: Zero-argument callable opening the completion stream
+        system_content: The system message, for the token estimate
+        user_content: The user message, for the token estimate
+        stage: Pipeline stage, used to label latency and token metrics
+
+    Yields:
+        str: Pieces of the generated text, in order
+
+    Raises:
+        Exception: The error that stopped the stream, after it is logged and counted
+    """
+    started = time.perf_counter()
+    completion_tokens = 0
+    try:
+        for chunk in create():
+            text = _chunk_text(chunk)
+            if text:
+                completion_tokens += estimate_tokens(text)
+                yield text
+        record_tokens(stage, estimate_tokens(system_content) + estimate_tokens(user_content), completion_tokens)
+    except Exception as e:
+        _openai_failed(stage, e)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service="openai", operation=stage)
+
+
+async def stream_completion_async(create, system_content, user_content, stage):
+    """Stream an awaited chat completion (see stream_completion); `create` is a coroutine function."""
+    started = time.perf_counter()
+    completion_tokens = 0
+    try:
+        async for chunk in await create():
+            text = _chunk_text(chunk)
+            if text:
+                completion_tokens += estimate_tokens(text)
+                yield text
+        record_tokens(stage, estimate_tokens(system_content) + estimate_tokens(user_content), completion_tokens)
+    except Exception as e:
+        _openai_failed(stage, e)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service="openai", operation=stage)
+
+
+def wants_stream(data, headers):
+    """
+    Check whether the client asked for a streamed (Server-Sent Events) answer.
+
+    Args:
+        data: The parsed JSON request body
+        headers: The request headers
+
+    Returns:
+        bool: True if the answer should be streamed
+    """
+    return bool(data.get("stream")) or "text/event-stream" in headers.get("Accept", "")
+
+
+def sse_event(payload, event=None):
+    """
+    Format a Server-Sent Event carrying a JSON payload.
+
+    Args:
+        payload: The data to send
+        event: Optional event name
+
+    Returns:
+        str: The encoded event
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+
+def answer_payload(text, extra, cached=False):
+    """
+    Body of a JSON answer: the text and the extra fields, with ANSWER_ERROR in "error" when there is no text.
+
+    Args:
+        text: The answer
+        extra: Additional fields for the response
+        cached: Whether the answer came from the answer cache
+
+    Returns:
+        dict: The response body
+    """
+    if cached:
+        return {**extra, "response": text, "cached": True}
+    if not text:
+        return {**extra, "response": text, "error": ANSWER_ERROR}
+    return {**extra, "response": text}
+
+
+def answer_events(stream, extra, cached_text=None, on_answer=None):
+    """
+    Send an answer as Server-Sent Events.
+
+    One {"token": ...} event is sent per piece of text, then a "done" event with
+    the full response and the extra fields. If the stream fails, an "error"
+    event with ANSWER_ERROR and the text received so far replaces "done". A
+    cached answer is sent as one token without opening the stream.
+
+    Args:
+        stream: Zero-argument callable returning the pieces of the answer
+        extra: Additional fields for the final event
+        cached_text: The cached answer, None if there is none
+        on_answer: Called with the full answer once it is complete (e.g. to cache it)
+
+    Yields:
+        str: The encoded events
+    """
+    if cached_text is not None:
+        yield sse_event({"token": cached_text})
+        yield sse_event(answer_payload(cached_text, extra, cached=True), event="done")
+        return
+
+    tokens = []
+    try:
+        for token in stream():
+            tokens.append(token)
+            yield sse_event({"token": token})
+    except Exception:
+        # Logged by the stream; the client gets an error, not an empty answer
+        yield sse_event({**extra, "error": ANSWER_ERROR, "response": "".join(tokens)}, event="error")
+        return
+    generated_text = "".join(tokens)
+    if on_answer:
+        on_answer(generated_text)
+    yield sse_event({**extra, "response": generated_text}, event="done")
+
+
+async def answer_events_async(stream, extra, cached_text=None, on_answer=None):
+    """Send an awaited answer as Server-Sent Events (see answer_events); `on_answer` is a coroutine function."""
+    if cached_text is not None:
+        yield sse_event({"token": cached_text})
+        yield sse_event(answer_payload(cached_text, extra, cached=True), event="done")
+        return
+
+    tokens = []
+    try:
+        async for token in stream():
+            tokens.append(token)
+            yield sse_event({"token": token})
+    except Exception:
+        # Logged by the stream; the client gets an error, not an empty answer
+        yield sse_event({**extra, "error": ANSWER_ERROR, "response": "".join(tokens)}, event="error")
+        return
+    generated_text = "".join(tokens)
+    if on_answer:
+        await on_answer(generated_text)
+    yield sse_event({**extra, "response": generated_text}, event="done")
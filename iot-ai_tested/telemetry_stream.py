@@ -0,0 +1,234 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from websockets.asyncio.client import connect
+
+# ------------------ Live Telemetry ------------------
+
+# Devices subscribed per WebSocket message
+SUBSCRIBE_BATCH = 100
+
+
+class TelemetryStore:
+    """
+    Latest telemetry and titles of the devices users ask about, pushed by ThingsBoard over a WebSocket.
+
+    Devices are added with `watch`, after their first REST fetch, and get a
+    latest-telemetry and a "title" attribute subscription on ThingsBoard's
+    WebSocket API. ThingsBoard answers each subscription with the current
+    values and then sends every change, so readings are read from memory
+    instead of being polled for each question.
+
+    A background thread keeps the connection. When it drops or its token
+    expires, the thread connects again with a fresh token, waiting
+    `reconnect_delay` seconds, doubled after each failed attempt up to
+    `max_reconnect_delay`, and subscribes every device again. Until a device's
+    subscription has sent its current values, and whenever the connection is
+    down, `devices` returns None so that callers fall back to REST. Devices
+    nobody asked about for `idle_timeout` seconds are unsubscribed and dropped.
+
+    Args:
+        ws_url: Telemetry WebSocket endpoint, e.g. "ws://localhost:8080/api/ws/plugins/telemetry"
+        token: Callable returning a valid JWT, called before each connection
+        reconnect_delay: Seconds before the first reconnection attempt
+        max_reconnect_delay: Longest wait between reconnection attempts
+        idle_timeout: Seconds a device stays subscribed after it was last read
+        open_timeout: Seconds to wait for the connection to open
+    """
+
+    def __init__(self, ws_url, token, reconnect_delay=1, max_reconnect_delay=60, idle_timeout=3600, open_timeout=10):
+        self.ws_url = ws_url
+        self.token = token
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.idle_timeout = idle_timeout
+        self.open_timeout = open_timeout
+        self.connected = False
+        # Device ID -> {"id", "name", "type", "title", "data", "live", "read"}
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._changed = None
+        # Owned by the connection thread: device ID -> its command IDs, and command ID -> (device ID, kind)
+        self._subscribed = {}
+        self._commands = {}
+        self._next_command = 0
+
+    def watch(self, devices):
+        """
+        Keep the telemetry of some devices current, starting the connection on first use.
+
+        Args:
+            devices (list): {"id", "name", "type", "title", "data"} for each device, as fetched over REST
+        """
+        now = time.monotonic()
+        with self._lock:
+            for device in devices:
+                record = self._devices.get(device["id"])
+                if record is None:
+                    self._devices[device["id"]] = dict(device, data=dict(device["data"]), live=False, read=now)
+                else:
+                    record.update(name=device["name"], type=device["type"], read=now)
+            if self._thread is None:
+                self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), name="telemetry-stream", daemon=True)
+                self._thread.start()
+            loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._changed.set)
+
+    def devices(self, device_ids):
+        """
+        Get the current name, type, title and latest telemetry of some devices.
+
+        Args:
+            device_ids (list): The device IDs
+
+        Returns:
+            list: {"id", "name", "type", "title", "data"} for each device, in order; "data" is
+                {key: [{"ts": ..., "value": ...}]}. None unless every device has live data.
+        """
+        now = time.monotonic()
+        with self._lock:
+            records = [self._devices.get(device_id) for device_id in device_ids]
+            if not self.connected or any(record is None or not record["live"] for record in records):
+                return None
+            devices = []
+            for record in records:
+                record["read"] = now
+                devices.append({
+                    "id": record["id"], "name": record["name"], "type": record["type"],
+                    "title": record["title"], "data": dict(record["data"])
+                })
+            return devices
+
+    def stats(self):
+        """
+        Connection state and device counts.
+
+        Returns:
+            dict: {"connected": bool, "devices": watched devices, "live": devices with live data}
+        """
+        with self._lock:
+            live = sum(record["live"] for record in self._devices.values())
+            return {"connected": self.connected, "devices": len(self._devices), "live": live}
+
+    async def _run(self):
+        """Connect, serve the connection until it drops, and connect again."""
+        self._changed = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        delay = self.reconnect_delay
+        while True:
+            try:
+                token = await asyncio.to_thread(self.token)
+                async with connect(f"{self.ws_url}?token={token}", open_timeout=self.open_timeout) as websocket:
+                    logging.info("Telemetry stream connected to %s", self.ws_url)
+                    delay = self.reconnect_delay
+                    await self._serve(websocket)
+                logging.warning("Telemetry stream closed by ThingsBoard, reconnecting in %.0fs", delay)
+            except Exception as e:
+                logging.warning(f"Telemetry stream disconnected, reconnecting in {delay:.0f}s: {e!r}")
+            finally:
+                self._disconnected()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _serve(self, websocket):
+        """Read updates while keeping the subscriptions in line with the watched devices."""
+        self._subscribed, self._commands = {}, {}
+        with self._lock:
+            self.connected = True
+        reader = asyncio.create_task(self._read(websocket))
+        subscriber = asyncio.create_task(self._subscribe(websocket))
+        done, pending = await asyncio.wait({reader, subscriber}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+
+    async def _read(self, websocket):
+        async for message in websocket:
+            self._receive(json.loads(message))
+
+    async def _subscribe(self, websocket):
+        """Subscribe new devices and drop idle ones whenever `watch` is called, and every so often."""
+        while True:
+            self._changed.clear()
+            await self._sync(websocket)
+            try:
+                await asyncio.wait_for(self._changed.wait(), min(60, self.idle_timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sync(self, websocket):
+        now = time.monotonic()
+        with self._lock:
+            idle = [device_id for device_id, record in self._devices.items() if now - record["read"] > self.idle_timeout]
+            for device_id in idle:
+                del self._devices[device_id]
+            new = [device_id for device_id in self._devices if device_id not in self._subscribed]
+
+        unsubscribe = {"tsSubCmds": [], "attrSubCmds": [], "historyCmds": []}
+        for device_id in idle:
+            for command_id in self._subscribed.pop(device_id, ()):
+                _, kind = self._commands.pop(command_id)
+                unsubscribe[kind].append(
+                    {"entityType": "DEVICE", "entityId": device_id, "cmdId": command_id, "unsubscribe": True}
+                )
+        if idle:
+            logging.info("Telemetry stream: unsubscribing %d idle devices", len(idle))
+            await websocket.send(json.dumps(unsubscribe))
+
+        for start in range(0, len(new), SUBSCRIBE_BATCH):
+            subscribe = {"tsSubCmds": [], "attrSubCmds": [], "historyCmds": []}
+            for device_id in new[start:start + SUBSCRIBE_BATCH]:
+                telemetry, title = self._next_command + 1, self._next_command + 2
+                self._next_command += 2
+                self._subscribed[device_id] = (telemetry, title)
+                self._commands[telemetry] = (device_id, "tsSubCmds")
+                self._commands[title] = (device_id, "attrSubCmds")
+                subscribe["tsSubCmds"].append(
+                    {"entityType": "DEVICE", "entityId": device_id, "scope": "LATEST_TELEMETRY", "cmdId": telemetry}
+                )
+                subscribe["attrSubCmds"].append(
+                    {"entityType": "DEVICE", "entityId": device_id, "keys": "title", "cmdId": title}
+                )
+            await websocket.send(json.dumps(subscribe))
+
+    def _receive(self, message):
+        """Apply one subscription update: {"subscriptionId", "errorCode", "data": {key: [[ts, value], ...]}}."""
+        command = self._commands.get(message.get("subscriptionId"))
+        if command is None:
+            return
+        device_id, kind = command
+        # A failed subscription (e.g. of a deleted device) still counts as answered, with no telemetry
+        if message.get("errorCode"):
+            logging.warning("Telemetry subscription of device %s failed: %s", device_id, message.get("errorMsg"))
+
+        latest = {
+            key: max(samples, key=lambda sample: sample[0])
+            for key, samples in (message.get("data") or {}).items() if samples
+        }
+        with self._lock:
+            record = self._devices.get(device_id)
+            if record is None:
+                return
+            if kind == "attrSubCmds":
+                if "title" in latest:
+                    record["title"] = latest["title"][1]
+                return
+            # Keys a device has never reported come with no timestamp
+            record["data"] = {
+                **record["data"],
+                **{key: [{"ts": ts, "value": value}] for key, (ts, value) in latest.items() if ts}
+            }
+            record["live"] = True
+
+    def _disconnected(self):
+        with self._lock:
+            self.connected = False
+            for record in self._devices.values():
+                record["live"] = False
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the app modules as app.py does, and the stub servers of the replay benchmark
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(APP_DIR), "benchmarks"))
+
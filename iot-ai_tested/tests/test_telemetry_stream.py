@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from stubs import ThingsBoardStub
+from telemetry_stream import TelemetryStore
+
+
+@pytest.fixture
+def thingsboard():
+    stub = ThingsBoardStub(devices=4).start()
+    yield stub
+    stub.stop()
+
+
+def rest_devices(stub):
+    """Devices as the app passes them to `watch` after their REST fetch."""
+    return [
+        {"id": device_id, "name": device["name"], "type": device["type"], "title": "", "data": {}}
+        for device_id, device in stub.devices.items()
+    ]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.01)
+
+
+def ws_calls(stub, command):
+    return sum(call == f"WS tsSubCmds {command}" for call in stub.calls)
+
+
+def test_devices_are_served_from_their_subscriptions(thingsboard):
+    store = TelemetryStore(thingsboard.ws_url, lambda: "token")
+    devices = rest_devices(thingsboard)
+    device_ids = [device["id"] for device in devices]
+    assert store.devices(device_ids) is None
+
+    store.watch(devices)
+    wait_until(lambda: store.devices(device_ids) is not None)
+
+    live = store.devices(device_ids)
+    assert [device["title"] for device in live] == [device["title"] for device in thingsboard.devices.values()]
+    assert set(live[1]["data"]) == set(thingsboard.devices[device_ids[1]]["keys"])
+    assert ws_calls(thingsboard, "subscribe") == 4
+    assert store.stats() == {"connected": True, "devices": 4, "live": 4}
+
+
+def test_pushed_values_replace_the_latest_reading(thingsboard):
+    store = TelemetryStore(thingsboard.ws_url, lambda: "token")
+    devices = rest_devices(thingsboard)
+    device_id = devices[1]["id"]
+    store.watch(devices)
+    wait_until(lambda: store.devices([device_id]) is not None)
+
+    thingsboard.push(device_id, "temperature", 99.9, ts=1700000060000)
+    wait_until(lambda: store.devices([device_id])[0]["data"]["temperature"][0]["ts"] == 1700000060000)
+    assert store.devices([device_id])[0]["data"]["temperature"] == [{"ts": 1700000060000, "value": "99.9"}]
+
+
+def test_unwatched_devices_are_not_served(thingsboard):
+    store = TelemetryStore(thingsboard.ws_url, lambda: "token")
+    devices = rest_devices(thingsboard)
+    store.watch(devices[:2])
+    wait_until(lambda: store.devices([devices[0]["id"], devices[1]["id"]]) is not None)
+    assert store.devices([devices[0]["id"], devices[2]["id"]]) is None
+
+
+def test_failed_subscription_counts_as_answered(thingsboard):
+    store = TelemetryStore(thingsboard.ws_url, lambda: "token")
+    deleted = {"id": "00000002-0000-4000-8000-0000000000ff", "name": "GONE", "type": "Sensor", "title": "", "data": {}}
+    store.watch([deleted])
+    wait_until(lambda: store.devices([deleted["id"]]) is not None)
+    assert store.devices([deleted["id"]])[0]["data"] == {}
+
+
+def test_reconnects_and_subscribes_again(thingsboard):
+    tokens = []
+
+    def token():
+        tokens.append(1)
+        return "token"
+
+    store = TelemetryStore(thingsboard.ws_url, token, reconnect_delay=0.05, max_reconnect_delay=0.1)
+    devices = rest_devices(thingsboard)
+    device_ids = [device["id"] for device in devices]
+    store.watch(devices)
+    wait_until(lambda: store.devices(device_ids) is not None)
+
+    thingsboard.drop_websockets()
+    wait_until(lambda: not store.stats()["connected"])
+    # REST takes over while the stream is down
+    assert store.devices(device_ids) is None
+
+    wait_until(lambda: store.devices(device_ids) is not None)
+    assert ws_calls(thingsboard, "subscribe") == 8
+    assert len(tokens) == 2
+
+
+def test_idle_devices_are_unsubscribed(thingsboard):
+    store = TelemetryStore(thingsboard.ws_url, lambda: "token", idle_timeout=0.2)
+    devices = rest_devices(thingsboard)
+    store.watch(devices)
+    wait_until(lambda: store.stats()["live"] == 4)
+
+    wait_until(lambda: store.stats()["devices"] == 0)
+    wait_until(lambda: ws_calls(thingsboard, "unsubscribe") == 4)
+    assert store.devices([devices[0]["id"]]) is None
+
+
+def test_read_devices_stay_subscribed(thingsboard):
+    store = TelemetryStore(thingsboard.ws_url, lambda: "token", idle_timeout=0.3)
+    devices = rest_devices(thingsboard)
+    store.watch(devices)
+    wait_until(lambda: store.stats()["live"] == 4)
+
+    for _ in range(6):
+        store.devices([devices[0]["id"]])
+        time.sleep(0.1)
+    assert store.stats()["devices"] == 1
+    assert store.devices([devices[0]["id"]]) is not None
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+import requests
+from tb_rest_client.rest_client_pe import RestClientPE
+
+from instrumentation import timed
+from resilience import stage_timeout
+
+# ------------------ ThingsBoard Session ------------------
+
+
+class ThingsBoardSession:
+    """
+    Process-wide ThingsBoard client that logs in once and keeps its JWT fresh.
+
+    Every request shares one logged-in RestClientPE, and with it one pooled set
+    of connections, instead of opening a client and logging in per request.
+    The token is renewed with the refresh token when it is within
+    `refresh_margin` seconds of expiring: one thread renews it while the
+    others carry on with the current token. Only an expired or rejected token
+    makes callers wait, and a new login is made only when the refresh fails.
+
+    The client is safe to share between threads: renewing the token replaces
+    its API client and controllers, and calls already running keep the ones
+    they started with.
+
+    Login and refresh requests are bounded by `timeout`, cut to what is left of
+    the request budget (see resilience.stage_timeout), and go through the
+    optional circuit breaker.
+
+    Args:
+        base_url: The ThingsBoard URL
+        username: ThingsBoard user
+        password: Its password
+        pool_size: Maximum number of pooled connections kept open to ThingsBoard
+        refresh_margin: Seconds before the token expires at which it is renewed
+        timeout: Seconds a login or token refresh may take
+        breaker: CircuitBreaker guarding the login and refresh requests (optional)
+    """
+
+    def __init__(self, base_url, username, password, pool_size=10, refresh_margin=300, timeout=None, breaker=None):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.pool_size = pool_size
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self.breaker = breaker
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        """
+        Get the shared client, logging in or renewing its token first when needed.
+
+        Returns:
+            RestClientPE: The logged-in client
+
+        Raises:
+            Exception: When there is no valid token and logging in fails
+        """
+        client = self._client
+        expires_in = client.token_info["exp"] - time.time() if client else 0
+        if expires_in > self.refresh_margin:
+            return client
+
+        # The token still works: renew it if no other thread is, and use it meanwhile
+        if expires_in > 0:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._renew(client)
+                except Exception as e:
+                    logging.warning(f"ThingsBoard token renewal failed, {expires_in:.0f}s left on the token: {e!r}")
+                finally:
+                    self._lock.release()
+            return self._client
+
+        with self._lock:
+            # Another thread may have renewed it while this one waited
+            if self._client is client:
+                self._renew(client)
+            if self._client is None:
+                raise ConnectionError("Not logged in to ThingsBoard")
+            return self._client
+
+    def invalidate(self):
+        """Drop the token after ThingsBoard rejected it, so the next caller logs in again."""
+        with self._lock:
+            self._client = None
+
+    def _renew(self, client):
+        """Refresh the client's token, or log in with a new client if that fails."""
+        if client is not None and client.token_info.get("refreshToken"):
+            try:
+                tokens = self._post("/api/auth/token", {"refreshToken": client.token_info["refreshToken"]}, "refresh_token")
+                client.token_login(tokens["token"], tokens["refreshToken"])
+                return
+            except Exception as e:
+                logging.warning(f"ThingsBoard token refresh failed, logging in again: {e!r}")
+
+        tokens = self._post("/api/auth/login", {"username": self.username, "password": self.password}, "login")
+        client = RestClientPE(base_url=self.base_url)
+        client.configuration.connection_pool_maxsize = self.pool_size
+        client.token_login(tokens["token"], tokens["refreshToken"])
+        client.logged_in = True
+        self._client = client
+
+    def _post(self, path, payload, operation):
+        """Make a timed, bounded authentication request and return its tokens."""
+        timeout = stage_timeout(self.timeout)
+        guard = self.breaker.guard() if self.breaker else nullcontext()
+        with timed("thingsboard", operation), guard:
+            response = requests.post(self.base_url + path, json=payload, timeout=timeout)
+            response.raise_for_status()
+            tokens = response.json()
+        if not tokens.get("token"):
+            raise ConnectionError(f"ThingsBoard sent no token: {tokens}")
+        return tokens
@@ -1,25 +1,62 @@
+import hashlib
+import logging
 import os
-import requests
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import json
-from rapidfuzz import process
+from rapidfuzz import fuzz, process, utils
 import re
+import tempfile
 from typing import Tuple
 import openai
-from flask import Flask, make_response, render_template, request, jsonify, session
+from flask import Flask, Response, g, make_response, render_template, request, jsonify, session, stream_with_context
 from countryinfo import CountryInfo
 from dotenv import load_dotenv
+from cache import LastGoodData, TieredCache
+from concurrency import bounded_map, fan_out
+from fleet_snapshot import FleetSnapshot
+from instrumentation import CONTENT_TYPE, Counter, install_request_id_logging, register_cache, render
+from prompt_encoding import encode_rows, format_value
+from pipeline import run_steps, upstream
+from resilience import CircuitBreaker, call_with_timeout, register_breakers, stage_deadline, stage_timeout
+from series_summary import records_to_arrays, summarize_series
+from serving import (
+    SSE_HEADERS, answer_events, answer_payload, chat_request, complete, register_request_hooks, stream_completion,
+    wants_stream
+)
+from zabbix_client import ZabbixAPIError, ZabbixClient
 
 load_dotenv()
 
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s'
+)
+install_request_id_logging()
+
 # ------------------ Configuration and Constants ------------------
 # Zabbix API Configuration
 ZABBIX_API_TOKEN = os.getenv('ZABBIX_API_TOKEN')
 ZABBIX_URL = os.getenv('ZABBIX_URL')
-ZABBIX_HEADERS = {
-    "Content-Type": "application/json-rpc"
-}
+
+# Circuit breakers: consecutive failures that open an upstream's circuit, and
+# the seconds before a trial call is let through again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+ZABBIX_BREAKER = CircuitBreaker("zabbix", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+OPENAI_BREAKER = CircuitBreaker("openai", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+register_breakers(ZABBIX_BREAKER, OPENAI_BREAKER)
+
+# Shared, pooled Zabbix connection used by every Zabbix API call
+zabbix = ZabbixClient(
+    ZABBIX_URL,
+    token=ZABBIX_API_TOKEN,
+    pool_size=int(os.getenv('ZABBIX_POOL_SIZE', 10)),
+    connect_timeout=float(os.getenv('ZABBIX_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('ZABBIX_READ_TIMEOUT', 30)),
+    max_retries=int(os.getenv('ZABBIX_MAX_RETRIES', 2)),
+    breaker=ZABBIX_BREAKER
+)
 
 # OpenAI API Configuration
 openai.api_type = os.getenv('OPENAI_API_TYPE')
@@ -43,6 +80,128 @@ DASHBOARDS = {
     "Haiti": 118
 }
 
+# Send independent per-host calls as one JSON-RPC batch (one round trip, run
+# sequentially by Zabbix, the default) or as concurrent requests on the fetch
+# pool (parallel on the server; see concurrency.py)
+ZABBIX_BATCH_REQUESTS = os.getenv('ZABBIX_BATCH_REQUESTS', '1') == '1'
+ZABBIX_FETCH_TIMEOUT = float(os.getenv('ZABBIX_FETCH_TIMEOUT', 30))
+
+# Latency budget of a request, the part of it the Zabbix fetches of a query may
+# use, and the longest time an answer or a routing decision may wait for OpenAI
+REQUEST_BUDGET = float(os.getenv('REQUEST_BUDGET', 30))
+ZABBIX_STAGE_BUDGET = float(os.getenv('ZABBIX_STAGE_BUDGET', 8))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 20))
+OPENAI_ROUTING_TIMEOUT = float(os.getenv('OPENAI_ROUTING_TIMEOUT', 8))
+
+# Zabbix fields the handlers actually use (keeps API payloads small)
+HOST_FIELDS = ["hostid", "host", "name", "description"]
+INVENTORY_FIELDS = ["name", "model", "location", "notes"]
+ITEM_FIELDS = ["itemid", "name", "name_resolved", "key_", "description", "lastvalue", "lastclock", "units", "value_type"]
+PROBLEM_FIELDS = ["eventid", "objectid", "name", "severity", "clock", "acknowledged"]
+ACKNOWLEDGE_FIELDS = ["action", "new_severity", "message", "clock"]
+
+# Metrics sent to the model: at most METRIC_TOP_K, within METRIC_TOKEN_BUDGET tokens
+METRIC_TOP_K = int(os.getenv('METRIC_TOP_K', 25))
+METRIC_TOKEN_BUDGET = int(os.getenv('METRIC_TOKEN_BUDGET', 1200))
+
+# History queries: window when the query names none, longest window read from
+# raw history (trends beyond it), metrics summarized, points fetched per call,
+# points in the downsampled series, and the token budget of the summary table
+HISTORY_DEFAULT_WINDOW = int(os.getenv('HISTORY_DEFAULT_WINDOW', 24 * 3600))
+HISTORY_RAW_MAX_WINDOW = int(os.getenv('HISTORY_RAW_MAX_WINDOW', 2 * 24 * 3600))
+HISTORY_TOP_K = int(os.getenv('HISTORY_TOP_K', 3))
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', 100000))
+HISTORY_BUCKETS = int(os.getenv('HISTORY_BUCKETS', 12))
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 800))
+# Unix time history windows end at, for replays and tests (empty: the current time)
+HISTORY_NOW = os.getenv('HISTORY_NOW', '')
+
+# Words and phrases that ask how a metric behaved over time rather than its
+# current value. Words that also fit current-state questions ("has the VSAT
+# been down?", "average load") only count with a time window (see history_window).
+HISTORY_KEYWORDS = [
+    "history", "historical", "trend", "trends", "trended", "trending", "over time", "peak", "peaks", "peaked",
+    "spike", "spikes", "spiked", "fluctuate", "fluctuated", "fluctuating", "so far today", "all day"
+]
+
+# Seconds per unit for time windows named in queries
+TIME_UNITS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+
+# Token budget for a device's problem table
+PROBLEM_TOKEN_BUDGET = int(os.getenv('PROBLEM_TOKEN_BUDGET', 600))
+
+# Prompt table columns: (field, header)
+METRIC_COLUMNS = [("name", "Metric"), ("description", "Description"), ("value", "Value"), ("units", "Units")]
+PROBLEM_COLUMNS = [("name", "Problem"), ("severity", "Severity"), ("detail", "Detail")]
+HISTORY_COLUMNS = [
+    ("name", "Metric"), ("units", "Units"), ("points", "Points"), ("min", "Min"), ("mean", "Mean"),
+    ("p50", "P50"), ("p95", "P95"), ("max", "Max"), ("first", "First"), ("last", "Last"),
+    ("above", "Time Above Threshold"), ("changes", "Level Shifts"), ("series", "Downsampled Means")
+]
+
+# Background fleet snapshot: refresh interval (0, the default, disables it, as
+# every worker polls Zabbix on its own), full re-pull interval, the oldest
+# snapshot data /home will answer from, and the most history records an
+# incremental refresh reads before it re-pulls instead
+FLEET_SNAPSHOT_INTERVAL = float(os.getenv('FLEET_SNAPSHOT_INTERVAL', 0))
+FLEET_SNAPSHOT_FULL_REFRESH = float(os.getenv('FLEET_SNAPSHOT_FULL_REFRESH', 3600))
+FLEET_SNAPSHOT_MAX_STALENESS = float(os.getenv('FLEET_SNAPSHOT_MAX_STALENESS', 300))
+FLEET_SNAPSHOT_HISTORY_LIMIT = int(os.getenv('FLEET_SNAPSHOT_HISTORY_LIMIT', 10000))
+
+# Directory of the cache tier shared by all worker processes on this host
+# (empty keeps every cache in-process), and the longest time a worker serves
+# an entry from memory before reading the shared tier again
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'lucy-nms-cache'))
+CACHE_LOCAL_TTL = float(os.getenv('CACHE_LOCAL_TTL', 60))
+
+# Parsed dashboard device maps, shared by the GET and POST /home handlers
+DASHBOARD_CACHE = TieredCache(
+    "dashboards",
+    ttl=float(os.getenv('DASHBOARD_CACHE_TTL', 900)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+
+# Final answers keyed on the normalized query, host and the device data in the prompt
+ANSWER_CACHE = TieredCache(
+    "answers",
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 300)),
+    maxsize=int(os.getenv('ANSWER_CACHE_SIZE', 512)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+
+# Last data fetched for each dashboard, host and fleet status, served (marked
+# stale) when a fresh fetch fails or misses its deadline
+LAST_GOOD_CACHE = TieredCache(
+    "last_good",
+    ttl=float(os.getenv('STALE_DATA_TTL', 24 * 3600)),
+    maxsize=int(os.getenv('STALE_DATA_SIZE', 2048)),
+    directory=CACHE_DIR or None,
+    local_ttl=CACHE_LOCAL_TTL
+)
+LAST_GOOD = LastGoodData(LAST_GOOD_CACHE)
+
+# Cache hit/miss counters on /metrics
+register_cache("answer", ANSWER_CACHE)
+register_cache("dashboard", DASHBOARD_CACHE)
+register_cache("last_good", LAST_GOOD_CACHE)
+
+# Where host data for an answer came from: the fleet snapshot or a live Zabbix call
+HOST_CONTEXT_SOURCE = Counter("lucy_host_context_total", "Host data lookups, by source.", ("source",))
+
+# Failed or late fetches answered with the last good data instead
+STALE_DATA = Counter("lucy_stale_data_total", "Fetches answered with the last good data, by kind.", ("kind",))
+
+# System messages for general answers and device analysis
+GENERAL_SYSTEM_CONTENT = "You are Lucy, a network monitoring assistant specialized in analyzing device information for the UNDP ITM."
+ANALYSIS_SYSTEM_CONTENT = "You are a helpful assistant for network monitoring."
+
+# Local device resolution: minimum fuzzy score to accept a device, and the
+# lead it needs over the next-best device before we skip the LLM
+DEVICE_MATCH_THRESHOLD = float(os.getenv('DEVICE_MATCH_THRESHOLD', 85))
+DEVICE_MATCH_MARGIN = float(os.getenv('DEVICE_MATCH_MARGIN', 10))
+
 # Infrastructure Types
 INFRASTRUCTURES = [
     "OneICTbox",
@@ -55,6 +214,55 @@ INFRASTRUCTURES = [
     "VOIP VSAT",
 ]
 
+# Network vocabulary used by the local need_nms router
+NETWORK_KEYWORDS = [
+    "network", "device", "devices", "host", "hosts", "latency", "ping", "packet", "packet loss",
+    "bandwidth", "throughput", "traffic", "uptime", "downtime", "offline", "online", "outage",
+    "interface", "interfaces", "port", "ports", "link", "router", "switch", "firewall", "server",
+    "cpu", "memory", "disk", "battery", "signal", "snr", "vpn", "dns", "voip", "satellite", "modem",
+    "wan", "lan", "wifi", "problem", "problems", "alert", "alerts", "alarm", "alarms", "trigger",
+    "triggers", "incident", "severity", "monitoring", "zabbix", "nms", "metric", "metrics"
+]
+
+# Small talk that never needs NMS data
+SMALL_TALK_KEYWORDS = [
+    "hi", "hello", "hey", "thanks", "thank you", "good morning", "good afternoon",
+    "good evening", "who are you", "what can you do", "how are you", "bye"
+]
+
+# Words that ask about a device's problems rather than its metrics
+PROBLEM_KEYWORDS = [
+    "problem", "problems", "issue", "issues", "alert", "alerts", "alarm", "alarms", "trigger",
+    "triggers", "incident", "incidents", "error", "errors", "fault", "faults"
+]
+
+# Device data a plan can ask for, in the order it is listed
+DATA_KINDS = ("metrics", "problems", "history")
+
+# Plan routing and host selection with one structured LLM call instead of two
+NMS_PLANNING_MODE = os.getenv('NMS_PLANNING_MODE', '1') == '1'
+
+# Confidence the local router needs before it skips the LLM
+NMS_ROUTER_CONFIDENCE = float(os.getenv('NMS_ROUTER_CONFIDENCE', 0.8))
+
+# Phrases that ask about every country rather than the chosen dashboard. A
+# bare "which country" or "across all" also fits single-site questions ("which
+# country is this router in", "errors across all interfaces"), so only their
+# comparing and plural-site forms are listed.
+FLEET_KEYWORDS = [
+    "all countries", "every country", "each country", "which countries", "which country has",
+    "which country had", "which country sees", "which country reports", "across countries",
+    "across all countries", "across all sites", "across all offices", "all sites", "every site",
+    "all offices", "fleet", "worldwide", "globally", "everywhere"
+]
+
+# Problem names that mean a device is down rather than degraded
+DOWN_PROBLEM_KEYWORDS = ["unavailable", "unreachable", "not available", "down", "no data", "offline"]
+
+# Fleet queries: dashboards fetched at once, and problems listed per infrastructure type
+FLEET_CONCURRENCY = int(os.getenv('FLEET_CONCURRENCY', 4))
+FLEET_PROBLEMS_PER_TYPE = int(os.getenv('FLEET_PROBLEMS_PER_TYPE', 10))
+
 # Weather detection keywords
 # WEATHER_KEYWORDS = [
 #     "weather", "forecast", "climate", "rain", "snow", "humidity", "temperature",
@@ -72,37 +280,119 @@ def add_ngrok_header(response):
     response.headers["ngrok-skip-browser-warning"] = "true"
     return response
 
+# Request IDs, latency budgets and request latency metrics
+register_request_hooks(app, request, g, REQUEST_BUDGET)
+
 # ------------------ Utility Functions ------------------
 
-def use_openai(system_content, user_content):
+def use_openai(system_content, user_content, temperature=0.7, max_tokens=800, stage="answer", timeout=OPENAI_TIMEOUT):
     """
     Make a request to OpenAI API with the given content.
     
     Args:
         system_content: The system message for GPT
         user_content: The user query for GPT
+        temperature: Sampling temperature (default: 0.7)
+        max_tokens: Maximum tokens in the completion (default: 800)
+        stage: Pipeline stage, used to label latency and token metrics
+        timeout: Longest time the call may take, cut to the request budget
         
     Returns:
         str: The GPT-generated response or empty string on error
     """
-    try:
-        completion = openai.chat.completions.create(
-            model="gpt-4o-itm-sicu",  
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": user_content}
-            ],  
-            temperature=0.7,
-            max_tokens=800,
-            top_p=0.95,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None
+    def create():
+        limit = stage_timeout(timeout)
+        with OPENAI_BREAKER.guard():
+            # The SDK timeout applies to each retry; the outer wait bounds them all
+            return call_with_timeout(lambda: openai.chat.completions.create(
+                **chat_request(system_content, user_content, temperature, max_tokens, limit)
+            ), limit)
+
+    return complete(create, stage)
+
+def stream_openai(system_content, user_content, temperature=0.7, max_tokens=800, stage="answer", timeout=OPENAI_TIMEOUT):
+    """
+    Stream a response from OpenAI API as it is generated.
+    
+    Args:
+        system_content: The system message for GPT
+        user_content: The user query for GPT
+        temperature: Sampling temperature (default: 0.7)
+        max_tokens: Maximum tokens in the completion (default: 800)
+        stage: Pipeline stage, used to label latency and token metrics
+        timeout: Longest wait for the stream or its next chunk, cut to the request budget
+        
+    Returns:
+        generator: Pieces of the GPT-generated response, in order (see serving.stream_completion)
+    """
+    def create():
+        limit = stage_timeout(timeout)
+        with OPENAI_BREAKER.guard():
+            return call_with_timeout(lambda: openai.chat.completions.create(
+                **chat_request(system_content, user_content, temperature, max_tokens, limit, stream=True)
+            ), limit)
+
+    return stream_completion(create, system_content, user_content, stage)
+
+def answer_cache_key(query, hostid, device_data):
+    """
+    Build the answer cache key for a query.
+    
+    The device data is the metric/problem text that goes into the prompt, so a
+    change in device state produces a new key.
+    
+    Args:
+        query: The user's query
+        hostid: The resolved host ID ("" when no device is involved)
+        device_data: The device data included in the prompt
+        
+    Returns:
+        str: The cache key
+    """
+    fingerprint = hashlib.sha256(device_data.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{normalize(query)}|{hostid}|{fingerprint}".encode("utf-8")).hexdigest()
+
+def store_answer(cache_key, generated_text):
+    """Log a generated answer and keep it in ANSWER_CACHE when it has a key."""
+    logging.info("Decision AI Answer: %s", generated_text)
+    if cache_key and generated_text:
+        ANSWER_CACHE.set(cache_key, generated_text)
+
+def answer_response(system_content, user_content, data, extra=None, cache_key=None, stage="answer"):
+    """
+    Answer the query with a GPT completion, streamed as Server-Sent Events when requested.
+    
+    The answer is sent as serving.answer_events or serving.answer_payload
+    describe, with ANSWER_ERROR when the model fails. When a cache key is given,
+    a cached answer is returned without calling GPT and new answers are stored.
+    
+    Args:
+        system_content: The system message for GPT
+        user_content: The user query or prompt for GPT
+        data: The parsed JSON request body
+        extra: Additional fields for the response (optional)
+        cache_key: Key in ANSWER_CACHE (optional, see answer_cache_key)
+        stage: Pipeline stage, used to label latency and token metrics
+        
+    Returns:
+        Response: JSON or text/event-stream response
+    """
+    extra = extra or {}
+    cached_text = ANSWER_CACHE.get(cache_key) if cache_key else None
+
+    if wants_stream(data, request.headers):
+        events = answer_events(
+            lambda: stream_openai(system_content, user_content, stage=stage), extra, cached_text,
+            on_answer=lambda generated_text: store_answer(cache_key, generated_text)
         )
-        return completion.choices[0].message.content
-    except Exception as e:
-        print(f"Error with OpenAI API: {e}")
-        return ""
+        return Response(stream_with_context(events), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+    if cached_text is not None:
+        return jsonify(answer_payload(cached_text, extra, cached=True))
+
+    generated_text = use_openai(system_content, user_content, stage=stage)
+    store_answer(cache_key, generated_text)
+    return jsonify(answer_payload(generated_text, extra))
 
 def jsonify_with_ngrok(data, status_code=200):
     """
@@ -131,9 +421,9 @@ def save_to_json(data, filename):
     try:
         with open(filename, "w") as file:
             json.dump(data, file, indent=4)
-        print(f"Data saved to {filename}")
+        logging.info("Data saved to %s", filename)
     except Exception as e:
-        print(f"Error saving to JSON file: {e}")
+        logging.error("Error saving to JSON file: %s", e)
 
 def normalize(text):
     """
@@ -161,30 +451,37 @@ def get_dashboard_info(dashboard_id, token):
         list: Dashboard data if successful, None otherwise
     """
     try:
-        request_data = {
-            "jsonrpc": "2.0",
-            "method": "dashboard.get",
-            "params": {
-                "output": "extend",
-                "dashboardids": [dashboard_id],
-                "selectPages": "extend"
-            },
-            "auth": token,
-            "id": 1
-        }
-        response = requests.post(ZABBIX_URL, headers=ZABBIX_HEADERS, json=request_data)
-        response.raise_for_status()
-        data = response.json()
-        
-        if "error" in data:
-            print(f"Error: {data['error']['message']} - {data['error']['data']}")
-            return None
-        
-        return data.get("result", [])
-    except Exception as e:
-        print(f"Error fetching dashboard info: {e}")
+        return zabbix.call("dashboard.get", {
+            "output": "extend",
+            "dashboardids": [dashboard_id],
+            "selectPages": "extend"
+        }, token)
+    except ZabbixAPIError as e:
+        logging.error("Error fetching dashboard info: %s", e)
         return None
 
+def host_info_params(hostid, include_items=True):
+    """Build the host.get parameters used to describe a single device."""
+    params = {
+        "output": HOST_FIELDS,
+        "hostids": hostid,
+        "selectInventory": INVENTORY_FIELDS
+    }
+    if include_items:
+        params["selectItems"] = ITEM_FIELDS
+    return params
+
+def problem_params(hostid):
+    """Build the problem.get parameters used to list a device's recent problems."""
+    return {
+        "output": PROBLEM_FIELDS,
+        "hostids": hostid,
+        "recent": True,
+        "selectAcknowledges": ACKNOWLEDGE_FIELDS,
+        "sortfield": ["eventid"],
+        "sortorder": "DESC"
+    }
+
 def get_host_info(hostid, token):
     """
     Fetch detailed information about a host device.
@@ -197,31 +494,9 @@ def get_host_info(hostid, token):
         list: Host information if successful, None otherwise
     """
     try:
-        request_data = {
-            "jsonrpc": "2.0",
-            "method": "host.get",
-            "params": {
-                "output": "extend",
-                "hostids": hostid,
-                "selectItems": "extend",
-                "selectTriggers": "extend",
-                "selectInventory": "extend"
-            },
-            "auth": token,
-            "id": 1
-        }
-
-        response = requests.post(ZABBIX_URL, headers=ZABBIX_HEADERS, json=request_data)
-        response.raise_for_status()
-        data = response.json()
-
-        if "error" in data:
-            print(f"Error: {data['error']['message']} - {data['error']['data']}")
-            return None
-            
-        return data.get("result", [])
-    except Exception as e:
-        print(f"Error fetching host information: {e}")
+        return zabbix.call("host.get", host_info_params(hostid), token)
+    except ZabbixAPIError as e:
+        logging.error("Error fetching host information: %s", e)
         return None
 
 def get_problems(hostid, token):
@@ -236,34 +511,71 @@ def get_problems(hostid, token):
         list: Problems if successful, empty list otherwise
     """
     try:
-        request_data = {
-            "jsonrpc": "2.0",
-            "method": "problem.get",
-            "params": {
-                "output": "extend",
-                "hostids": hostid,
-                "recent": True,
-                "selectAcknowledges": "extend",
-                "selectTags": "extend",
-                "sortfield": ["eventid"],
-                "sortorder": "DESC"
-            },
-            "auth": token,
-            "id": 1
-        }
+        return zabbix.call("problem.get", problem_params(hostid), token)
+    except ZabbixAPIError as e:
+        logging.error("Error fetching problems: %s", e)
+        return []
+
+def zabbix_batch(calls):
+    """
+    Send Zabbix calls as one JSON-RPC batch, or concurrently with ZABBIX_BATCH_REQUESTS disabled.
+    
+    Args:
+        calls: (method, params) tuples
         
-        response = requests.post(ZABBIX_URL, headers=ZABBIX_HEADERS, json=request_data)
-        response.raise_for_status()
-        data = response.json()
+    Returns:
+        list: The result of each call, in order; a failed call's result is its ZabbixAPIError
         
-        if "error" in data:
-            print(f"Error: {data['error']['message']} - {data['error']['data']}")
-            return []
+    Raises:
+        ZabbixAPIError: When the batch itself fails
+    """
+    if ZABBIX_BATCH_REQUESTS:
+        return zabbix.batch(calls, return_exceptions=True)
+
+    def call(method, params):
+        try:
+            return zabbix.call(method, params)
+        except ZabbixAPIError as e:
+            return e
+
+    tasks = {index: (lambda method=method, params=params: call(method, params)) for index, (method, params) in enumerate(calls)}
+    defaults = {index: ZabbixAPIError(f"{method} timed out") for index, (method, _) in enumerate(calls)}
+    results = fan_out(tasks, timeout=ZABBIX_FETCH_TIMEOUT, defaults=defaults)
+    return [results[index] for index in range(len(calls))]
+
+def host_details_steps(hostid, include_items=True, include_problems=True):
+    """
+    Fetch host information and, optionally, its problems in a single round trip (a pipeline).
+    
+    Args:
+        hostid: The ID of the host
+        include_items: Whether to fetch the host's items (metrics)
+        include_problems: Whether to fetch the host's problems as well
         
-        return data.get("result", [])
-    except Exception as e:
-        print(f"Error fetching problems: {e}")
-        return []
+    Returns:
+        tuple: (host information or None, list of problems)
+    """
+    calls = [("host.get", host_info_params(hostid, include_items))]
+    if include_problems:
+        calls.append(("problem.get", problem_params(hostid)))
+
+    try:
+        results = yield upstream("zabbix_batch", calls)
+    except ZabbixAPIError as e:
+        logging.error("Error fetching host details: %s", e)
+        return None, []
+
+    hostinfo = results[0]
+    if isinstance(hostinfo, ZabbixAPIError):
+        logging.error("Error fetching host information: %s", hostinfo)
+        hostinfo = None
+
+    problems = results[1] if include_problems else []
+    if isinstance(problems, ZabbixAPIError):
+        logging.error("Error fetching problems: %s", problems)
+        problems = []
+
+    return hostinfo, problems
 
 def get_hostid(widgets):
     """
@@ -285,168 +597,1542 @@ def get_hostid(widgets):
 
     return list(hostids_set)
 
-# ------------------ AI Decision Functions ------------------
-
-def need_nms(query: str, infrastructures: list) -> bool:
+def parse_dashboard_devices(dashboard_info):
     """
-    Determine if the query requires NMS (Network Management System).
+    Build the device map of a dashboard from its pages.
+    
+    Each dashboard page describes one device; its widgets reference the host.
     
     Args:
-        query: The user's query
-        infrastructures: List of infrastructure types
+        dashboard_info: Dashboard data returned by get_dashboard_info
         
     Returns:
-        bool: True if NMS is needed, False otherwise
+        dict: {"devices": {page name: hostid}, "widget_types": {page name: [widget types]}}
     """
-    prompt = (
-        "You are an intelligent IT and network assistant.\n"
-        "You have a list of possible infrastructures:\n"
-        f"{infrastructures}\n\n"
-        "Here is the user's query:\n"
-        f"'{query}'\n\n"
-        "If the user is asking about any of these infrastructures, "
-        "network devices, or network monitoring details, return ONLY 'YES'.\n"
-        "Otherwise, return ONLY 'NO'."
-    )
+    country_devices = {}
+    widget_types = {}
 
-    system_content = "You decide if the user query references any of the listed infrastructures or network systems."
-    answer = use_openai(system_content, prompt)
-    
-    answer = answer.strip().upper()
-    return True if "YES" in answer else False
+    for dashboard in dashboard_info:
+        for page in dashboard.get("pages", []):
+            name = page.get("name")
+            widgets = page.get("widgets", [])
+            hostids = get_hostid(widgets)
 
-# def is_weather_query(text: str, threshold: int = 95) -> Tuple[bool, str]:
-#     """
-#     Check if the query is related to weather.
+            if len(hostids) > 1:
+                logging.warning("Multiple Hosts on One Device: %s", name)
+            if hostids == []:
+                continue
+
+            country_devices[name] = hostids[0]
+            widget_types[name] = [widget.get("type") for widget in widgets]
+
+    return {"devices": country_devices, "widget_types": widget_types}
+
+def load_dashboard_devices(dashboard_id):
+    """
+    Get the parsed device map of a dashboard, fetching it from Zabbix on a cache miss.
     
-#     Args:
-#         text: The user's query
-#         threshold: Matching threshold (default: 95)
+    Args:
+        dashboard_id: The ID of the dashboard
         
-#     Returns:
-#         tuple: (is_weather, matched_term)
-#     """
-#     text_cleaned = re.sub(r'[^\w\s]', '', text)
-#     text_lower = text_cleaned.lower()
-#     words = text_lower.split()
+    Returns:
+        dict: The parsed dashboard (see parse_dashboard_devices), None if it cannot be fetched
+    """
+    return run_pipeline(dashboard_devices_steps(dashboard_id))
+
+def dashboard_devices_steps(dashboard_id):
+    """
+    The pipeline of load_dashboard_devices.
     
-#     for word in words:
-#         best_match, match_score, _ = process.extractOne(word, WEATHER_KEYWORDS)
-#         if match_score >= threshold:
-#             return True, best_match
+    Cache reads and writes are "thread" steps: the shared cache tier is on disk.
+    """
+    key = str(dashboard_id)
+    dashboard_devices = yield upstream("thread", DASHBOARD_CACHE.get, key)
+    if dashboard_devices is not None:
+        return with_device_index(dashboard_devices)
 
-#     return False, ""
+    try:
+        dashboard_info = yield upstream("zabbix", "dashboard.get", {
+            "output": "extend",
+            "dashboardids": [dashboard_id],
+            "selectPages": "extend"
+        })
+    except ZabbixAPIError as e:
+        logging.error("Error fetching dashboard info: %s", e)
+        dashboard_info = None
+    if not dashboard_info:
+        return (yield upstream("thread", stale_dashboard_devices, dashboard_id))
 
-# def extract_city_from_query(query: str, matched_country) -> str:
-#     """
-#     Extract city name from query, defaulting to country capital if none found.
+    dashboard_devices = parse_dashboard_devices(dashboard_info)
+    yield upstream("thread", store_dashboard_devices, key, dashboard_devices)
+    return with_device_index(dashboard_devices)
+
+def store_dashboard_devices(key, dashboard_devices):
+    """Cache a freshly parsed dashboard and keep it as its fallback."""
+    DASHBOARD_CACHE.set(key, dashboard_devices)
+    LAST_GOOD.remember("dashboard", key, dashboard_devices)
+
+def stale_dashboard_devices(dashboard_id):
+    """
+    Get the last device map fetched for a dashboard, after a failed or late fetch.
     
-#     Args:
-#         query: The user's query
-#         matched_country: The country for capital fallback
+    Args:
+        dashboard_id: The ID of the dashboard
         
-#     Returns:
-#         str: The detected city name
-#     """
-#     prompt = (
-#         "Extract the city name from the following query. "
-#         "If no city name is present, return 'Unknown'. "
-#         f"Query: '{query}'"
-#     )
+    Returns:
+        dict: The parsed dashboard (see parse_dashboard_devices), None if it was never fetched
+    """
+    dashboard_devices, age = LAST_GOOD.get("dashboard", str(dashboard_id))
+    if dashboard_devices is None:
+        return None
+    logging.warning("Dashboard %s unavailable, using its device map from %.0fs ago", dashboard_id, age)
+    STALE_DATA.inc(kind="dashboard")
+    return with_device_index(dashboard_devices)
+
+def with_device_index(dashboard_devices):
+    """
+    Attach the fuzzy device index to a parsed dashboard.
     
-#     system_content = "You are a helpful assistant for extracting Cities from text."
-#     city = use_openai(system_content, prompt)
+    The index is built in each worker process and is not stored in the shared
+    cache tier (it is attached after the dashboard has been cached).
     
-#     if not city or city.lower() == "unknown":
-#         country = CountryInfo(matched_country)
-#         city = country.capital()
+    Args:
+        dashboard_devices: The parsed dashboard (see parse_dashboard_devices)
         
-#     return city
+    Returns:
+        dict: The same dashboard with an "index" DeviceIndex
+    """
+    if "index" not in dashboard_devices:
+        dashboard_devices["index"] = DeviceIndex(dashboard_devices["devices"])
+    return dashboard_devices
 
-def resolve_host_id(country_devices_query, query):
+def country_for_dashboard(dashboard_id):
     """
-    Match user query to a specific host/device ID.
+    Look up the country of a dashboard ID.
     
     Args:
-        country_devices_query: String with device information
-        query: The user's query
+        dashboard_id: The ID of the dashboard (int or string)
         
     Returns:
-        str: Host ID if found, '-1' otherwise
+        str: The country name, or an empty string if unknown
     """
-    prompt = (
-        f"Match the user's query to a device and return ONLY the corresponding HostID.\n"
-        f"Here is the list of devices:\n"
-        f"{country_devices_query}\n\n"
-        f"User's question: {query}\n\n"
-        "Return ONLY the HostID as a number. If no match is found, return -1."
-    )
+    for country, country_dashboard_id in DASHBOARDS.items():
+        if str(country_dashboard_id) == str(dashboard_id):
+            return country
+    return ""
 
-    system_content = "You are an intelligent IT and network assistant."
-    return use_openai(system_content, prompt)
+def invalidate_dashboard(dashboard_id=None):
+    """
+    Drop the cached device map of a dashboard, or of every dashboard when no ID is given.
     
-def match_country(query, dashboards):
+    Args:
+        dashboard_id: The ID of the dashboard (optional)
     """
-    Match user query to a country and return the dashboard ID.
+    DASHBOARD_CACHE.invalidate(None if dashboard_id is None else str(dashboard_id))
+
+# ------------------ Metric Selection ------------------
+
+def rank_metrics(query, metrics, top_k=METRIC_TOP_K):
+    """
+    Keep the metrics most relevant to the query.
     
     Args:
         query: The user's query
-        dashboards: Dictionary mapping countries to dashboard IDs
+        metrics: Zabbix items of the host
+        top_k: Maximum number of metrics to keep
         
     Returns:
-        int: Dashboard ID if matched, -1 otherwise
+        list: Zabbix items, most relevant first
     """
-    prompt = (
-        f"Match the user's query to a country and return ONLY the corresponding dashboard ID.\n"
-        f"Here is the list of countries with their dashboard IDs:\n"
-        f"{dashboards}\n\n"
-        f"User's query: {query}\n\n"
-        "Return ONLY the dashboard ID as a number. If no match is found, return -1."
+    if not metrics:
+        return []
+
+    choices = [
+        f"{metric.get('name_resolved') or metric.get('name')} {metric.get('description', '')} {metric.get('key_', '')}"
+        for metric in metrics
+    ]
+    ranked = process.extract(
+        query, choices, scorer=fuzz.token_set_ratio, processor=utils.default_process, limit=None
     )
+    # Stable order for equal scores keeps Zabbix's item order
+    ranked.sort(key=lambda match: (-match[1], match[2]))
 
-    system_content = "You are an intelligent assistant that matches queries to countries."
-    answer = use_openai(system_content, prompt)
+    return [metrics[index] for _, _, index in ranked[:top_k]]
+
+# ------------------ Metric History ------------------
+
+def history_window(query):
+    """
+    Find the time window a query asks about.
     
-    return int(answer) if answer and (answer.isdigit() or answer == "-1") else -1
+    Args:
+        query: The user's query
+        
+    Returns:
+        int: Window length in seconds, None if the query is not about past values
+    """
+    text = " ".join(re.findall(r'[a-z0-9]+', query.lower()))
+    match = re.search(r'\b(?:last|past|previous)\s+(\d+)\s*(minute|hour|day|week|month)s?\b', text)
+    if match:
+        return int(match.group(1)) * TIME_UNITS[match.group(2)]
+    match = re.search(r'\b(?:last|past|previous|this)\s+(minute|hour|day|week|month)\b', text)
+    if match:
+        return TIME_UNITS[match.group(1)]
+    if re.search(r'\byesterday\b', text):
+        return 2 * TIME_UNITS["day"]
+    if re.search(r'\bsince\s+\d', text) or re.search(r'\b(?:been|average|averaged|since)\b.*\btoday\b', text):
+        return HISTORY_DEFAULT_WINDOW
+    if any(f" {keyword} " in f" {text} " for keyword in HISTORY_KEYWORDS):
+        return HISTORY_DEFAULT_WINDOW
+    return None
 
-# ------------------ Route Handlers ------------------
+def query_threshold(query):
+    """
+    Find a threshold such as "above 500" in a query.
+    
+    Args:
+        query: The user's query
+        
+    Returns:
+        float: The threshold, None if the query names none
+    """
+    match = re.search(
+        r'(?:above|over|exceed(?:s|ed|ing)?|greater than|more than|higher than|>)\s*(-?\d+(?:\.\d+)?)',
+        query.lower()
+    )
+    return float(match.group(1)) if match else None
 
-@app.route('/', methods=['GET'])
-def landing_page():
-    """Render the landing page with dashboard options."""
-    return render_template('landing.html', dashboards=DASHBOARDS)
+def format_window(seconds):
+    """Format a window length, e.g. "7 days" or "24 hours"."""
+    for unit in ("month", "week", "day", "hour", "minute"):
+        if seconds >= TIME_UNITS[unit] and seconds % TIME_UNITS[unit] == 0:
+            count = seconds // TIME_UNITS[unit]
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return f"{round(seconds / 3600)} hours"
 
-@app.route('/home', methods=['GET', 'POST'])
-def home():
+def history_items(query, items, top_k=HISTORY_TOP_K):
     """
-    Handle GET requests to display the dashboard 
-    and POST requests to process user queries.
+    Pick the numeric metrics (float and unsigned items) most relevant to the query.
+    
+    Args:
+        query: The user's query
+        items: Zabbix items of the host
+        top_k: Maximum number of metrics
+        
+    Returns:
+        list: Zabbix items, most relevant first
     """
-    # Handle GET requests to display the dashboard
+    numeric = [item for item in items if item.get("value_type") in ("0", "3")]
+    return rank_metrics(query, numeric, top_k)
+
+def history_calls(items, time_from, time_till):
+    """
+    Build the Zabbix calls that read the values of items over a window.
+    
+    Windows up to HISTORY_RAW_MAX_WINDOW read raw history, one history.get per
+    value type; longer windows read hourly trends with one trend.get.
+    
+    Args:
+        items: Numeric Zabbix items
+        time_from: Start of the window (Unix time)
+        time_till: End of the window (Unix time)
+        
+    Returns:
+        list: (method, params) tuples
+    """
+    if time_till - time_from > HISTORY_RAW_MAX_WINDOW:
+        return [("trend.get", {
+            "output": ["itemid", "clock", "num", "value_min", "value_avg", "value_max"],
+            "itemids": [item["itemid"] for item in items],
+            "time_from": time_from,
+            "time_till": time_till,
+            "limit": HISTORY_MAX_POINTS
+        })]
+
+    itemids_by_type = {}
+    for item in items:
+        itemids_by_type.setdefault(item["value_type"], []).append(item["itemid"])
+    return [
+        ("history.get", {
+            "output": ["itemid", "clock", "value"],
+            "history": int(value_type),
+            "itemids": itemids,
+            "time_from": time_from,
+            "time_till": time_till,
+            "sortfield": "clock",
+            "sortorder": "ASC",
+            "limit": HISTORY_MAX_POINTS
+        })
+        for value_type, itemids in sorted(itemids_by_type.items())
+    ]
+
+def summarize_history(items, results, time_from, time_till, threshold=None):
+    """
+    Summarize the history/trend records of several items with NumPy.
+    
+    Args:
+        items: The Zabbix items the records belong to
+        results: Results of the history_calls batch (failed calls as ZabbixAPIError)
+        time_from: Start of the window (Unix time)
+        time_till: End of the window (Unix time)
+        threshold: Report the time spent above this value (optional)
+        
+    Returns:
+        list: One summary row per item with data (see HISTORY_COLUMNS)
+    """
+    records = []
+    for result in results:
+        if isinstance(result, ZabbixAPIError):
+            logging.error("Error fetching history: %s", result)
+            continue
+        records.extend(result)
+    if not records:
+        return []
+
+    trends = "value_avg" in records[0]
+    itemids, clocks, values = records_to_arrays(records, "value_avg" if trends else "value")
+    if trends:
+        _, _, minimums = records_to_arrays(records, "value_min")
+        _, _, maximums = records_to_arrays(records, "value_max")
+        _, _, weights = records_to_arrays(records, "num")
+
+    rows = []
+    for item in items:
+        mask = itemids == item["itemid"]
+        if not mask.any():
+            continue
+        extra = {"minimums": minimums[mask], "maximums": maximums[mask], "weights": weights[mask]} if trends else {}
+        summary = summarize_series(
+            clocks[mask], values[mask], time_from, time_till,
+            threshold=threshold, buckets=HISTORY_BUCKETS, **extra
+        )
+
+        changes = "; ".join(
+            f"{datetime.fromtimestamp(timestamp, timezone.utc).strftime('%a %H:%M')} {'+' if step > 0 else ''}{format_value(step)}"
+            for timestamp, step in summary["change_points"]
+        )
+        rows.append({
+            "name": item.get("name_resolved") or item.get("name"),
+            "units": item.get("units"),
+            **{key: summary[key] for key in ("points", "min", "mean", "p50", "p95", "max", "first", "last")},
+            "above": None if summary["time_above"] is None else format_window(int(summary["time_above"])),
+            "changes": changes,
+            "series": " ".join("-" if mean != mean else format_value(mean) for mean in summary["downsampled"])
+        })
+    return rows
+
+def encode_history(rows, window):
+    """
+    Encode history summaries as a compact table.
+    
+    Args:
+        rows: Summary rows (see summarize_history)
+        window: Window length in seconds
+        
+    Returns:
+        str: The table, prefixed with the window, or an empty string without data
+    """
+    if not rows:
+        return ""
+    table, stats = encode_rows(rows, HISTORY_COLUMNS, token_budget=HISTORY_TOKEN_BUDGET, max_chars=200)
+    logging.info("Prompt history: %d metrics (%d omitted) in %d tokens", stats["rows"], stats["omitted"], stats["tokens"])
+    return f"Last {format_window(window)}, downsampled to {HISTORY_BUCKETS} equal intervals, times in UTC:\n{table}"
+
+def history_bounds(query):
+    """
+    Get the window a history query asks about, ending now (or at HISTORY_NOW).
+    
+    Args:
+        query: The user's query
+        
+    Returns:
+        tuple: (start, end, length in seconds), Unix times
+    """
+    window = history_window(query) or HISTORY_DEFAULT_WINDOW
+    time_till = int(HISTORY_NOW) if HISTORY_NOW else int(time.time())
+    return time_till - window, time_till, window
+
+def metric_history_steps(query, items):
+    """
+    Summarize how the metrics most relevant to the query behaved over the window it asks about (a pipeline).
+    
+    Args:
+        query: The user's query
+        items: Zabbix items of the host
+        
+    Returns:
+        str: The encoded summaries (see encode_history), empty if there is no history
+    """
+    time_from, time_till, window = history_bounds(query)
+    selected = history_items(query, items)
+    if not selected:
+        return ""
+
+    try:
+        results = yield upstream("zabbix_batch", history_calls(selected, time_from, time_till))
+    except ZabbixAPIError as e:
+        logging.error("Error fetching history: %s", e)
+        return ""
+    # Summaries over large series are CPU-bound; the async server runs them off its event loop
+    rows = yield upstream("thread", summarize_history, selected, results, time_from, time_till, query_threshold(query))
+    return encode_history(rows, window)
+
+# ------------------ Prompt Building ------------------
+
+def encode_metrics(metrics, token_budget=METRIC_TOKEN_BUDGET):
+    """
+    Encode Zabbix items as a compact metric table.
+    
+    Args:
+        metrics: Zabbix items, most relevant first
+        token_budget: Maximum estimated tokens for the table
+        
+    Returns:
+        tuple: (table text, encoding stats, see prompt_encoding.encode_rows)
+    """
+    rows = [
+        {
+            "name": metric.get("name_resolved") or metric.get("name"),
+            "description": metric.get("description"),
+            "value": metric.get("lastvalue"),
+            "units": metric.get("units")
+        }
+        for metric in metrics
+    ]
+    return encode_rows(rows, METRIC_COLUMNS, token_budget=token_budget, legend_columns=("description",))
+
+def encode_problems(probleminfo, token_budget=PROBLEM_TOKEN_BUDGET):
+    """
+    Encode a device's problems, with acknowledgement messages, as a compact table.
+    
+    Args:
+        probleminfo: Problems returned by problem.get
+        token_budget: Maximum estimated tokens for the table
+        
+    Returns:
+        tuple: (table text, encoding stats, see prompt_encoding.encode_rows)
+    """
+    rows = []
+    for problem in probleminfo:
+        # Severity changes back to "not classified" carry no useful message
+        details = [
+            ack.get("message") for ack in problem.get("acknowledges") or []
+            if ack.get("message") and not (ack.get("action") == "4" and ack.get("new_severity") == "0")
+        ]
+        rows.append({"name": problem.get("name"), "severity": problem.get("severity"), "detail": "; ".join(details)})
+    return encode_rows(rows, PROBLEM_COLUMNS, token_budget=token_budget, legend_columns=("detail",))
+
+def build_host_prompt(query, device_name, hostinfo, probleminfo, data_age, history="", problems_fetched=True):
+    """
+    Build the analysis prompt for a query about one device.
+    
+    Args:
+        query: The user's query
+        device_name: The device (dashboard page) name
+        hostinfo: Host information returned by host.get
+        probleminfo: Problems returned by problem.get
+        data_age: Age of the device data in seconds
+        history: Metric history summaries (see metric_history_steps)
+        problems_fetched: Whether the device's problems were fetched at all
+        
+    Returns:
+        tuple: (prompt, device data included in the prompt)
+    """
+    # Extract device details (inventory is an empty list when it is disabled)
+    inventory_infomation = hostinfo[0].get("inventory") or {}
+    description = hostinfo[0].get("description")
+    inventory_model = inventory_infomation.get("model")
+    location = inventory_infomation.get("location")
+    device_infomation = f"Device Name: {device_name}, Device Model: {inventory_model}, Description: {description}, Location: {location}"
+
+    # Keep only the metrics most relevant to the query, as compact tables
+    possible_metrics_str, metric_stats = encode_metrics(rank_metrics(query, hostinfo[0].get("items", [])))
+    problems_str, problem_stats = encode_problems(probleminfo)
+    if not problems_fetched:
+        problems_str = "Problems not fetched."
+    problems_str = problems_str or "No current problems."
+    history_str = f"Metric History:\n{history}" if history else ""
+    logging.info(
+        "Prompt device data: %d metrics (%d omitted) in %d tokens, %d problems (%d omitted) in %d tokens",
+        metric_stats["rows"], metric_stats["omitted"], metric_stats["tokens"],
+        problem_stats["rows"], problem_stats["omitted"], problem_stats["tokens"]
+    )
+    
+    # Create prompt for GPT to analyze the device data
+    prompt = f"""
+        You are an expert at analyzing network infrastructure data.
+        Below is the user question, some information about a device, and a list of potential metrics you can reference.
+        User Question:
+        {query}
+        Device Information:
+        {device_infomation}
+        Data Age:
+        {round(data_age)} seconds
+        Device Problems:
+        {problems_str}
+        Here is a table of the metrics and their values, find a metric and value pair that matches the query
+        {possible_metrics_str}
+        {history_str}
+        Please provide your best answer to the user's question by relevant metrics from the list above.
+        
+        Keep the response within 5 sentences
+        """
+
+    return prompt, device_infomation + problems_str + possible_metrics_str + history_str
+
+# ------------------ Device Resolution ------------------
+
+def query_ngrams(query, max_words):
+    """
+    Split a query into word n-grams, both space-separated and run together.
+    
+    Args:
+        query: The user's query
+        max_words: Longest n-gram to produce, in words
+        
+    Returns:
+        list: The n-grams of the query
+    """
+    words = re.findall(r'[a-z0-9]+', query.lower())
+    ngrams = set()
+    for n in range(1, max_words + 1):
+        for i in range(len(words) - n + 1):
+            chunk = words[i:i + n]
+            ngrams.add(" ".join(chunk))
+            ngrams.add("".join(chunk))
+    return list(ngrams)
+
+def device_aliases(name):
+    """
+    Build the lowercase aliases a device can be referred to by.
+    
+    Args:
+        name: The device (dashboard page) name
+        
+    Returns:
+        set: Aliases such as "voip vsat" and the normalized "voipvsat"
+    """
+    aliases = {" ".join(re.findall(r'[a-z0-9]+', name.lower())), normalize(name)}
+    aliases.discard("")
+    return aliases
+
+class DeviceIndex:
+    """
+    In-memory fuzzy index over the device names of one dashboard.
+    
+    Aliases are compared with the word n-grams of a query rather than the raw
+    query string, so a short name like "UPS" does not match inside "groups".
+    
+    Args:
+        country_devices: Dictionary mapping device names to host IDs
+    """
+
+    def __init__(self, country_devices):
+        self.aliases = []
+        for name, hostid in country_devices.items():
+            for alias in device_aliases(name):
+                self.aliases.append((alias, hostid))
+        self.max_words = max((len(alias.split()) for alias, _ in self.aliases), default=1)
+
+    def match(self, query):
+        """
+        Score every device against the query.
+        
+        Args:
+            query: The user's query
+            
+        Returns:
+            list: (hostid, score, alias) for each device, best match first
+        """
+        ngrams = query_ngrams(query, self.max_words)
+        if not ngrams:
+            return []
+
+        best = {}
+        for alias, hostid in self.aliases:
+            _, score, _ = process.extractOne(alias, ngrams, scorer=fuzz.ratio)
+            if hostid not in best or (score, len(alias)) > best[hostid][1:]:
+                best[hostid] = (hostid, score, len(alias), alias)
+
+        ranked = sorted(best.values(), key=lambda match: (match[1], match[2]), reverse=True)
+        return [(hostid, score, alias) for hostid, score, _, alias in ranked]
+
+    def resolve(self, query, threshold=DEVICE_MATCH_THRESHOLD, margin=DEVICE_MATCH_MARGIN):
+        """
+        Resolve the query to a host ID when one device is a clear match.
+        
+        Args:
+            query: The user's query
+            threshold: Minimum score for the best device
+            margin: Minimum lead over the next-best device
+            
+        Returns:
+            str: Host ID of the matched device, None if there is no confident match
+        """
+        matches = self.match(query)
+        if not matches or matches[0][1] < threshold:
+            return None
+
+        hostid, score, alias = matches[0]
+        for _, other_score, other_alias in matches[1:]:
+            # An exact name match outranks near-duplicates such as "Switch 1" vs "Switch 2"
+            if other_score < score - margin or (score == 100 and other_score < 100):
+                break
+            # "vsat" scoring as well as "voip vsat" is explained by the longer match
+            if other_alias != alias and other_alias in alias:
+                continue
+            return None
+
+        return hostid
+
+def device_name_for(hostid, country_devices):
+    """
+    Look up the device name of a host ID.
+    
+    Args:
+        hostid: The ID of the host
+        country_devices: Dictionary mapping device names to host IDs
+        
+    Returns:
+        str: The device name, or an empty string if the host is not on the dashboard
+    """
+    for devicename, host_id in country_devices.items():
+        if host_id == hostid:
+            return devicename
+    return ""
+
+def devices_listing(country_devices):
+    """
+    List a dashboard's devices for an LLM prompt.
+    
+    Args:
+        country_devices: Dictionary mapping device names to host IDs
+        
+    Returns:
+        str: One "Device: X, HostID: Y." line per device
+    """
+    country_devices_query = ""
+    for key, value in country_devices.items():
+        country_devices_query = country_devices_query + f"Device: {key}, HostID: {value}. \n"
+    return country_devices_query
+
+def find_host_steps(query, dashboard_devices):
+    """
+    Match the user's query to a device, asking the LLM only when the local index is unsure (a pipeline).
+    
+    Args:
+        query: The user's query
+        dashboard_devices: The parsed dashboard (see load_dashboard_devices)
+        
+    Returns:
+        str: Host ID if found, '-1' otherwise
+    """
+    hostid = dashboard_devices["index"].resolve(query)
+    if hostid:
+        logging.debug("Resolved host %s locally", hostid)
+        return hostid
+
+    system_content, prompt = resolve_host_prompt(devices_listing(dashboard_devices["devices"]), query)
+    answer = yield upstream("openai", system_content, prompt, stage="resolve_host_id", timeout=OPENAI_ROUTING_TIMEOUT)
+    return answer.strip()
+
+# ------------------ AI Decision Functions ------------------
+
+def classify_nms_query(query: str, device_index=None) -> Tuple[bool, float]:
+    """
+    Decide locally whether the query requires NMS, with a confidence score.
+    
+    Args:
+        query: The user's query
+        device_index: DeviceIndex of the current dashboard (optional), searched
+            along with INFRASTRUCTURE_INDEX
+        
+    Returns:
+        tuple: (needs NMS, confidence between 0 and 1)
+    """
+    words = re.findall(r'[a-z0-9]+', query.lower())
+    text = " ".join(words)
+    padded = f" {text} "
+
+    for index in (INFRASTRUCTURE_INDEX, device_index):
+        matches = index.match(query) if index else []
+        if matches and matches[0][1] >= DEVICE_MATCH_THRESHOLD:
+            return True, 0.95
+
+    keyword_hits = sum(1 for keyword in NETWORK_KEYWORDS if f" {keyword} " in padded)
+    if keyword_hits >= 2:
+        return True, 0.9
+    if keyword_hits == 1:
+        return True, 0.75
+
+    if any(f" {phrase} " in padded for phrase in SMALL_TALK_KEYWORDS) and len(words) <= 6:
+        return False, 0.9
+
+    return False, 0.6
+
+def need_nms_prompt(query, infrastructures):
+    """
+    Build the LLM prompt that decides if a query requires NMS.
+    
+    Args:
+        query: The user's query
+        infrastructures: List of infrastructure types
+        
+    Returns:
+        tuple: (system content, prompt)
+    """
+    prompt = (
+        "You are an intelligent IT and network assistant.\n"
+        "You have a list of possible infrastructures:\n"
+        f"{infrastructures}\n\n"
+        "Here is the user's query:\n"
+        f"'{query}'\n\n"
+        "If the user is asking about any of these infrastructures, "
+        "network devices, or network monitoring details, return ONLY 'YES'.\n"
+        "Otherwise, return ONLY 'NO'."
+    )
+
+    system_content = "You decide if the user query references any of the listed infrastructures or network systems."
+    return system_content, prompt
+
+def need_nms_steps(query: str, infrastructures: list, device_index=None):
+    """
+    Determine if the query requires NMS (Network Management System) (a pipeline).
+    
+    The local classifier answers when it is confident; otherwise the LLM decides.
+    
+    Args:
+        query: The user's query
+        infrastructures: List of infrastructure types
+        device_index: DeviceIndex of the current dashboard (optional)
+        
+    Returns:
+        bool: True if NMS is needed, False otherwise
+    """
+    decision, confidence = classify_nms_query(query, device_index)
+    if confidence >= NMS_ROUTER_CONFIDENCE:
+        logging.info("need_nms decision=%s confidence=%.2f path=local", decision, confidence)
+        return decision
+
+    system_content, prompt = need_nms_prompt(query, infrastructures)
+    answer = yield upstream("openai", system_content, prompt, stage="need_nms", timeout=OPENAI_ROUTING_TIMEOUT)
+    
+    answer = answer.strip().upper()
+    decision = True if "YES" in answer else False
+    logging.info("need_nms decision=%s confidence=%.2f path=llm", decision, confidence)
+    return decision
+
+# def is_weather_query(text: str, threshold: int = 95) -> Tuple[bool, str]:
+#     """
+#     Check if the query is related to weather.
+    
+#     Args:
+#         text: The user's query
+#         threshold: Matching threshold (default: 95)
+        
+#     Returns:
+#         tuple: (is_weather, matched_term)
+#     """
+#     text_cleaned = re.sub(r'[^\w\s]', '', text)
+#     text_lower = text_cleaned.lower()
+#     words = text_lower.split()
+    
+#     for word in words:
+#         best_match, match_score, _ = process.extractOne(word, WEATHER_KEYWORDS)
+#         if match_score >= threshold:
+#             return True, best_match
+
+#     return False, ""
+
+# def extract_city_from_query(query: str, matched_country) -> str:
+#     """
+#     Extract city name from query, defaulting to country capital if none found.
+    
+#     Args:
+#         query: The user's query
+#         matched_country: The country for capital fallback
+        
+#     Returns:
+#         str: The detected city name
+#     """
+#     prompt = (
+#         "Extract the city name from the following query. "
+#         "If no city name is present, return 'Unknown'. "
+#         f"Query: '{query}'"
+#     )
+    
+#     system_content = "You are a helpful assistant for extracting Cities from text."
+#     city = use_openai(system_content, prompt)
+    
+#     if not city or city.lower() == "unknown":
+#         country = CountryInfo(matched_country)
+#         city = country.capital()
+        
+#     return city
+
+def resolve_host_prompt(country_devices_query, query):
+    """
+    Build the LLM prompt that matches a query to a host ID.
+    
+    Args:
+        country_devices_query: String with device information
+        query: The user's query
+        
+    Returns:
+        tuple: (system content, prompt)
+    """
+    prompt = (
+        f"Match the user's query to a device and return ONLY the corresponding HostID.\n"
+        f"Here is the list of devices:\n"
+        f"{country_devices_query}\n\n"
+        f"User's question: {query}\n\n"
+        "Return ONLY the HostID as a number. If no match is found, return -1."
+    )
+
+    system_content = "You are an intelligent IT and network assistant."
+    return system_content, prompt
+    
+def requested_data_kinds(query, widget_types):
+    """
+    Decide locally which device data a query needs.
+    
+    Args:
+        query: The user's query
+        widget_types: Widget types on the device's dashboard page
+        
+    Returns:
+        list: Data kinds to fetch, from "metrics", "problems" and "history"
+    """
+    words = set(re.findall(r'[a-z0-9]+', query.lower()))
+    data_kinds = ["metrics"]
+    if words & set(PROBLEM_KEYWORDS) or "problems" in widget_types:
+        data_kinds.append("problems")
+    if history_window(query):
+        data_kinds.append("history")
+    return data_kinds
+
+def parse_plan(answer, country_devices):
+    """
+    Parse the JSON plan returned by plan_query.
+    
+    Args:
+        answer: The raw LLM answer
+        country_devices: Dictionary mapping device names to host IDs
+        
+    Returns:
+        dict: The validated plan, None if the answer is not a usable plan
+    """
+    match = re.search(r'\{.*\}', answer or "", re.DOTALL)
+    if not match:
+        return None
+
+    try:
+        plan = json.loads(match.group(0))
+    except ValueError:
+        return None
+
+    hostid = str(plan.get("hostid", "-1")).strip()
+    if hostid not in country_devices.values():
+        hostid = "-1"
+
+    # "false" or "no" must not count as true; anything but a clear answer is not a usable plan
+    need = plan.get("need_nms")
+    if isinstance(need, str):
+        need = {"true": True, "yes": True, "false": False, "no": False}.get(need.strip().lower())
+    if not isinstance(need, bool):
+        return None
+
+    data = plan.get("data", [])
+    data_kinds = [kind for kind in data if kind in DATA_KINDS] if isinstance(data, list) else []
+    return {
+        "need_nms": need,
+        "hostid": hostid,
+        "data": data_kinds or ["metrics"]
+    }
+
+def plan_query_steps(query, country_devices, infrastructures):
+    """
+    Decide routing, host and data kinds for a query with one structured LLM call (a pipeline).
+    
+    Replaces the need_nms -> resolve_host_id chain with a single completion.
+    
+    Args:
+        query: The user's query
+        country_devices: Dictionary mapping device names to host IDs
+        infrastructures: List of infrastructure types
+        
+    Returns:
+        dict: {"need_nms": bool, "hostid": str, "data": [...]}, None if the answer cannot be parsed
+    """
+    system_content, prompt = plan_prompt(query, country_devices, infrastructures)
+    answer = yield upstream("openai", system_content, prompt, temperature=0, max_tokens=100, stage="plan", timeout=OPENAI_ROUTING_TIMEOUT)
+    plan = parse_plan(answer, country_devices)
+    logging.info("plan_query plan=%s", plan)
+    return plan
+
+def plan_prompt(query, country_devices, infrastructures):
+    """
+    Build the LLM prompt that plans routing, host and data kinds as JSON.
+    
+    Args:
+        query: The user's query
+        country_devices: Dictionary mapping device names to host IDs
+        infrastructures: List of infrastructure types
+        
+    Returns:
+        tuple: (system content, prompt)
+    """
+    prompt = (
+        "You route questions for a network monitoring assistant.\n"
+        "Possible infrastructures:\n"
+        f"{infrastructures}\n\n"
+        "Devices on the current dashboard:\n"
+        f"{devices_listing(country_devices)}\n"
+        f"User's question: {query}\n\n"
+        "Respond with ONLY a JSON object with these keys:\n"
+        '"need_nms": true if the question is about these infrastructures, network devices or '
+        "network monitoring details, otherwise false;\n"
+        '"hostid": the HostID of the device the question is about as a string, or "-1" if none matches;\n'
+        '"data": the device data needed to answer, a list containing "metrics" (current values), '
+        '"problems" and/or "history" (how values changed over a past period).'
+    )
+
+    system_content = "You are an intelligent IT and network assistant that answers in JSON."
+    return system_content, prompt
+
+def host_plan(query, hostid, dashboard_devices):
+    """
+    Build the plan for a query about a known host, choosing data kinds locally.
+    
+    Args:
+        query: The user's query
+        hostid: The resolved host ID ('-1' if none)
+        dashboard_devices: The parsed dashboard (see load_dashboard_devices), or None
+        
+    Returns:
+        dict: {"need_nms": True, "hostid": str, "data": [...]}
+    """
+    country_devices = dashboard_devices["devices"] if dashboard_devices else {}
+    widget_types = dashboard_devices["widget_types"] if dashboard_devices else {}
+    device_name = device_name_for(hostid, country_devices)
+    return {"need_nms": True, "hostid": hostid, "data": requested_data_kinds(query, widget_types.get(device_name, []))}
+
+def complete_plan(query, plan, dashboard_devices):
+    """
+    Add the data kinds the local rules require to an LLM plan for a known host.
+    
+    The LLM may leave out data the device's dashboard page shows, such as its problems.
+    
+    Args:
+        query: The user's query
+        plan: The plan returned by plan_query
+        dashboard_devices: The parsed dashboard (see load_dashboard_devices), or None
+        
+    Returns:
+        dict: The plan, with every data kind host_plan would choose
+    """
+    if not plan["need_nms"] or plan["hostid"] == "-1":
+        return plan
+    required = host_plan(query, plan["hostid"], dashboard_devices)["data"]
+    return {**plan, "data": [kind for kind in DATA_KINDS if kind in plan["data"] or kind in required]}
+
+def local_plan(query, dashboard_devices):
+    """
+    Plan a query without the LLM when the router and the device index are both confident.
+    
+    Args:
+        query: The user's query
+        dashboard_devices: The parsed dashboard (see load_dashboard_devices), or None
+        
+    Returns:
+        dict: The plan (see plan_nms_query), None if the LLM is needed
+    """
+    device_index = dashboard_devices["index"] if dashboard_devices else None
+
+    decision, confidence = classify_nms_query(query, device_index)
+    if confidence < NMS_ROUTER_CONFIDENCE:
+        return None
+
+    if not decision:
+        logging.info("need_nms decision=%s confidence=%.2f path=local", decision, confidence)
+        return {"need_nms": False, "hostid": "-1", "data": []}
+
+    hostid = device_index.resolve(query) if device_index else None
+    if not hostid:
+        return None
+
+    logging.info("need_nms decision=%s confidence=%.2f path=local", decision, confidence)
+    return host_plan(query, hostid, dashboard_devices)
+
+def plan_nms_query(query, dashboard_devices):
+    """
+    Plan how to answer a query, calling the LLM only for what cannot be decided locally.
+    
+    Args:
+        query: The user's query
+        dashboard_devices: The parsed dashboard (see load_dashboard_devices), or None
+        
+    Returns:
+        dict: {"need_nms": bool, "hostid": str, "data": [...]}
+    """
+    return run_pipeline(plan_steps(query, dashboard_devices))
+
+def plan_steps(query, dashboard_devices):
+    """The pipeline of plan_nms_query."""
+    plan = local_plan(query, dashboard_devices)
+    if plan:
+        return plan
+
+    country_devices = dashboard_devices["devices"] if dashboard_devices else {}
+    if NMS_PLANNING_MODE:
+        plan = yield from plan_query_steps(query, country_devices, INFRASTRUCTURES)
+        if plan:
+            return complete_plan(query, plan, dashboard_devices)
+
+    # Fall back to the need_nms -> resolve_host_id chain
+    device_index = dashboard_devices["index"] if dashboard_devices else None
+    if not (yield from need_nms_steps(query, INFRASTRUCTURES, device_index)):
+        return {"need_nms": False, "hostid": "-1", "data": []}
+
+    hostid = (yield from find_host_steps(query, dashboard_devices)) if dashboard_devices else "-1"
+    return host_plan(query, hostid, dashboard_devices)
+
+def match_country(query, dashboards):
+    """
+    Match user query to a country and return the dashboard ID.
+    
+    Args:
+        query: The user's query
+        dashboards: Dictionary mapping countries to dashboard IDs
+        
+    Returns:
+        int: Dashboard ID if matched, -1 otherwise
+    """
+    prompt = (
+        f"Match the user's query to a country and return ONLY the corresponding dashboard ID.\n"
+        f"Here is the list of countries with their dashboard IDs:\n"
+        f"{dashboards}\n\n"
+        f"User's query: {query}\n\n"
+        "Return ONLY the dashboard ID as a number. If no match is found, return -1."
+    )
+
+    system_content = "You are an intelligent assistant that matches queries to countries."
+    answer = use_openai(system_content, prompt, stage="match_country", timeout=OPENAI_ROUTING_TIMEOUT)
+    
+    return int(answer) if answer and (answer.isdigit() or answer == "-1") else -1
+
+# ------------------ Fleet Snapshot ------------------
+
+fleet_snapshot = FleetSnapshot(
+    zabbix,
+    DASHBOARDS.values(),
+    lambda dashboard_id: (load_dashboard_devices(dashboard_id) or {}).get("devices"),
+    fields={
+        "host": HOST_FIELDS,
+        "inventory": INVENTORY_FIELDS,
+        "item": ITEM_FIELDS
+    },
+    problem_params=problem_params,
+    interval=FLEET_SNAPSHOT_INTERVAL,
+    full_refresh_interval=FLEET_SNAPSHOT_FULL_REFRESH,
+    history_limit=FLEET_SNAPSHOT_HISTORY_LIMIT
+) if FLEET_SNAPSHOT_INTERVAL > 0 else None
+
+@app.before_request
+def start_fleet_snapshot():
+    """
+    Start the snapshot poller in the serving process (not in the debug reloader).
+    
+    Each worker process of a multi-process server runs its own poller, so Zabbix
+    receives one refresh batch per worker every FLEET_SNAPSHOT_INTERVAL seconds.
+    """
+    if fleet_snapshot:
+        fleet_snapshot.start()
+
+def host_context_steps(hostid, data_kinds):
+    """
+    Get a host's information and problems, from the fleet snapshot when it is fresh enough (a pipeline).
+    
+    Args:
+        hostid: The ID of the host
+        data_kinds: Data kinds to fetch, from "metrics", "problems" and "history"
+        
+    Returns:
+        tuple: (host information or None, list of problems, data age in seconds,
+            whether the data is stale)
+    """
+    # History summaries are chosen from the host's items
+    include_items = "metrics" in data_kinds or "history" in data_kinds
+    include_problems = "problems" in data_kinds
+
+    snapshot = fleet_snapshot.host(hostid) if fleet_snapshot else None
+    if snapshot and snapshot[2] is not None and snapshot[2] <= FLEET_SNAPSHOT_MAX_STALENESS:
+        HOST_CONTEXT_SOURCE.inc(source="snapshot")
+        return snapshot_context(snapshot, include_items, include_problems) + (False,)
+
+    HOST_CONTEXT_SOURCE.inc(source="live")
+    hostinfo, probleminfo = yield from host_details_steps(
+        hostid,
+        include_items=include_items,
+        include_problems=include_problems
+    )
+    return (yield upstream(
+        "thread", live_or_stale_context, hostid, hostinfo, probleminfo, snapshot, include_items, include_problems
+    ))
+
+def snapshot_context(snapshot, include_items, include_problems):
+    """Shape a fleet snapshot entry like a live host.get/problem.get result."""
+    host, problems, age = snapshot
+    if not include_items:
+        host = {**host, "items": []}
+    return [host], problems if include_problems else [], age
+
+def live_or_stale_context(hostid, hostinfo, probleminfo, snapshot, include_items, include_problems):
+    """
+    Keep a live fetch of host data as its fallback, or fall back when the fetch failed.
+    
+    The fallback is the newer of the host's last live data and the fleet snapshot, however old.
+    
+    Args:
+        hostid: The ID of the host
+        hostinfo: Host information from the live fetch (None if it failed)
+        probleminfo: Problems from the live fetch
+        snapshot: The host's fleet snapshot entry (None without a snapshot)
+        include_items: Whether the host's items were fetched
+        include_problems: Whether the host's problems were fetched
+        
+    Returns:
+        tuple: (host information or None, list of problems, data age in seconds,
+            whether the data is stale)
+    """
+    key = f"{hostid}:{int(include_items)}:{int(include_problems)}"
+    if hostinfo:
+        LAST_GOOD.remember("host", key, (hostinfo, probleminfo))
+        return hostinfo, probleminfo, 0, False
+
+    stale, age = LAST_GOOD.get("host", key)
+    if stale is not None:
+        hostinfo, probleminfo = stale
+    if snapshot and snapshot[2] is not None and (age is None or snapshot[2] < age):
+        hostinfo, probleminfo, age = snapshot_context(snapshot, include_items, include_problems)
+    if not hostinfo:
+        return None, [], 0, False
+
+    logging.warning("Host %s unavailable, using its data from %.0fs ago", hostid, age)
+    STALE_DATA.inc(kind="host")
+    return hostinfo, probleminfo, age, True
+
+# ------------------ Fleet Queries ------------------
+
+INFRASTRUCTURE_INDEX = DeviceIndex({infrastructure: infrastructure for infrastructure in INFRASTRUCTURES})
+
+def is_fleet_query(query):
+    """
+    Check whether the query asks about every country rather than the chosen dashboard.
+    
+    Args:
+        query: The user's query
+        
+    Returns:
+        bool: True for fleet-wide queries
+    """
+    padded = " " + " ".join(re.findall(r'[a-z0-9]+', query.lower())) + " "
+    return any(f" {keyword} " in padded for keyword in FLEET_KEYWORDS)
+
+def singularize(text):
+    """Strip English plural endings ("VSATs", "UPSes") so names match their singular form."""
+    return re.sub(r'(?<=[a-z0-9])(es|s)\b', '', text.lower())
+
+def infrastructure_type(device_name):
+    """
+    Classify a device by the INFRASTRUCTURES type its name refers to.
+    
+    Args:
+        device_name: The device (dashboard page) name
+        
+    Returns:
+        str: The infrastructure type, or "Other"
+    """
+    return INFRASTRUCTURE_INDEX.resolve(device_name) or "Other"
+
+def requested_infrastructures(query):
+    """
+    List the infrastructure types a query names, e.g. ["VSAT", "UPS"] for "which VSATs or UPSes are down".
+    
+    Args:
+        query: The user's query
+        
+    Returns:
+        list: Infrastructure types, empty when the query names none (meaning all types)
+    """
+    requested = set()
+    for text in (query, singularize(query)):
+        for infrastructure, score, _ in INFRASTRUCTURE_INDEX.match(text):
+            if score >= DEVICE_MATCH_THRESHOLD:
+                requested.add(infrastructure)
+    return [infrastructure for infrastructure in INFRASTRUCTURES if infrastructure in requested]
+
+def fleet_status_calls(hostids):
+    """Build the host.get/problem.get batch that reports availability and open problems of many hosts."""
+    return [
+        ("host.get", {
+            "output": ["hostid", "name"],
+            "hostids": hostids,
+            "selectInterfaces": ["available"],
+            "selectTriggers": ["triggerid"]
+        }),
+        ("problem.get", {
+            "output": PROBLEM_FIELDS,
+            "hostids": hostids,
+            "sortfield": ["eventid"],
+            "sortorder": "DESC"
+        })
+    ]
+
+def group_problems(hosts, problems):
+    """
+    Group problem.get results by host, via the triggers returned with each host.
+    
+    Args:
+        hosts: Hosts from host.get with selectTriggers
+        problems: Problems from problem.get
+        
+    Returns:
+        tuple: ({hostid: host}, {hostid: list of problems})
+    """
+    host_map = {}
+    trigger_hosts = {}
+    for host in hosts:
+        for trigger in host.get("triggers", []):
+            trigger_hosts[trigger["triggerid"]] = host["hostid"]
+        host_map[host["hostid"]] = host
+
+    host_problems = {hostid: [] for hostid in host_map}
+    for problem in problems:
+        hostid = trigger_hosts.get(problem.get("objectid"))
+        if hostid in host_problems:
+            host_problems[hostid].append(problem)
+    return host_map, host_problems
+
+def get_dashboard_status(dashboard_id):
+    """
+    Get the availability and open problems of every device on a dashboard.
+    
+    Served from the fleet snapshot when it is fresh enough, otherwise with one Zabbix batch.
+    
+    Args:
+        dashboard_id: The ID of the dashboard
+        
+    Returns:
+        dict: {"devices", "hosts", "problems"} (see group_problems), None if the dashboard cannot be fetched
+    """
+    return run_pipeline(dashboard_status_steps(dashboard_id))
+
+def dashboard_status_steps(dashboard_id):
+    """The pipeline of get_dashboard_status."""
+    dashboard_devices = yield from dashboard_devices_steps(dashboard_id)
+    if not dashboard_devices:
+        return None
+
+    devices = dashboard_devices["devices"]
+    hostids = sorted(set(devices.values()))
+    if fleet_snapshot:
+        hosts, problems, age = fleet_snapshot.hosts(hostids)
+        if age is not None and age <= FLEET_SNAPSHOT_MAX_STALENESS and len(hosts) == len(hostids):
+            return {"devices": devices, "hosts": hosts, "problems": problems}
+
+    try:
+        hosts, problems = yield upstream("zabbix_batch", fleet_status_calls(hostids))
+        for result in (hosts, problems):
+            if isinstance(result, ZabbixAPIError):
+                raise result
+    except ZabbixAPIError:
+        status = yield upstream("thread", stale_dashboard_status, dashboard_id)
+        if status is None:
+            raise
+        return status
+    return (yield upstream("thread", dashboard_status, dashboard_id, devices, hosts, problems))
+
+def dashboard_status(dashboard_id, devices, hosts, problems):
+    """Group a live fleet status fetch by host and keep it as the dashboard's fallback."""
+    host_map, host_problems = group_problems(hosts, problems)
+    status = {"devices": devices, "hosts": host_map, "problems": host_problems}
+    LAST_GOOD.remember("fleet", dashboard_id, status)
+    return status
+
+def stale_dashboard_status(dashboard_id):
+    """
+    Get the last status fetched for a dashboard, after a failed or late fetch.
+    
+    Returns:
+        dict: The status (see get_dashboard_status) with its age in "stale_seconds",
+            None if it was never fetched
+    """
+    status, age = LAST_GOOD.get("fleet", dashboard_id)
+    if status is None:
+        return None
+    logging.warning("Dashboard %s status unavailable, using its status from %.0fs ago", dashboard_id, age)
+    STALE_DATA.inc(kind="fleet")
+    return {**status, "stale_seconds": age}
+
+def get_fleet_status():
+    """
+    Get the status of every dashboard in DASHBOARDS, FLEET_CONCURRENCY dashboards at a time.
+    
+    Returns:
+        dict: {country: dashboard status (see get_dashboard_status) or None if it failed}
+    """
+    countries = list(DASHBOARDS)
+    statuses = bounded_map(
+        lambda country: get_dashboard_status(DASHBOARDS[country]),
+        countries,
+        limit=FLEET_CONCURRENCY,
+        timeout=ZABBIX_FETCH_TIMEOUT
+    )
+    return dict(zip(countries, statuses))
+
+def is_host_down(host, problems):
+    """
+    Decide whether a host is down: an unavailable interface, or an open availability problem.
+    
+    Args:
+        host: Host from host.get (interfaces are optional)
+        problems: Open problems of the host
+        
+    Returns:
+        bool: True if the host is down
+    """
+    if any(interface.get("available") == "2" for interface in host.get("interfaces", [])):
+        return True
+    return any(
+        keyword in (problem.get("name") or "").lower()
+        for problem in problems for keyword in DOWN_PROBLEM_KEYWORDS
+    )
+
+def aggregate_fleet(fleet_status, infrastructures=()):
+    """
+    Aggregate device counts, down devices and problems by infrastructure type.
+    
+    Args:
+        fleet_status: Status per country (see get_fleet_status)
+        infrastructures: Infrastructure types to keep (all when empty)
+        
+    Returns:
+        dict: {infrastructure type: {"devices": int, "down": [...], "problems": [...]}}
+    """
+    aggregate = {}
+    for country, status in fleet_status.items():
+        if not status:
+            continue
+        for device_name, hostid in status["devices"].items():
+            infrastructure = infrastructure_type(device_name)
+            if infrastructures and infrastructure not in infrastructures:
+                continue
+
+            entry = aggregate.setdefault(infrastructure, {"devices": 0, "down": [], "problems": []})
+            entry["devices"] += 1
+            host = status["hosts"].get(hostid)
+            problems = status["problems"].get(hostid, [])
+            if host is None or is_host_down(host, problems):
+                entry["down"].append(f"{country}/{device_name}")
+            for problem in problems:
+                entry["problems"].append((int(problem.get("severity") or 0), f"{country}/{device_name}: {problem.get('name')}"))
+
+    for entry in aggregate.values():
+        entry["problems"].sort(key=lambda problem: problem[0], reverse=True)
+    return aggregate
+
+def format_fleet_aggregate(aggregate, failed_countries, stale_countries=None):
+    """
+    Format the fleet aggregate as compact prompt lines.
+    
+    Args:
+        aggregate: The aggregate returned by aggregate_fleet
+        failed_countries: Countries whose dashboards could not be fetched
+        stale_countries: {country: age in seconds} of countries described by their last known status
+        
+    Returns:
+        str: One block per infrastructure type
+    """
+    lines = []
+    for infrastructure, entry in sorted(aggregate.items()):
+        lines.append(
+            f"{infrastructure}: {entry['devices']} devices, {len(entry['down'])} down, "
+            f"{len(entry['problems'])} open problems"
+        )
+        if entry["down"]:
+            lines.append(f"  Down: {', '.join(entry['down'])}")
+        for severity, problem in entry["problems"][:FLEET_PROBLEMS_PER_TYPE]:
+            lines.append(f"  Problem (severity {severity}): {problem}")
+        if len(entry["problems"]) > FLEET_PROBLEMS_PER_TYPE:
+            lines.append(f"  ... {len(entry['problems']) - FLEET_PROBLEMS_PER_TYPE} more problems")
+    if failed_countries:
+        lines.append(f"No data for: {', '.join(failed_countries)}")
+    if stale_countries:
+        oldest = max(stale_countries.values())
+        lines.append(f"Last known data, up to {round(oldest / 60)} minutes old, for: {', '.join(stale_countries)}")
+    return "\n".join(lines) if lines else "No matching devices."
+
+def build_fleet_prompt(query, fleet_status):
+    """
+    Build the analysis prompt for a fleet-wide query.
+    
+    Args:
+        query: The user's query
+        fleet_status: Status per country (see get_fleet_status)
+        
+    Returns:
+        tuple: (prompt, fleet data included in the prompt)
+    """
+    failed_countries = [country for country, status in fleet_status.items() if not status]
+    stale_countries = {country: status["stale_seconds"] for country, status in fleet_status.items() if status and "stale_seconds" in status}
+    fleet_data = format_fleet_aggregate(
+        aggregate_fleet(fleet_status, requested_infrastructures(query)), failed_countries, stale_countries
+    )
+
+    prompt = f"""
+        You are an expert at analyzing network infrastructure data.
+        Below is the user question and a summary of the monitored devices in every country, grouped by infrastructure type.
+        Devices are named Country/Device.
+        User Question:
+        {query}
+        Fleet Summary:
+        {fleet_data}
+        Please provide your best answer to the user's question from the summary above.
+        
+        Keep the response within 5 sentences
+        """
+
+    return prompt, fleet_data
+
+# ------------------ Request Pipeline ------------------
+
+def run_pipeline(steps):
+    """
+    Run a pipeline (see pipeline.py) with blocking upstream calls.
+    
+    Args:
+        steps: The pipeline generator
+        
+    Returns:
+        The pipeline's return value
+    """
+    return run_steps(steps, {
+        "openai": use_openai,
+        "zabbix": zabbix.call,
+        "zabbix_batch": zabbix_batch,
+        "thread": lambda func, *args: func(*args),
+        "fleet_status": get_fleet_status
+    })
+
+def query_steps(query, chosen_dash_id):
+    """
+    Route a query and gather the device data and prompt to answer it with (a pipeline).
+
+    Args:
+        query: The user's query
+        chosen_dash_id: The dashboard chosen in the session (None if none is)
+
+    Returns:
+        dict: {"reply": response body} when the query is answered without GPT, otherwise the
+            answer_response arguments {"system_content", "user_content", "extra", "cache_key", "stage"}
+    """
+    # Fleet-wide questions are answered from every dashboard at once
+    if is_fleet_query(query):
+        with stage_deadline(ZABBIX_STAGE_BUDGET):
+            fleet_status = yield upstream("fleet_status")
+        prompt, fleet_data = build_fleet_prompt(query, fleet_status)
+        stale = any(status and "stale_seconds" in status for status in fleet_status.values())
+        return {
+            "system_content": ANALYSIS_SYSTEM_CONTENT, "user_content": prompt, "extra": {"stale": stale},
+            "cache_key": answer_cache_key(query, "fleet", fleet_data), "stage": "fleet_answer"
+        }
+
+    with stage_deadline(ZABBIX_STAGE_BUDGET):
+        dashboard_devices = (yield from dashboard_devices_steps(chosen_dash_id)) if chosen_dash_id else None
+
+    # Decide routing, host and data kinds (locally when possible, else one LLM call)
+    plan = yield from plan_steps(query, dashboard_devices)
+
+    if plan["need_nms"] == False:
+        return {
+            "system_content": GENERAL_SYSTEM_CONTENT, "user_content": query, "extra": {},
+            "cache_key": answer_cache_key(query, "", ""), "stage": "general_answer"
+        }
+
+    # Get dashboard and country information
+    matched_country = country_for_dashboard(chosen_dash_id)
+
+    if dashboard_devices:
+        logging.info("Saved Dashboard")
+    else:
+        logging.error("Failed to retrieve dashboard info.")
+        return {"reply": {"response": f"Could not retrieve the dashboard for {matched_country}"}}
+
+    hostid = plan["hostid"]
+    if hostid == '-1':
+        return {"reply": {"response": f"That device cannot be found in {matched_country}"}}
+
+    device_name = device_name_for(hostid, dashboard_devices["devices"])
+
+    # Fetch only the data the plan asked for (fleet snapshot, else one Zabbix round trip),
+    # falling back to the last known data when Zabbix fails or is too slow
+    with stage_deadline(ZABBIX_STAGE_BUDGET):
+        hostinfo, probleminfo, data_age, stale = yield from host_context_steps(hostid, plan["data"])
+        if not hostinfo:
+            return {"reply": {"response": f"Could not retrieve information for that device in {matched_country}"}}
+
+        # Summarize past values locally when the query asks about a period
+        history = ""
+        if "history" in plan["data"]:
+            history = yield from metric_history_steps(query, hostinfo[0].get("items", []))
+
+    # Build the analysis prompt from the device data
+    prompt, device_data = build_host_prompt(query, device_name, hostinfo, probleminfo, data_age, history, "problems" in plan["data"])
+    return {
+        "system_content": ANALYSIS_SYSTEM_CONTENT, "user_content": prompt,
+        "extra": {"data_age_seconds": round(data_age), "stale": stale},
+        "cache_key": answer_cache_key(query, hostid, device_data), "stage": "answer"
+    }
+
+# ------------------ Route Handlers ------------------
+
+@app.route('/', methods=['GET'])
+def landing_page():
+    """Render the landing page with dashboard options."""
+    return render_template('landing.html', dashboards=DASHBOARDS)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Expose cache sizes and hit/miss counters."""
+    return jsonify_with_ngrok({
+        "answers": ANSWER_CACHE.stats(),
+        "dashboards": DASHBOARD_CACHE.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose latency histograms, token counts, cache and error counters for Prometheus."""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+@app.route('/home', methods=['GET', 'POST'])
+def home():
+    """
+    Handle GET requests to display the dashboard 
+    and POST requests to process user queries.
+    """
+    # Handle GET requests to display the dashboard
     if request.method == 'GET':
         dashboard_id = request.args.get('dashboard_id', '')
         if dashboard_id:
             session['dashboard_id'] = dashboard_id
             
-        country_devices = {}
-        device_name = ""
-        dashboard_info = get_dashboard_info(dashboard_id, ZABBIX_API_TOKEN)
-        
-        if dashboard_info:
-            for dashboard in dashboard_info:
-                for page in dashboard.get("pages", []):
-                    name = page.get("name")
-                    widgets = page.get("widgets")
-                    hostid = ""
-                    hostids = get_hostid(widgets)
-                    
-                    if len(hostids) > 1:
-                        print("Multiple Hosts on One Device: name")
-                    if hostids == []:
-                        continue
-                        
-                    hostid = hostids[0]
-                    country_devices[name] = hostid
+        # ?refresh=1 forces the dashboard to be re-read from Zabbix
+        if request.args.get('refresh'):
+            invalidate_dashboard(dashboard_id)
+            
+        dashboard_devices = load_dashboard_devices(dashboard_id)
+        country_devices = dashboard_devices["devices"] if dashboard_devices else {}
     
         return render_template(
             'index.html', 
@@ -462,143 +2148,12 @@ def home():
         if not query:
             return jsonify_with_ngrok({"error": "Query is required"}, 400)
         
-        chosen_dash_id = session.get('dashboard_id', None)
-        
-        # Check if query requires NMS
-        need_nms_data = need_nms(query, INFRASTRUCTURES)
-        
-        if need_nms_data == False:
-            system_content = "You are Lucy, a network monitoring assistant specialized in analyzing device information for the UNDP ITM."
-            generated_text = use_openai(system_content, query)
-            return jsonify_with_ngrok({"response": generated_text}, 200)
-       
-        # Get dashboard and country information
-        matched_country = ""
-        for country, dashboard_id in DASHBOARDS.items():
-            if dashboard_id == chosen_dash_id:
-                matched_country = country
-                break
-                     
-        dashboard_id = chosen_dash_id
-        dashboard_info = get_dashboard_info(dashboard_id, ZABBIX_API_TOKEN)
-        
-        if dashboard_info:
-            print("Saved Dashboard")
-        else:
-            print("Failed to retrieve dashboard info.")
-            exit(1)
-            
-        # Extract device information from dashboard
-        country_devices = {}
-        device_name = ""
-        for dashboard in dashboard_info:
-            for page in dashboard.get("pages", []):
-                name = page.get("name")
-                widgets = page.get("widgets")
-                hostid = ""
-                hostids = get_hostid(widgets)
-                
-                if len(hostids) > 1:
-                    print("Multiple Hosts on One Device: name")
-                if hostids == []:
-                    continue
-                    
-                hostid = hostids[0]
-                country_devices[name] = hostid
-                
-        # Build query for host resolution
-        country_devices_query = ""
-        for key, value in country_devices.items(): 
-            country_devices_query = country_devices_query + f"Device: {key}, HostID: {value}. \n"
-        
-        hostid = resolve_host_id(country_devices_query, query)
-        if hostid == '-1':
-            return jsonify({
-                "response": f"That device cannot be found in {matched_country}",
-            })
-        
-        # Get device name from hostid
-        for devicename, host_id in country_devices.items():
-            if host_id == hostid:
-                device_name = devicename
-                break
-            
-        # Check if we need to fetch problems
-        problems_flag = False
-        for widget in page.get("widgets", []):
-            if widget.get("type") == 'problems':
-                problems_flag = True
-
-        # Fetch host information and problems
-        hostinfo = get_host_info(hostid, ZABBIX_API_TOKEN)
-
-        if problems_flag:
-            probleminfo = get_problems(hostid, ZABBIX_API_TOKEN)
-
-        # Extract device details
-        inventory_infomation = hostinfo[0].get("inventory")
-        description = hostinfo[0].get("description")
-        inventory_name = hostinfo[0].get("inventory")["name"]
-        inventory_model = hostinfo[0].get("inventory")["model"]
-        location = hostinfo[0].get("inventory")["location"]
-        notes = hostinfo[0].get("inventory")["notes"]
-        device_infomation = f"Device Name: {device_name}, Device Model: {inventory_model}, Description: {description}, Location: {location}"
-
-        # Process device problems
-        device_problems = []
-        for problem in probleminfo:
-            if problem.get("acknowledges") == []:
-                device_problems.append(f"Problem: {problem.get('name')} Severity: {problem.get('severity')}")
-            else:
-                device_problem = f"Problem: {problem.get('name')} Severity: {problem.get('severity')}"
-                acknowledges = problem.get("acknowledges")
-                for ack in acknowledges:
-                    if not (ack.get("action") == "4" and ack.get("new_severity") == "0"):
-                        device_problem = device_problem + f" Detail: {ack.get('message')}"
-                        device_problems.append(device_problem)
-
-        # Process device metrics
-        device_metrics = []
-        host_metrics = hostinfo[0].get("items")
-        for metric in host_metrics:
-            metric_name = f"Metric Name: {metric['name_resolved']}, " 
-            metric_desc = f"Description: {metric['description']}, "
-            metric_value = f"Value: {metric['lastvalue']}"
-            if metric_desc == "Description: , ":
-                device_metrics.append(metric_name + metric_value)
-            else:
-                device_metrics.append(metric_name + metric_desc + metric_value)
-
-        # Prepare data for GPT prompt
-        possible_metrics_str = "\n".join(device_metrics) 
-        problems_str = "\n".join(device_problems) if device_problems else "No current problems."
-        
-        # Create prompt for GPT to analyze the device data
-        prompt = f"""
-        You are an expert at analyzing network infrastructure data.
-        Below is the user question, some information about a device, and a list of potential metrics you can reference.
-        User Question:
-        {query}
-        Device Information:
-        {device_infomation}
-        Device Problems:
-        {problems_str}
-        Here is a list of the metrics and their values, find a metric and value pair that matches the query
-        {possible_metrics_str}
-        Please provide your best answer to the user's question by relevant metrics from the list above.
-        
-        Keep the response within 5 sentences
-        """
+        answer = run_pipeline(query_steps(query, session.get('dashboard_id', None)))
+        if "reply" in answer:
+            return jsonify(answer["reply"])
         
-        # Get response from GPT
-        system_content = "You are a helpful assistant for network monitoring."
-        generated_text = use_openai(system_content, prompt)
-        print("Decision AI Answer")
-        print(generated_text)
-        
-        return jsonify({
-            "response": generated_text,
-        })
+        # Get response from GPT (streamed when the client asks for it)
+        return answer_response(data=data, **answer)
         
     # Default return for other cases
     return render_template('index.html')
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import os
+
+import openai
+from quart import Quart, Response, g, jsonify, render_template, request, session
+
+import app as nms
+from instrumentation import CONTENT_TYPE, render
+from pipeline import run_steps_async
+from resilience import stage_timeout
+from serving import (
+    SSE_HEADERS, answer_events_async, answer_payload, chat_request, complete_async, register_request_hooks,
+    stream_completion_async, wants_stream
+)
+from zabbix_client import AsyncZabbixClient
+
+# ------------------ Async Serving Mode ------------------
+# Same routes and templates as app.py, served by an asyncio server. Zabbix and
+# OpenAI calls are awaited instead of blocking a worker thread, so one process
+# can hold many in-flight chats. Routing, prompts and caches come from app.py,
+# whose request pipelines run here with awaited upstream calls.
+
+# Shared, pooled non-blocking Zabbix connection
+azabbix = AsyncZabbixClient(
+    nms.ZABBIX_URL,
+    token=nms.ZABBIX_API_TOKEN,
+    pool_size=int(os.getenv('ZABBIX_POOL_SIZE', 10)),
+    connect_timeout=float(os.getenv('ZABBIX_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('ZABBIX_READ_TIMEOUT', 30)),
+    max_retries=int(os.getenv('ZABBIX_MAX_RETRIES', 2)),
+    breaker=nms.ZABBIX_BREAKER
+)
+
+_openai_client = None
+
+# Quart Application Setup
+app = Quart(__name__)
+app.secret_key = os.getenv('FLASK_SECRET_KEY')  # Required for session management
+
+@app.after_request
+async def add_ngrok_header(response):
+    """Add header to skip ngrok browser warning."""
+    response.headers["ngrok-skip-browser-warning"] = "true"
+    return response
+
+# Request IDs, latency budgets and request latency metrics
+register_request_hooks(app, request, g, nms.REQUEST_BUDGET, is_async=True)
+
+@app.before_serving
+async def start_fleet_snapshot():
+    """Start the snapshot poller (it runs in its own thread with the sync client)."""
+    if nms.fleet_snapshot:
+        nms.fleet_snapshot.start()
+
+@app.after_serving
+async def close_clients():
+    """Close the pooled upstream connections."""
+    await azabbix.close()
+    if _openai_client is not None:
+        await _openai_client.close()
+
+# ------------------ Async OpenAI ------------------
+
+def openai_client():
+    """
+    Get the shared async OpenAI client, configured like the module-level client in app.py.
+
+    Returns:
+        AsyncOpenAI: AsyncAzureOpenAI when OPENAI_API_TYPE is "azure", AsyncOpenAI otherwise
+    """
+    global _openai_client
+    if _openai_client is None:
+        if openai.api_type == "azure":
+            _openai_client = openai.AsyncAzureOpenAI(
+                azure_endpoint=openai.azure_endpoint,
+                api_key=openai.api_key,
+                api_version=openai.api_version
+            )
+        else:
+            _openai_client = openai.AsyncOpenAI(api_key=openai.api_key)
+    return _openai_client
+
+async def use_openai(system_content, user_content, temperature=0.7, max_tokens=800, stage="answer",
+                     timeout=nms.OPENAI_TIMEOUT):
+    """
+    Make a request to OpenAI API without blocking the event loop.
+
+    Args:
+        system_content: The system message for GPT
+        user_content: The user query for GPT
+        temperature: Sampling temperature (default: 0.7)
+        max_tokens: Maximum tokens in the completion (default: 800)
+        stage: Pipeline stage, used to label latency and token metrics
+        timeout: Longest time the call may take, cut to the request budget
+
+    Returns:
+        str: The GPT-generated response or empty string on error
+    """
+    async def create():
+        limit = stage_timeout(timeout)
+        with nms.OPENAI_BREAKER.guard():
+            # The SDK timeout applies to each retry; wait_for bounds them all
+            return await asyncio.wait_for(openai_client().chat.completions.create(
+                **chat_request(system_content, user_content, temperature, max_tokens, limit)
+            ), limit)
+
+    return await complete_async(create, stage)
+
+def stream_openai(system_content, user_content, temperature=0.7, max_tokens=800, stage="answer",
+                  timeout=nms.OPENAI_TIMEOUT):
+    """
+    Stream a response from OpenAI API as it is generated.
+
+    Returns:
+        async generator: Pieces of the GPT-generated response, in order (see serving.stream_completion)
+    """
+    async def create():
+        limit = stage_timeout(timeout)
+        with nms.OPENAI_BREAKER.guard():
+            return await asyncio.wait_for(openai_client().chat.completions.create(
+                **chat_request(system_content, user_content, temperature, max_tokens, limit, stream=True)
+            ), limit)
+
+    return stream_completion_async(create, system_content, user_content, stage)
+
+async def answer_response(system_content, user_content, data, extra=None, cache_key=None, stage="answer"):
+    """
+    Answer the query with a GPT completion, streamed as Server-Sent Events when requested.
+
+    Async counterpart of app.answer_response, sharing its answer cache. The
+    cache is read and written in worker threads, since its shared tier is on disk.
+
+    Args:
+        system_content: The system message for GPT
+        user_content: The user query or prompt for GPT
+        data: The parsed JSON request body
+        extra: Additional fields for the response (optional)
+        cache_key: Key in ANSWER_CACHE (optional, see answer_cache_key)
+        stage: Pipeline stage, used to label latency and token metrics
+
+    Returns:
+        Response: JSON or text/event-stream response
+    """
+    extra = extra or {}
+    cached_text = await asyncio.to_thread(nms.ANSWER_CACHE.get, cache_key) if cache_key else None
+
+    if wants_stream(data, request.headers):
+        events = answer_events_async(
+            lambda: stream_openai(system_content, user_content, stage=stage), extra, cached_text,
+            on_answer=lambda generated_text: asyncio.to_thread(nms.store_answer, cache_key, generated_text)
+        )
+        return Response(events, mimetype="text/event-stream", headers=SSE_HEADERS)
+
+    if cached_text is not None:
+        return jsonify(answer_payload(cached_text, extra, cached=True))
+
+    generated_text = await use_openai(system_content, user_content, stage=stage)
+    await asyncio.to_thread(nms.store_answer, cache_key, generated_text)
+    return jsonify(answer_payload(generated_text, extra))
+
+# ------------------ Async Pipelines ------------------
+
+async def in_thread(func, *args):
+    """Run a blocking step (CPU-bound work or a disk cache access) in a worker thread, off the event loop."""
+    return await asyncio.to_thread(func, *args)
+
+async def run_pipeline(steps):
+    """
+    Run a pipeline of app.py (see pipeline.py), awaiting its upstream calls.
+
+    Args:
+        steps: The pipeline generator
+
+    Returns:
+        The pipeline's return value
+    """
+    return await run_steps_async(steps, {
+        "openai": use_openai,
+        "zabbix": azabbix.call,
+        "zabbix_batch": lambda calls: azabbix.batch(calls, return_exceptions=True),
+        "thread": in_thread,
+        "fleet_status": get_fleet_status
+    })
+
+async def get_fleet_status():
+    """
+    Get the status of every dashboard in DASHBOARDS, FLEET_CONCURRENCY dashboards at a time.
+
+    Returns:
+        dict: {country: dashboard status (see app.get_dashboard_status) or None if it failed}
+    """
+    semaphore = asyncio.Semaphore(max(1, nms.FLEET_CONCURRENCY))
+
+    async def fetch(country):
+        async with semaphore:
+            try:
+                return await run_pipeline(nms.dashboard_status_steps(nms.DASHBOARDS[country]))
+            except Exception as e:
+                logging.error("Fetch for %r failed: %s", country, e)
+                return None
+
+    countries = list(nms.DASHBOARDS)
+    tasks = [asyncio.ensure_future(fetch(country)) for country in countries]
+    done, pending = await asyncio.wait(tasks, timeout=nms.ZABBIX_FETCH_TIMEOUT)
+    for task in pending:
+        task.cancel()
+        logging.warning("Fleet fetch timed out after %.1fs", nms.ZABBIX_FETCH_TIMEOUT)
+    return {country: task.result() if task in done else None for country, task in zip(countries, tasks)}
+
+# ------------------ Route Handlers ------------------
+
+@app.route('/', methods=['GET'])
+async def landing_page():
+    """Render the landing page with dashboard options."""
+    return await render_template('landing.html', dashboards=nms.DASHBOARDS)
+
+@app.route('/cache/stats', methods=['GET'])
+async def cache_stats():
+    """Expose cache sizes and hit/miss counters."""
+    return jsonify({
+        "answers": await asyncio.to_thread(nms.ANSWER_CACHE.stats),
+        "dashboards": await asyncio.to_thread(nms.DASHBOARD_CACHE.stats)
+    })
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Expose latency histograms, token counts, cache and error counters for Prometheus."""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+@app.route('/home', methods=['GET', 'POST'])
+async def home():
+    """
+    Handle GET requests to display the dashboard
+    and POST requests to process user queries.
+    """
+    # Handle GET requests to display the dashboard
+    if request.method == 'GET':
+        dashboard_id = request.args.get('dashboard_id', '')
+        if dashboard_id:
+            session['dashboard_id'] = dashboard_id
+
+        # ?refresh=1 forces the dashboard to be re-read from Zabbix
+        if request.args.get('refresh'):
+            nms.invalidate_dashboard(dashboard_id)
+
+        dashboard_devices = await run_pipeline(nms.dashboard_devices_steps(dashboard_id))
+        country_devices = dashboard_devices["devices"] if dashboard_devices else {}
+
+        return await render_template(
+            'index.html',
+            chosen_dashboard=session.get('dashboard_id', ''),
+            country_devices=country_devices
+        )
+
+    # Handle POST requests for user queries
+    data = await request.get_json()
+    query = data.get('query')
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+
+    answer = await run_pipeline(nms.query_steps(query, session.get('dashboard_id', None)))
+    if "reply" in answer:
+        return jsonify(answer["reply"])
+
+    # Get response from GPT (streamed when the client asks for it)
+    return await answer_response(data=data, **answer)
+
+# ------------------ Application Entry Point ------------------
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.environ.get("PORT", 8080))
+    uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,265 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import diskcache
+
+# ------------------ In-Process Caches ------------------
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache whose entries expire after a fixed time-to-live.
+
+    When `maxsize` is set, the least recently used entry is evicted once the
+    cache is full. Hits and misses are counted for monitoring.
+
+    Args:
+        ttl: Seconds an entry stays valid after it is stored
+        maxsize: Maximum number of entries (None for unbounded)
+    """
+
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for `key`, or `default` if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store `value` under `key` for `ttl` seconds (defaults to the cache TTL).
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Drop a single entry, or every entry when `key` is None.
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        """
+        Report the cache size and hit/miss counters.
+
+        Returns:
+            dict: {"size", "maxsize", "hits", "misses"}
+        """
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# ------------------ Shared Caches ------------------
+
+# Seconds to wait for a lock on the shared tier before treating the lookup as a miss
+SHARED_TIMEOUT = 1.0
+
+_MISSING = object()
+
+
+class TieredCache:
+    """
+    Cache shared by every worker process on a host, with an in-process tier in front.
+
+    Lookups go to an in-process TTLCache first, then to a diskcache directory
+    (SQLite, memory-mapped) that all workers open, so one worker's upstream fetch
+    warms the others. Entries found in the shared tier are copied into the
+    in-process tier for at most `local_ttl` seconds, which bounds how long a
+    worker can serve an entry another worker has invalidated. When the shared
+    tier is unavailable or locked, the cache works in-process only.
+
+    Values stored in the shared tier must be picklable.
+
+    Args:
+        name: Name of the cache (the subdirectory of `directory` it uses)
+        ttl: Seconds an entry stays valid after it is stored
+        maxsize: Maximum number of entries in the in-process tier (None for unbounded)
+        directory: Directory of the shared tier (None for an in-process cache)
+        local_ttl: Longest time an entry stays in the in-process tier (defaults to `ttl`)
+    """
+
+    def __init__(self, name, ttl, maxsize=None, directory=None, local_ttl=None):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.directory = os.path.join(directory, name) if directory else None
+        self.local = TTLCache(ttl=ttl if local_ttl is None else min(ttl, local_ttl), maxsize=maxsize)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._shared = None
+        self._lock = threading.Lock()
+
+    def _shared_cache(self):
+        with self._lock:
+            if self._shared is None and self.directory is not None:
+                try:
+                    self._shared = diskcache.Cache(self.directory, timeout=SHARED_TIMEOUT)
+                except Exception as e:
+                    logging.warning("Shared cache %s unavailable, caching in-process only: %s", self.name, e)
+                    self.directory = None
+            return self._shared
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for `key`, or `default` if it is missing or expired in both tiers.
+        """
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count("hits")
+            return value
+
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                value, expire_time = shared.get(key, default=_MISSING, expire_time=True)
+            except Exception as e:
+                logging.warning("Shared cache %s read failed: %s", self.name, e)
+                value = _MISSING
+            if value is not _MISSING:
+                remaining = expire_time - time.time() if expire_time else self.local.ttl
+                self.local.set(key, value, ttl=min(self.local.ttl, remaining))
+                self._count("hits")
+                self._count("shared_hits")
+                return value
+
+        self._count("misses")
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Store `value` under `key` in both tiers for `ttl` seconds (defaults to the cache TTL).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(key, value, ttl=min(self.local.ttl, ttl))
+
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                shared.set(key, value, expire=ttl)
+            except Exception as e:
+                logging.warning("Shared cache %s write failed: %s", self.name, e)
+
+    def invalidate(self, key=None):
+        """
+        Drop a single entry, or every entry when `key` is None, from both tiers.
+
+        Other workers drop their in-process copies when those expire.
+        """
+        self.local.invalidate(key)
+
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                if key is None:
+                    shared.clear()
+                else:
+                    shared.delete(key)
+            except Exception as e:
+                logging.warning("Shared cache %s invalidation failed: %s", self.name, e)
+
+    def stats(self):
+        """
+        Report the cache sizes and hit/miss counters.
+
+        Returns:
+            dict: {"size", "maxsize", "hits", "misses", "shared_hits", "shared_size"};
+                "hits" includes the hits served by the shared tier
+        """
+        shared = self._shared_cache()
+        try:
+            shared_size = len(shared) if shared is not None else None
+        except Exception:
+            shared_size = None
+        with self._lock:
+            return {
+                "size": len(self.local),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+                "shared_size": shared_size
+            }
+
+    def __len__(self):
+        return len(self.local)
+
+
+# ------------------ Last Good Data ------------------
+
+
+class LastGoodData:
+    """
+    Last successfully fetched data, kept to answer later fetches of the same data that fail.
+
+    Args:
+        cache: The cache holding the data (its TTL bounds how old fallback data may be)
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def remember(self, kind, key, data):
+        """
+        Keep freshly fetched data as the fallback for its kind and key.
+
+        Args:
+            kind: Kind of data, e.g. "dashboard"
+            key: Identity of the data within its kind
+            data: The data (picklable)
+        """
+        self.cache.set(f"{kind}:{key}", (time.time(), data))
+
+    def get(self, kind, key):
+        """
+        Get the data last remembered for a kind and key.
+
+        Returns:
+            tuple: (data, age in seconds), or (None, None) if there is none
+        """
+        entry = self.cache.get(f"{kind}:{key}")
+        if entry is None:
+            return None, None
+        stored_at, data = entry
+        return data, max(0.0, time.time() - stored_at)
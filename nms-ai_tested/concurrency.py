@@ -0,0 +1,106 @@
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+# ------------------ Concurrent Upstream Fetches ------------------
+
+# Shared worker pool for independent upstream calls (Zabbix, OpenAI, ...)
+FETCH_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv('FETCH_POOL_SIZE', 16)),
+    thread_name_prefix="fetch"
+)
+
+# Worker pool of bounded_map. Its calls may fan out on FETCH_POOL and wait for
+# the results; run on FETCH_POOL itself, enough of them would take every worker
+# and wait for calls that no worker is left to run.
+MAP_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv('MAP_POOL_SIZE', 8)),
+    thread_name_prefix="map"
+)
+
+
+def submit(func, *args, pool=FETCH_POOL):
+    """Run `func` on `pool` in a copy of the caller's context (request ID and deadline)."""
+    return pool.submit(contextvars.copy_context().run, func, *args)
+
+
+def fan_out(tasks, timeout=None, defaults=None):
+    """
+    Run independent calls concurrently and wait only for the slowest one.
+
+    Args:
+        tasks: Dictionary mapping a name to a zero-argument callable
+        timeout: Seconds each call may take, either one number for all calls or a
+            dictionary mapping names to seconds (None waits indefinitely)
+        defaults: Dictionary of results to use for calls that fail or time out
+            (missing names default to None)
+
+    Returns:
+        dict: The result of each call, keyed by name
+    """
+    defaults = defaults or {}
+    started = time.monotonic()
+    futures = {name: submit(task) for name, task in tasks.items()}
+
+    results = {}
+    for name, future in futures.items():
+        call_timeout = timeout.get(name) if isinstance(timeout, dict) else timeout
+        remaining = None if call_timeout is None else max(0, started + call_timeout - time.monotonic())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeout:
+            future.cancel()
+            logging.warning("Fetch %s timed out after %.1fs", name, call_timeout)
+            results[name] = defaults.get(name)
+        except Exception as e:
+            logging.error("Fetch %s failed: %s", name, e)
+            results[name] = defaults.get(name)
+
+    return results
+
+
+def bounded_map(func, items, limit, timeout=None, default=None):
+    """
+    Call `func` on every item concurrently, with at most `limit` calls in flight.
+
+    The calls run on MAP_POOL, so `func` may itself use fan_out.
+
+    Args:
+        func: Callable taking one item
+        items: The items to process
+        limit: Maximum number of concurrent calls
+        timeout: Seconds the whole map may take (None waits indefinitely)
+        default: Result for calls that fail or do not finish in time
+
+    Returns:
+        list: The result of each call, in the same order as `items`
+    """
+    items = list(items)
+    results = [default] * len(items)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pending = {}
+    next_index = 0
+
+    while next_index < len(items) or pending:
+        while next_index < len(items) and len(pending) < max(1, limit):
+            pending[submit(func, items[next_index], pool=MAP_POOL)] = next_index
+            next_index += 1
+
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            for future, index in pending.items():
+                future.cancel()
+                logging.warning("Fetch for %r timed out after %.1fs", items[index], timeout)
+            break
+
+        for future in done:
+            index = pending.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                logging.error("Fetch for %r failed: %s", items[index], e)
+
+    return results
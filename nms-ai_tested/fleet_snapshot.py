@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+
+from zabbix_client import ZabbixAPIError
+
+# ------------------ Background Fleet Snapshot ------------------
+
+
+class FleetSnapshot:
+    """
+    In-memory snapshot of hosts, latest item values and open problems for a set of dashboards.
+
+    A background thread keeps the snapshot fresh. A full pull (host.get with items and
+    problem.get) runs on start and every `full_refresh_interval` seconds. In between,
+    refreshes are incremental: item values come from history.get since the newest
+    `lastclock` seen (at most `history_limit` records, newest first; a longer backlog
+    triggers a full pull instead), new problems from problem.get since the newest
+    `eventid` seen, and problems that left the problem list are dropped by reconciling
+    against its event IDs. Problems are read with the same `problem_params` as live
+    queries, so the snapshot lists the same problems a live fetch would. Every
+    refresh is a single JSON-RPC batch, so the load on Zabbix does not depend on chat traffic.
+    The snapshot keeps and updates the hosts and items it receives, so its calls are
+    not coalesced with (and never share results with) chat requests.
+
+    The snapshot lives in the memory of the process that started it, so every worker
+    process of a multi-process server keeps its own and polls Zabbix on its own.
+
+    Args:
+        client: ZabbixClient used for all calls
+        dashboard_ids: Dashboards whose hosts are tracked
+        load_devices: Callable returning the {device name: hostid} map of a dashboard
+        fields: Dictionary of Zabbix output fields with the keys "host", "inventory" and "item"
+        problem_params: Callable building the problem.get parameters for a list of host IDs
+        interval: Seconds between refreshes
+        full_refresh_interval: Seconds between full re-pulls
+        history_limit: Most history records read by one incremental refresh
+    """
+
+    def __init__(self, client, dashboard_ids, load_devices, fields, problem_params, interval=60,
+                 full_refresh_interval=3600, history_limit=10000):
+        self.client = client
+        self.dashboard_ids = list(dashboard_ids)
+        self.load_devices = load_devices
+        self.fields = fields
+        self.problem_params = problem_params
+        self.interval = interval
+        self.full_refresh_interval = full_refresh_interval
+        self.history_limit = history_limit
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._hosts = {}
+        self._items = {}
+        self._problems = {}
+        self._trigger_hosts = {}
+        self._hostids = []
+        self._item_clock = 0
+        self._problem_eventid = 0
+        self._needs_full_refresh = True
+        self._full_refreshed_at = 0
+        self.updated_at = None
+
+    # ---- Lifecycle ----
+
+    def start(self):
+        """Start the background refresh thread (no-op if it is already running)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="fleet-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error("Fleet snapshot refresh failed: %s", e)
+            time.sleep(self.interval)
+
+    # ---- Reads ----
+
+    def age(self):
+        """Seconds since the last successful refresh, None if there has been none."""
+        if self.updated_at is None:
+            return None
+        return time.time() - self.updated_at
+
+    def host(self, hostid):
+        """
+        Get a host from the snapshot.
+
+        Args:
+            hostid: The ID of the host
+
+        Returns:
+            tuple: (host with its items, list of open problems, age in seconds),
+                None if the host is not in the snapshot
+        """
+        with self._lock:
+            host = self._hosts.get(str(hostid))
+            if host is None:
+                return None
+
+            host = {**host, "items": [dict(item) for item in host["items"]]}
+            problems = [
+                dict(problem) for problem in self._problems.values()
+                if self._trigger_hosts.get(problem.get("objectid")) == host["hostid"]
+            ]
+
+        problems.sort(key=lambda problem: int(problem["eventid"]), reverse=True)
+        return host, problems, self.age()
+
+    def hosts(self, hostids):
+        """
+        Get several hosts, without their items, from the snapshot.
+
+        Args:
+            hostids: IDs of the hosts
+
+        Returns:
+            tuple: ({hostid: host}, {hostid: list of open problems}, age in seconds);
+                hosts missing from the snapshot are left out
+        """
+        hostids = {str(hostid) for hostid in hostids}
+        with self._lock:
+            hosts = {
+                hostid: {key: value for key, value in host.items() if key != "items"}
+                for hostid, host in self._hosts.items() if hostid in hostids
+            }
+            problems = {hostid: [] for hostid in hosts}
+            for problem in self._problems.values():
+                hostid = self._trigger_hosts.get(problem.get("objectid"))
+                if hostid in problems:
+                    problems[hostid].append(dict(problem))
+
+        return hosts, problems, self.age()
+
+    # ---- Refresh ----
+
+    def refresh(self):
+        """Refresh the snapshot, fully or incrementally as needed; its age is unchanged if nothing was fetched."""
+        hostids = sorted({
+            str(hostid)
+            for dashboard_id in self.dashboard_ids
+            for hostid in (self.load_devices(dashboard_id) or {}).values()
+        })
+
+        full_due = time.time() - self._full_refreshed_at >= self.full_refresh_interval
+        if self._needs_full_refresh or full_due or hostids != self._hostids:
+            if not self._full_refresh(hostids):
+                return
+        else:
+            self._incremental_refresh()
+
+        self.updated_at = time.time()
+
+    def _full_refresh(self, hostids):
+        """Replace the snapshot with a full pull of `hostids`; returns False if there are none to pull."""
+        if not hostids:
+            return False
+
+        hosts, problems = self.client.batch([
+            ("host.get", {
+                "output": self.fields["host"],
+                "hostids": hostids,
+                "selectInventory": self.fields["inventory"],
+                "selectItems": self.fields["item"],
+                "selectTriggers": ["triggerid"]
+            }),
+            ("problem.get", self.problem_params(hostids))
+        ], coalesce=False)
+
+        host_map = {}
+        items = {}
+        trigger_hosts = {}
+        for host in hosts:
+            for item in host.get("items", []):
+                items[item["itemid"]] = item
+            for trigger in host.pop("triggers", []):
+                trigger_hosts[trigger["triggerid"]] = host["hostid"]
+            host_map[host["hostid"]] = host
+
+        with self._lock:
+            self._hosts = host_map
+            self._items = items
+            self._trigger_hosts = trigger_hosts
+            self._problems = {problem["eventid"]: problem for problem in problems}
+            self._hostids = hostids
+            self._item_clock = max((int(item.get("lastclock") or 0) for item in items.values()), default=0)
+            self._problem_eventid = max((int(eventid) for eventid in self._problems), default=0)
+            self._needs_full_refresh = False
+            self._full_refreshed_at = time.time()
+
+        logging.info("Fleet snapshot full refresh: %d hosts, %d items, %d problems",
+                     len(host_map), len(items), len(problems))
+        return True
+
+    def _incremental_refresh(self):
+        with self._lock:
+            itemids_by_type = {}
+            for item in self._items.values():
+                itemids_by_type.setdefault(item.get("value_type", "0"), []).append(item["itemid"])
+            # Values older than the last full pull are already in its lastvalue
+            time_from = max(self._item_clock, int(self._full_refreshed_at - self.interval))
+            problem_eventid = self._problem_eventid
+            hostids = self._hostids
+
+        params = self.problem_params(hostids)
+        open_params = {key: value for key, value in params.items() if key != "selectAcknowledges"}
+        value_types = sorted(itemids_by_type)
+        calls = [
+            ("problem.get", dict(open_params, output=["eventid"])),
+            ("problem.get", dict(params, eventid_from=str(problem_eventid + 1)))
+        ]
+        calls.extend(
+            ("history.get", {
+                "output": ["itemid", "clock", "value"],
+                "history": int(value_type),
+                "itemids": itemids_by_type[value_type],
+                "time_from": time_from,
+                "sortfield": "clock",
+                "sortorder": "DESC",
+                "limit": self.history_limit
+            })
+            for value_type in value_types
+        )
+
+        results = self.client.batch(calls, return_exceptions=True, coalesce=False)
+        open_problems, new_problems, histories = results[0], results[1], results[2:]
+        for result in (open_problems, new_problems):
+            if isinstance(result, ZabbixAPIError):
+                raise result
+
+        with self._lock:
+            updated = 0
+            for value_type, history in zip(value_types, histories):
+                if isinstance(history, ZabbixAPIError):
+                    logging.warning("Fleet snapshot history.get (type %s) failed: %s", value_type, history)
+                    continue
+                # Older values were cut off, and some items may be missing their latest one
+                if len(history) >= self.history_limit:
+                    self._needs_full_refresh = True
+                for record in history:
+                    item = self._items.get(record["itemid"])
+                    if item is None or int(record["clock"]) <= int(item.get("lastclock") or 0):
+                        continue
+                    item["lastvalue"] = record["value"]
+                    item["lastclock"] = record["clock"]
+                    self._item_clock = max(self._item_clock, int(record["clock"]))
+                    updated += 1
+
+            open_ids = {problem["eventid"] for problem in open_problems}
+            self._problems = {eventid: problem for eventid, problem in self._problems.items() if eventid in open_ids}
+            for problem in new_problems:
+                self._problems[problem["eventid"]] = problem
+                self._problem_eventid = max(self._problem_eventid, int(problem["eventid"]))
+                # A trigger we have not seen means the host configuration changed
+                if problem.get("objectid") not in self._trigger_hosts:
+                    self._needs_full_refresh = True
+
+        logging.info("Fleet snapshot incremental refresh: %d item values, %d new problems, %d open",
+                     updated, len(new_problems), len(open_ids))
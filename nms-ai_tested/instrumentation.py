@@ -0,0 +1,272 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# ------------------ Metrics and Request IDs ------------------
+
+# Prometheus text exposition format served by /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from a cache-speed Zabbix call to a long completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Request ID of the request being handled, attached to every log record
+REQUEST_ID = contextvars.ContextVar("request_id", default="-")
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _label_text(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """
+    Thread-safe counter with labels, exposed as a Prometheus counter.
+
+    Args:
+        name: Metric name
+        documentation: Help text
+        labelnames: Names of the labels passed to `inc`
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def inc(self, amount=1, **labels):
+        """Add `amount` to the counter for the given label values."""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Current value for the given label values."""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Histogram:
+    """
+    Thread-safe histogram with labels, exposed as a Prometheus histogram.
+
+    Args:
+        name: Metric name
+        documentation: Help text
+        labelnames: Names of the labels passed to `observe`
+        buckets: Upper bounds of the buckets, ascending
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def observe(self, value, **labels):
+        """Record one observation for the given label values."""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Collector:
+    """
+    Metric whose values are read from a callback when /metrics is scraped.
+
+    Args:
+        name: Metric name
+        documentation: Help text
+        kind: Prometheus type, "gauge" or "counter"
+        labelnames: Names of the labels
+        collect: Callable returning {tuple of label values: value}
+    """
+
+    def __init__(self, name, documentation, kind, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        register(self)
+
+    def render(self):
+        return [
+            f"{self.name}{_label_text(self.labelnames, key)} {value}"
+            for key, value in sorted(self.collect().items())
+        ]
+
+
+def register(metric):
+    """Add a metric to the /metrics output."""
+    with _registry_lock:
+        _registry.append(metric)
+
+
+def render():
+    """
+    Render every registered metric in the Prometheus text format.
+
+    Returns:
+        str: The exposition text
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---- Hot-path metrics ----
+
+REQUEST_LATENCY = Histogram(
+    "lucy_request_duration_seconds",
+    "Time until the response headers are sent, by route.",
+    ("route", "method", "status")
+)
+UPSTREAM_LATENCY = Histogram(
+    "lucy_upstream_duration_seconds",
+    "Latency of calls to Zabbix, ThingsBoard and OpenAI.",
+    ("service", "operation")
+)
+UPSTREAM_ERRORS = Counter(
+    "lucy_upstream_errors_total",
+    "Failed calls to Zabbix, ThingsBoard and OpenAI.",
+    ("service", "operation")
+)
+COALESCED_CALLS = Counter(
+    "lucy_upstream_coalesced_total",
+    "Upstream calls answered by an identical call already in flight.",
+    ("service", "operation")
+)
+CIRCUIT_REJECTIONS = Counter(
+    "lucy_circuit_rejections_total",
+    "Upstream calls refused because the upstream's circuit breaker was open.",
+    ("upstream",)
+)
+LLM_TOKENS = Counter(
+    "lucy_llm_tokens_total",
+    "Prompt and completion tokens, by stage (estimated for streamed answers).",
+    ("stage", "type")
+)
+
+
+@contextmanager
+def timed(service, operation):
+    """
+    Time an upstream call and count it as an error if it raises.
+
+    Args:
+        service: "zabbix", "thingsboard" or "openai"
+        operation: The API method or LLM stage
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service=service, operation=operation)
+
+
+def record_tokens(stage, prompt_tokens, completion_tokens):
+    """Count the prompt and completion tokens of one LLM call."""
+    LLM_TOKENS.inc(prompt_tokens or 0, stage=stage, type="prompt")
+    LLM_TOKENS.inc(completion_tokens or 0, stage=stage, type="completion")
+
+
+def register_cache(name, cache):
+    """Expose the hit, miss and size counters of a TTLCache or TieredCache."""
+    Collector(
+        f"lucy_{name}_cache_requests_total", f"Lookups in the {name} cache, by result.", "counter",
+        ("result",), lambda: {("hit",): cache.stats()["hits"], ("miss",): cache.stats()["misses"]}
+    )
+    Collector(
+        f"lucy_{name}_cache_entries", f"Entries in the in-process tier of the {name} cache.", "gauge",
+        (), lambda: {(): cache.stats()["size"]}
+    )
+    if "shared_hits" in cache.stats():
+        Collector(
+            f"lucy_{name}_cache_shared_hits_total",
+            f"Hits in the {name} cache served by the tier shared between workers.", "counter",
+            (), lambda: {(): cache.stats()["shared_hits"]}
+        )
+
+
+# ---- Request IDs ----
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request ID to log records as `request_id`."""
+
+    def filter(self, record):
+        record.request_id = REQUEST_ID.get()
+        return True
+
+
+def install_request_id_logging():
+    """Add the request ID filter to every root log handler."""
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RequestIdFilter())
+
+
+def start_request(incoming_id=None):
+    """
+    Set the request ID for the current request.
+
+    Args:
+        incoming_id: An X-Request-ID sent by the client or a proxy (optional)
+
+    Returns:
+        str: The request ID
+    """
+    request_id = (incoming_id or "")[:64] or uuid.uuid4().hex[:16]
+    REQUEST_ID.set(request_id)
+    return request_id
@@ -0,0 +1,169 @@
+import math
+import re
+
+# ------------------ Compact Prompt Encoding ------------------
+
+# Word pieces and single punctuation marks, roughly how BPE tokenizers split text
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+# Numbers with more digits than a float holds exactly, or with leading zeros, are identifiers
+# (serials, IMEIs, MAC-like codes) and are kept as written
+IDENTIFIER_PATTERN = re.compile(r"[+-]?(0\d+|\d{16,})")
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of model tokens in a text without a tokenizer.
+
+    Letters count one token per 4 characters of each word, digits one per 3,
+    and every punctuation mark one token.
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        int: Estimated token count
+    """
+    tokens = 0
+    for piece in TOKEN_PATTERN.findall(text):
+        if piece.isalpha():
+            tokens += math.ceil(len(piece) / 4)
+        elif piece.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+def format_value(value, digits=3, max_chars=80):
+    """
+    Format a value for a prompt: numbers rounded, text collapsed and shortened.
+
+    Integers, and numeric text that looks like an identifier (see
+    IDENTIFIER_PATTERN), are never rounded.
+
+    Args:
+        value: The value to format
+        digits: Decimal places kept for numbers (significant digits below 1)
+        max_chars: Longest text kept before it is cut with "..."
+
+    Returns:
+        str: The formatted value, an empty string for empty values
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value).lower()
+
+    if isinstance(value, int):
+        return str(value)
+
+    text = str(value).strip()
+    if IDENTIFIER_PATTERN.fullmatch(text):
+        return text
+    try:
+        number = float(text)
+    except ValueError:
+        text = " ".join(text.split()).replace("|", "/")
+        return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+    if math.isnan(number) or math.isinf(number):
+        return text
+    if number == int(number):
+        return str(int(number))
+    # Small values keep significant digits rather than decimal places
+    if abs(number) < 1:
+        return f"{number:.{digits}g}"
+    return f"{round(number, digits):f}".rstrip("0").rstrip(".")
+
+
+def encode_rows(rows, columns, token_budget=None, legend_columns=(), digits=3, max_chars=80, merge_duplicates=False):
+    """
+    Encode records as a compact pipe-separated table for a prompt.
+
+    Columns that are empty in every row are dropped. Values in `legend_columns`
+    that repeat across rows (typically descriptions) are written once in a
+    legend and referenced by a short id. With `merge_duplicates`, identical rows
+    are written once with a "Count" column. Rows are kept in order until the
+    token budget is reached; the rest are counted as omitted.
+
+    Args:
+        rows: List of dictionaries
+        columns: List of (key, header) pairs, in output order
+        token_budget: Maximum estimated tokens for the table (None for no limit)
+        legend_columns: Keys whose repeated values go to the legend
+        digits: Decimal places kept for numbers
+        max_chars: Longest text kept per cell
+        merge_duplicates: Write identical rows once, with their count
+
+    Returns:
+        tuple: (table text, {"rows": kept rows, "omitted": omitted rows, "tokens": estimated tokens})
+    """
+    cells = [{key: format_value(row.get(key), digits, max_chars) for key, _ in columns} for row in rows]
+    columns = [(key, header) for key, header in columns if any(cell[key] for cell in cells)]
+    if not columns:
+        return "", {"rows": 0, "omitted": len(rows), "tokens": 0}
+
+    if merge_duplicates:
+        merged = {}
+        for cell in cells:
+            row_key = tuple(cell[key] for key, _ in columns)
+            if row_key in merged:
+                merged[row_key]["count"] += 1
+            else:
+                merged[row_key] = dict(cell, count=1)
+        cells = list(merged.values())
+        columns = columns + [("count", "Count")]
+        for cell in cells:
+            cell["count"] = str(cell["count"])
+
+    # Repeated legend values are replaced by ids such as "d1"
+    counts = {}
+    for cell in cells:
+        for key in legend_columns:
+            if cell.get(key):
+                counts[cell[key]] = counts.get(cell[key], 0) + 1
+    legend_ids = {}
+
+    header = " | ".join(header for _, header in columns)
+    lines = [header]
+    legend = []
+    used_tokens = estimate_tokens(header)
+    kept = 0
+
+    for cell in cells:
+        new_values = []
+        values = []
+        for key, _ in columns:
+            value = cell[key]
+            if key in legend_columns and counts.get(value, 0) > 1:
+                if value not in legend_ids:
+                    legend_ids[value] = f"d{len(legend_ids) + 1}"
+                    new_values.append(value)
+                value = legend_ids[value]
+            values.append(value)
+
+        line = " | ".join(values)
+        new_legend = [f"{legend_ids[value]}: {value}" for value in new_values]
+        line_tokens = estimate_tokens(line) + sum(estimate_tokens(entry) for entry in new_legend)
+        if new_legend and not legend:
+            line_tokens += estimate_tokens("Legend:")
+        if token_budget is not None and used_tokens + line_tokens > token_budget:
+            for value in new_values:
+                del legend_ids[value]
+            break
+
+        lines.append(line)
+        legend.extend(new_legend)
+        used_tokens += line_tokens
+        kept += 1
+
+    omitted = len(cells) - kept
+    if legend:
+        lines.append("Legend:")
+        lines.extend(legend)
+    if omitted:
+        lines.append(f"({omitted} more rows omitted)")
+
+    text = "\n".join(lines)
+    return text, {"rows": kept, "omitted": omitted, "tokens": estimate_tokens(text)}
@@ -0,0 +1,213 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from instrumentation import CIRCUIT_REJECTIONS, Collector
+
+# ------------------ Deadlines and Circuit Breakers ------------------
+
+# Deadline of the request being handled (None outside requests, e.g. in the fleet snapshot)
+REQUEST_DEADLINE = contextvars.ContextVar("request_deadline", default=None)
+
+# Threads for upstream clients without a timeout of their own (see call_with_timeout)
+TIMEOUT_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="upstream")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's latency budget is spent before an upstream call can finish."""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class Deadline:
+    """
+    Latency budget of one request, shared by every stage of its call chain.
+
+    Args:
+        budget: Seconds the request may take (None for no limit)
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = None if budget is None else time.monotonic() + budget
+
+    def remaining(self):
+        """Seconds left, or None when there is no limit."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+def start_deadline(budget):
+    """
+    Set the latency budget of the current request.
+
+    Args:
+        budget: Seconds the request may take (None or 0 for no limit)
+
+    Returns:
+        Deadline: The request deadline
+    """
+    deadline = Deadline(budget or None)
+    REQUEST_DEADLINE.set(deadline)
+    return deadline
+
+
+@contextmanager
+def stage_deadline(limit):
+    """
+    Run a stage of the request under its own limit, within what is left of the request budget.
+
+    Upstream calls made in the stage (see stage_timeout) stop when the stage
+    limit is reached, so later stages keep the rest of the budget.
+
+    Args:
+        limit: Seconds the stage may take (None for no stage limit)
+    """
+    deadline = REQUEST_DEADLINE.get()
+    remaining = deadline.remaining() if deadline else None
+    if limit is not None and (remaining is None or limit < remaining):
+        remaining = limit
+    token = REQUEST_DEADLINE.set(Deadline(remaining))
+    try:
+        yield
+    finally:
+        REQUEST_DEADLINE.reset(token)
+
+
+def stage_timeout(limit=None):
+    """
+    Timeout of the next upstream call: its own stage limit, cut to what is left of the request budget.
+
+    Args:
+        limit: Longest time the stage may take on its own (None for no stage limit)
+
+    Returns:
+        float: Seconds, or None when neither the stage nor the request is limited
+
+    Raises:
+        DeadlineExceeded: When the request budget is already spent
+    """
+    deadline = REQUEST_DEADLINE.get()
+    remaining = deadline.remaining() if deadline else None
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded(f"Request budget of {deadline.budget:.1f}s spent")
+    if remaining is None:
+        return limit
+    return remaining if limit is None else min(limit, remaining)
+
+
+def call_with_timeout(func, timeout):
+    """
+    Call `func` in a worker thread and stop waiting for it after `timeout` seconds.
+
+    For clients that cannot be given a timeout, or whose timeout applies to each
+    retry separately. The call itself keeps running until the upstream answers;
+    repeated timeouts open the caller's circuit breaker, which stops new calls
+    from piling up behind it.
+
+    Args:
+        func: Zero-argument callable making the upstream call
+        timeout: Seconds to wait (None waits indefinitely)
+
+    Returns:
+        The result of the call
+
+    Raises:
+        DeadlineExceeded: When the call does not finish in time
+    """
+    if timeout is None:
+        return func()
+
+    future = TIMEOUT_POOL.submit(contextvars.copy_context().run, func)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise DeadlineExceeded(f"No answer after {timeout:.1f}s") from None
+
+
+class CircuitBreaker:
+    """
+    Stop calling an upstream that keeps failing, and probe it again after a pause.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail at once with CircuitOpenError instead of waiting for their timeouts.
+    After `reset_timeout` seconds one trial call is let through (half-open):
+    the circuit closes if it succeeds and opens again if it fails.
+
+    Args:
+        name: Upstream name, e.g. "zabbix", for logs and metrics
+        failure_threshold: Consecutive failures that open the circuit
+        reset_timeout: Seconds the circuit stays open before a trial call
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check that a call may be made now.
+
+        Raises:
+            CircuitOpenError: While the circuit is open, or while a trial call is in flight
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            # A trial that never reported back is replaced after another pause
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return
+        CIRCUIT_REJECTIONS.inc(upstream=self.name)
+        raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info("Circuit for %s closed", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning("Circuit for %s opened after %d failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    @contextmanager
+    def guard(self):
+        """Allow one call, and record whether it raised."""
+        self.allow()
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+
+
+def register_breakers(*breakers):
+    """Expose the state of circuit breakers on /metrics (0 closed, 1 half-open, 2 open)."""
+    levels = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+    Collector(
+        "lucy_circuit_state", "State of each upstream circuit breaker: 0 closed, 1 half-open, 2 open.", "gauge",
+        ("upstream",), lambda: {(breaker.name,): levels[breaker.state] for breaker in breakers}
+    )
@@ -0,0 +1,150 @@
+import numpy as np
+
+# ------------------ Time Series Summaries ------------------
+
+
+def records_to_arrays(records, value_key="value"):
+    """
+    Convert Zabbix history/trend records into NumPy arrays.
+
+    Args:
+        records: List of records with "itemid", "clock" and `value_key`
+        value_key: The value field ("value" for history, "value_avg" etc. for trends)
+
+    Returns:
+        tuple: (itemids, clocks, values) arrays of equal length
+    """
+    count = len(records)
+    itemids = np.fromiter((record["itemid"] for record in records), dtype=object, count=count)
+    clocks = np.fromiter((record["clock"] for record in records), dtype=np.int64, count=count)
+    values = np.fromiter((record[value_key] for record in records), dtype=np.float64, count=count)
+    return itemids, clocks, values
+
+
+def bucket_means(clocks, values, time_from, time_till, buckets):
+    """
+    Downsample a series to the mean value of equal-width time buckets.
+
+    Args:
+        clocks: Sample timestamps
+        values: Sample values
+        time_from: Start of the window
+        time_till: End of the window
+        buckets: Number of buckets
+
+    Returns:
+        ndarray: Mean of each bucket, NaN for empty buckets
+    """
+    width = max(time_till - time_from, 1) / buckets
+    index = np.clip(((clocks - time_from) / width).astype(np.int64), 0, buckets - 1)
+    sums = np.bincount(index, weights=values, minlength=buckets)
+    counts = np.bincount(index, minlength=buckets)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def change_points(means, time_from, time_till, max_points=3):
+    """
+    Find the bucket boundaries where the level of a series shifts sharply.
+
+    A shift counts when the step between consecutive bucket means is well above
+    the typical step (3 robust standard deviations), at least 10% of the series
+    range and at least 5% of the series level. Consecutive steps in the same direction form one shift.
+
+    Args:
+        means: Bucket means (see bucket_means)
+        time_from: Start of the window
+        time_till: End of the window
+        max_points: Maximum number of change points returned
+
+    Returns:
+        list: (timestamp, step) pairs, largest steps first
+    """
+    present = np.flatnonzero(~np.isnan(means))
+    if len(present) < 3:
+        return []
+
+    steps = np.diff(means[present])
+    deviation = 1.4826 * np.median(np.abs(steps - np.median(steps)))
+    spread = np.ptp(means[present])
+    level = np.abs(np.mean(means[present]))
+    limit = max(3 * deviation, 0.1 * spread, 0.05 * level)
+    if limit <= 0:
+        return []
+
+    width = (time_till - time_from) / len(means)
+    shifts = []
+    for jump in np.flatnonzero(np.abs(steps) > limit):
+        # A shift that straddles a bucket boundary shows as two steps in the same direction
+        if shifts and shifts[-1][2] == jump - 1 and np.sign(shifts[-1][1]) == np.sign(steps[jump]):
+            shifts[-1] = (shifts[-1][0], shifts[-1][1] + float(steps[jump]), jump)
+        else:
+            shifts.append((int(time_from + present[jump + 1] * width), float(steps[jump]), jump))
+
+    shifts.sort(key=lambda shift: abs(shift[1]), reverse=True)
+    return [(timestamp, step) for timestamp, step, _ in shifts[:max_points]]
+
+
+def time_above(clocks, values, threshold, time_till):
+    """
+    Seconds a series spent above a threshold, holding each sample until the next.
+
+    Args:
+        clocks: Sample timestamps, ascending
+        values: Sample values
+        threshold: The threshold
+        time_till: End of the window
+
+    Returns:
+        float: Seconds above the threshold
+    """
+    durations = np.diff(clocks, append=max(time_till, clocks[-1]))
+    return float(durations[values > threshold].sum())
+
+
+def summarize_series(clocks, values, time_from, time_till, threshold=None, buckets=12,
+                     minimums=None, maximums=None, weights=None):
+    """
+    Summarize a time series without sending its points anywhere.
+
+    For trend data, pass the hourly averages as `values` and the hourly minimums,
+    maximums and sample counts as `minimums`, `maximums` and `weights`.
+
+    Args:
+        clocks: Sample timestamps
+        values: Sample values
+        time_from: Start of the window
+        time_till: End of the window
+        threshold: Report the time spent above this value (optional)
+        buckets: Number of points in the downsampled series
+        minimums: Per-sample minimums (optional)
+        maximums: Per-sample maximums (optional)
+        weights: Per-sample weights for the mean (optional)
+
+    Returns:
+        dict: {"points", "min", "max", "mean", "p50", "p95", "p99", "first", "last",
+            "downsampled", "change_points", "time_above"}, None for an empty series
+    """
+    if len(values) == 0:
+        return None
+
+    order = np.argsort(clocks, kind="stable")
+    clocks, values = clocks[order], values[order]
+    minimums, maximums, weights = (None if array is None else array[order] for array in (minimums, maximums, weights))
+
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    means = bucket_means(clocks, values, time_from, time_till, buckets)
+    return {
+        "points": int(len(values) if weights is None else weights.sum()),
+        "min": float((values if minimums is None else minimums).min()),
+        "max": float((values if maximums is None else maximums).max()),
+        "mean": float(np.average(values, weights=weights)),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "first": float(values[0]),
+        "last": float(values[-1]),
+        "downsampled": means,
+        "change_points": change_points(means, time_from, time_till),
+        "time_above": None if threshold is None else time_above(clocks, values, threshold, time_till)
+    }
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import threading
+
+from instrumentation import COALESCED_CALLS
+from resilience import DeadlineExceeded, stage_timeout
+
+# ------------------ Request Coalescing ------------------
+
+
+def flight_key(*parts):
+    """
+    Build a single-flight key from a method name and its parameters.
+
+    Parameters are serialized with sorted keys, so equal dictionaries give equal keys.
+
+    Returns:
+        str: The key
+    """
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+class _Call:
+    """One in-flight call and, once it has finished, its result or exception."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Share one in-flight upstream call between threads that make the same call.
+
+    The first thread to ask for a key runs the call; threads asking for the same
+    key while it runs wait for it and get its result (or its exception) instead of
+    sending their own. Nothing is kept once the call finishes, so this only
+    coalesces concurrent calls; caching finished ones is left to the caches.
+
+    Callers sharing a result get the same object and must not modify it. A
+    waiting thread stops waiting when its own request budget is spent.
+
+    Args:
+        service: Upstream service name, used to label the coalesced-call counter
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, operation="", **kwargs):
+        """
+        Call `func(*args, **kwargs)`, or wait for the identical call already in flight.
+
+        Args:
+            key: Identity of the call (see flight_key)
+            func: The upstream call
+            operation: Operation name for the coalesced-call counter
+
+        Returns:
+            The result of the call
+
+        Raises:
+            DeadlineExceeded: When the request budget is spent waiting for another thread's call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            COALESCED_CALLS.inc(service=self.service, operation=operation)
+            if not call.done.wait(stage_timeout()):
+                raise DeadlineExceeded(f"Request budget spent waiting for {operation or key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Share one in-flight upstream call between coroutines that make the same call.
+
+    Async counterpart of SingleFlight for the ASGI serving mode. The call runs as
+    its own task, so a waiting request that is cancelled (e.g. a client
+    disconnect) does not cancel the call for the others.
+
+    Args:
+        service: Upstream service name, used to label the coalesced-call counter
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self._tasks = {}
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the exception as retrieved when every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key, func, *args, operation="", **kwargs):
+        """
+        Await `func(*args, **kwargs)`, or the identical call already in flight.
+
+        Args:
+            key: Identity of the call (see flight_key)
+            func: Coroutine function making the upstream call
+            operation: Operation name for the coalesced-call counter
+
+        Returns:
+            The result of the call
+
+        Raises:
+            DeadlineExceeded: When the request budget is spent before the call finishes
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            COALESCED_CALLS.inc(service=self.service, operation=operation)
+        # asyncio.wait neither cancels the call on timeout nor when this waiter is cancelled
+        done, _ = await asyncio.wait({task}, timeout=stage_timeout())
+        if not done:
+            raise DeadlineExceeded(f"Request budget spent waiting for {operation or key}")
+        return task.result()
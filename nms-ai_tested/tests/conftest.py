@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Tests import the app modules as app.py does, and the stub servers of the replay benchmark
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(APP_DIR), "benchmarks"))
+
+# Keep the shared caches of app.py out of the real cache directory
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="lucy-nms-tests-"))
+os.environ.setdefault("FLEET_SNAPSHOT_INTERVAL", "0")
@@ -0,0 +1,60 @@
+import time
+
+from cache import TieredCache, TTLCache
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a", "missing") == "missing"
+    assert cache.stats() == {"size": 0, "maxsize": None, "hits": 1, "misses": 1}
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_tiered_cache_shares_entries_between_instances(tmp_path):
+    writer = TieredCache("answers", ttl=60, directory=str(tmp_path))
+    reader = TieredCache("answers", ttl=60, directory=str(tmp_path))
+    writer.set("key", {"response": "ok"})
+
+    assert reader.get("key") == {"response": "ok"}
+    assert reader.get("key") == {"response": "ok"}
+    stats = reader.stats()
+    assert (stats["hits"], stats["shared_hits"], stats["misses"]) == (2, 1, 0)
+
+
+def test_tiered_cache_invalidation_reaches_the_shared_tier(tmp_path):
+    first = TieredCache("answers", ttl=60, directory=str(tmp_path), local_ttl=0.05)
+    second = TieredCache("answers", ttl=60, directory=str(tmp_path), local_ttl=0.05)
+    first.set("key", 1)
+    assert second.get("key") == 1
+
+    first.invalidate("key")
+    assert first.get("key") is None
+    # The second worker's in-process copy lives at most local_ttl
+    time.sleep(0.06)
+    assert second.get("key") is None
+
+
+def test_tiered_cache_expires_shared_entries(tmp_path):
+    cache = TieredCache("answers", ttl=60, directory=str(tmp_path))
+    cache.set("key", 1, ttl=0.05)
+    time.sleep(0.06)
+    assert TieredCache("answers", ttl=60, directory=str(tmp_path)).get("key") is None
+
+
+def test_tiered_cache_without_directory_is_in_process():
+    cache = TieredCache("answers", ttl=60)
+    cache.set("key", 1)
+    assert cache.get("key") == 1
+    assert cache.stats()["shared_size"] is None
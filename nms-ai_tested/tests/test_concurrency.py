@@ -0,0 +1,47 @@
+import threading
+import time
+
+import app
+from concurrency import FETCH_POOL, MAP_POOL, bounded_map, fan_out
+from stubs import ZabbixStub
+from zabbix_client import ZabbixAPIError, ZabbixClient
+
+
+def test_fan_out_uses_defaults_for_failed_and_late_calls():
+    def fail():
+        raise ValueError("down")
+
+    results = fan_out(
+        {"fast": lambda: 1, "slow": lambda: time.sleep(1), "broken": fail},
+        timeout={"fast": 1, "slow": 0.05, "broken": 1},
+        defaults={"slow": "late"}
+    )
+    assert results == {"fast": 1, "slow": "late", "broken": None}
+
+
+def test_bounded_map_calls_may_fan_out():
+    # As many outer calls as fetch workers, running in groups: on one pool, the inner calls could never run
+    items = list(range(FETCH_POOL._max_workers))
+    started = threading.Barrier(min(len(items), MAP_POOL._max_workers))
+
+    def fetch(item):
+        started.wait(timeout=2)
+        return sum(fan_out({0: lambda: item, 1: lambda: item}, timeout=1).values())
+
+    assert bounded_map(fetch, items, limit=len(items), timeout=5) == [2 * item for item in items]
+
+
+def test_zabbix_batch_sends_concurrent_requests_when_batching_is_off(monkeypatch):
+    stub = ZabbixStub().start()
+    try:
+        monkeypatch.setattr(app, "zabbix", ZabbixClient(stub.url + "/api_jsonrpc.php", token="t"))
+        monkeypatch.setattr(app, "ZABBIX_BATCH_REQUESTS", False)
+        hosts, missing = app.zabbix_batch([
+            ("host.get", {"hostids": ["13001"], "output": ["hostid"]}),
+            ("nothing.get", {})
+        ])
+        assert hosts[0]["hostid"] == "13001"
+        assert isinstance(missing, ZabbixAPIError)
+        assert stub.counts() == (2, 2)
+    finally:
+        stub.stop()
@@ -0,0 +1,40 @@
+import pytest
+
+from fleet_snapshot import FleetSnapshot
+from stubs import ZabbixStub
+from zabbix_client import ZabbixClient
+
+FIELDS = {"host": ["hostid", "name"], "inventory": ["location"], "item": ["itemid", "name", "lastvalue", "lastclock"]}
+
+
+@pytest.fixture(scope="module")
+def stub():
+    stub = ZabbixStub(items_per_host=3).start()
+    yield stub
+    stub.stop()
+
+
+def snapshot(stub, devices):
+    return FleetSnapshot(
+        ZabbixClient(stub.url + "/api_jsonrpc.php", token="t"), ["130"], lambda dashboard_id: devices, FIELDS,
+        lambda hostids: {"output": "extend", "hostids": hostids}
+    )
+
+
+def test_refresh_without_hosts_leaves_the_snapshot_unrefreshed(stub):
+    fleet = snapshot(stub, {})
+    fleet.refresh()
+
+    assert fleet.updated_at is None
+    assert fleet.age() is None
+
+
+def test_refresh_pulls_the_dashboard_hosts(stub):
+    devices = stub.devices("130")
+    fleet = snapshot(stub, devices)
+    fleet.refresh()
+
+    assert fleet.age() is not None
+    hosts, problems, age = fleet.hosts(list(devices.values()))
+    assert set(hosts) == set(devices.values())
+    assert age is not None
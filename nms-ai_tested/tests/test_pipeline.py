@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from pipeline import run_steps, run_steps_async, upstream
+
+
+def host_steps(hostid):
+    try:
+        hosts = yield upstream("zabbix", "host.get", {"hostids": hostid})
+    except ValueError:
+        return "unavailable"
+    name = yield from name_steps(hosts[0])
+    return name
+
+
+def name_steps(host):
+    answer = yield upstream("openai", f"Name {host['hostid']}", stage="name")
+    return answer.upper()
+
+
+def test_run_steps_passes_results_back_to_the_pipeline():
+    calls = []
+
+    def zabbix(method, params):
+        calls.append((method, params))
+        return [{"hostid": params["hostids"]}]
+
+    handlers = {"zabbix": zabbix, "openai": lambda prompt, stage: f"{prompt} ({stage})"}
+    assert run_steps(host_steps("10084"), handlers) == "NAME 10084 (NAME)"
+    assert calls == [("host.get", {"hostids": "10084"})]
+
+
+def test_run_steps_throws_handler_errors_into_the_pipeline():
+    def zabbix(method, params):
+        raise ValueError("down")
+
+    assert run_steps(host_steps("10084"), {"zabbix": zabbix}) == "unavailable"
+
+
+def test_run_steps_raises_errors_the_pipeline_does_not_handle():
+    def openai(prompt, stage):
+        raise RuntimeError("quota")
+
+    with pytest.raises(RuntimeError):
+        run_steps(host_steps("10084"), {"zabbix": lambda method, params: [{"hostid": "1"}], "openai": openai})
+
+
+def test_run_steps_async_awaits_the_handlers():
+    async def zabbix(method, params):
+        await asyncio.sleep(0)
+        return [{"hostid": params["hostids"]}]
+
+    async def openai(prompt, stage):
+        return prompt
+
+    assert asyncio.run(run_steps_async(host_steps("10084"), {"zabbix": zabbix, "openai": openai})) == "NAME 10084"
@@ -0,0 +1,23 @@
+import pytest
+
+from prompt_encoding import encode_rows, format_value
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("10084", "10084"),
+    ("0042", "0042"),
+    ("1234567890123456789", "1234567890123456789"),
+    (1234567890123456789, "1234567890123456789"),
+    (0.123456, "0.123"),
+    ("2500000.25", "2500000.25"),
+    ("12.0", "12"),
+])
+def test_format_value(value, expected):
+    assert format_value(value) == expected
+
+
+def test_encode_rows_keeps_long_ids():
+    rows = [{"itemid": "1234567890123456789", "value": "0.5"}]
+    table, stats = encode_rows(rows, [("itemid", "ItemID"), ("value", "Value")])
+    assert "1234567890123456789" in table
+    assert stats["rows"] == 1
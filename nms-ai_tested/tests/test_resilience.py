@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from resilience import (
+    CircuitBreaker, CircuitOpenError, DeadlineExceeded, REQUEST_DEADLINE, call_with_timeout,
+    stage_deadline, stage_timeout, start_deadline
+)
+
+
+@pytest.fixture(autouse=True)
+def no_request_deadline():
+    token = REQUEST_DEADLINE.set(None)
+    yield
+    REQUEST_DEADLINE.reset(token)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_breaker_lets_one_trial_call_through_after_the_pause():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # A second call waits for the trial
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+
+
+def test_breaker_reopens_when_the_trial_fails():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError("still down")
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_stage_timeout_without_a_deadline():
+    assert stage_timeout() is None
+    assert stage_timeout(5) == 5
+
+
+def test_stage_timeout_is_cut_to_the_request_budget():
+    start_deadline(1)
+    assert 0.9 < stage_timeout(5) <= 1
+    assert stage_timeout(0.5) == 0.5
+
+
+def test_stage_deadline_limits_calls_inside_the_stage_only():
+    start_deadline(10)
+    with stage_deadline(0.5):
+        assert stage_timeout(5) <= 0.5
+    assert stage_timeout(5) == 5
+
+
+def test_stage_deadline_cannot_extend_the_request_budget():
+    start_deadline(0.5)
+    with stage_deadline(10):
+        assert stage_timeout() <= 0.5
+
+
+def test_spent_budget_raises():
+    start_deadline(0.01)
+    time.sleep(0.02)
+    with pytest.raises(DeadlineExceeded):
+        stage_timeout(5)
+
+
+def test_zero_budget_means_no_limit():
+    start_deadline(0)
+    assert stage_timeout() is None
+
+
+def test_call_with_timeout_stops_waiting():
+    release = threading.Event()
+    try:
+        with pytest.raises(DeadlineExceeded):
+            call_with_timeout(lambda: release.wait(5), 0.05)
+    finally:
+        release.set()
+    assert call_with_timeout(lambda: "ok", 1) == "ok"
+
+
+def test_call_with_timeout_keeps_the_request_deadline():
+    deadline = start_deadline(10)
+    assert call_with_timeout(REQUEST_DEADLINE.get, 1) is deadline
@@ -0,0 +1,124 @@
+import pytest
+
+import app
+
+DEVICES = {"VSAT": "13001", "UPS": "13002", "VOIP VSAT": "13003", "Switch 1": "13004", "Switch 2": "13005"}
+
+
+@pytest.fixture
+def dashboard_devices():
+    return {
+        "devices": DEVICES,
+        "widget_types": {"UPS": ["problems", "graph"], "VSAT": ["graph"]},
+        "index": app.DeviceIndex(DEVICES)
+    }
+
+
+@pytest.mark.parametrize("query, hostid", [
+    ("what is the latency of the vsat?", "13001"),
+    ("is the voip vsat up?", "13003"),
+    ("how is the voipvsat doing", "13003"),
+    ("battery level of the ups", "13002"),
+    ("status of switch 2", "13005"),
+])
+def test_resolve_finds_the_device(query, hostid):
+    assert app.DeviceIndex(DEVICES).resolve(query) == hostid
+
+
+@pytest.mark.parametrize("query", [
+    "how many user groups are there?",
+    "is the switch up?",
+    "what is the weather today?",
+])
+def test_resolve_leaves_unclear_queries_to_the_llm(query):
+    assert app.DeviceIndex(DEVICES).resolve(query) is None
+
+
+def test_parse_plan_reads_the_json_in_the_answer():
+    answer = 'Here is the plan: {"need_nms": true, "hostid": 13001, "data": ["metrics", "history"]}'
+    assert app.parse_plan(answer, DEVICES) == {"need_nms": True, "hostid": "13001", "data": ["metrics", "history"]}
+
+
+def test_parse_plan_drops_unknown_hosts_and_data_kinds():
+    answer = '{"need_nms": "yes", "hostid": "99999", "data": ["graphs", 3]}'
+    assert app.parse_plan(answer, DEVICES) == {"need_nms": True, "hostid": "-1", "data": ["metrics"]}
+
+
+@pytest.mark.parametrize("need, expected", [('"false"', False), ('"No"', False), ("false", False), ('"true"', True), ("true", True)])
+def test_parse_plan_reads_need_nms_strictly(need, expected):
+    assert app.parse_plan(f'{{"need_nms": {need}}}', DEVICES)["need_nms"] is expected
+
+
+@pytest.mark.parametrize("answer", [
+    "I cannot help with that",
+    '{"need_nms": ',
+    '{"hostid": "13001"}',
+    '{"need_nms": "maybe"}',
+    '{"need_nms": 1}',
+    None,
+])
+def test_parse_plan_rejects_unusable_answers(answer):
+    assert app.parse_plan(answer, DEVICES) is None
+
+
+def test_complete_plan_adds_the_data_the_dashboard_shows(dashboard_devices):
+    plan = {"need_nms": True, "hostid": "13002", "data": ["history", "metrics"]}
+    assert app.complete_plan("how is the ups?", plan, dashboard_devices)["data"] == ["metrics", "problems", "history"]
+
+
+def test_complete_plan_keeps_plans_without_a_host(dashboard_devices):
+    plan = {"need_nms": True, "hostid": "-1", "data": ["metrics"]}
+    assert app.complete_plan("any problems?", plan, dashboard_devices) is plan
+    plan = {"need_nms": False, "hostid": "13002", "data": ["metrics"]}
+    assert app.complete_plan("how is the ups?", plan, dashboard_devices) is plan
+
+
+@pytest.mark.parametrize("query, window", [
+    ("How has the VSAT latency trended over the last 6 hours?", 6 * 3600),
+    ("Has the memory usage been fluctuating since yesterday?", 2 * 86400),
+    ("What was the peak CPU utilization of the BE6K today?", app.HISTORY_DEFAULT_WINDOW),
+    ("How has the latency been today?", app.HISTORY_DEFAULT_WINDOW),
+    ("Packet loss of the VSAT since 8 am", app.HISTORY_DEFAULT_WINDOW),
+    ("Average packet loss this week", 7 * 86400),
+])
+def test_history_window_reads_over_time_questions(query, window):
+    assert app.history_window(query) == window
+
+
+@pytest.mark.parametrize("query", [
+    "Has the VSAT been down?",
+    "Is the UPS up today?",
+    "What is the average load of the switch?",
+    "Has anything changed since the reboot?",
+])
+def test_history_window_leaves_current_state_questions_alone(query):
+    assert app.history_window(query) is None
+
+
+@pytest.mark.parametrize("query", [
+    "Which countries have a VSAT down?",
+    "Are there any problems across all sites?",
+    "Which country has the most UPS problems?",
+    "Give me a fleet overview of the OneICTbox devices",
+])
+def test_is_fleet_query_finds_questions_about_every_country(query):
+    assert app.is_fleet_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "Which country is this router in?",
+    "Are there errors across all interfaces of the switch?",
+    "Is the VSAT up?",
+])
+def test_is_fleet_query_leaves_single_site_questions_alone(query):
+    assert not app.is_fleet_query(query)
+
+
+def test_classify_nms_query_uses_the_cached_indexes(monkeypatch, dashboard_devices):
+    def no_new_index(*args):
+        raise AssertionError("classify_nms_query should not build a DeviceIndex")
+
+    monkeypatch.setattr(app, "DeviceIndex", no_new_index)
+    assert app.classify_nms_query("is switch 2 up?", dashboard_devices["index"]) == (True, 0.95)
+    assert app.classify_nms_query("how is the vsat doing?") == (True, 0.95)
+    assert app.classify_nms_query("hello there")[0] is False
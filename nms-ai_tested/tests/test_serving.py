@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from serving import ANSWER_ERROR, answer_events, answer_events_async, answer_payload, complete
+
+
+def parse(events):
+    parsed = []
+    for event in events:
+        lines = event.strip().split("\n")
+        name = lines[0][len("event: "):] if lines[0].startswith("event: ") else None
+        parsed.append((name, json.loads(lines[-1][len("data: "):])))
+    return parsed
+
+
+def failing_stream():
+    yield "Latency "
+    raise RuntimeError("connection reset")
+
+
+def test_answer_payload_flags_missing_answers():
+    assert answer_payload("ok", {"stale": False}) == {"stale": False, "response": "ok"}
+    assert answer_payload("", {}) == {"response": "", "error": ANSWER_ERROR}
+    assert answer_payload("ok", {}, cached=True) == {"response": "ok", "cached": True}
+
+
+def test_answer_events_stream_tokens_then_done():
+    answers = []
+    events = parse(answer_events(lambda: iter(["Latency ", "is 40 ms"]), {"stale": False}, on_answer=answers.append))
+    assert events == [
+        (None, {"token": "Latency "}),
+        (None, {"token": "is 40 ms"}),
+        ("done", {"stale": False, "response": "Latency is 40 ms"}),
+    ]
+    assert answers == ["Latency is 40 ms"]
+
+
+def test_answer_events_end_with_an_error_event_when_the_stream_fails():
+    answers = []
+    events = parse(answer_events(failing_stream, {}, on_answer=answers.append))
+    assert events[-1] == ("error", {"error": ANSWER_ERROR, "response": "Latency "})
+    assert answers == []
+
+
+def test_answer_events_send_cached_answers_without_streaming():
+    def stream():
+        raise AssertionError("the stream should not be opened")
+
+    events = parse(answer_events(stream, {}, cached_text="cached"))
+    assert events == [(None, {"token": "cached"}), ("done", {"response": "cached", "cached": True})]
+
+
+def test_answer_events_async_match_the_blocking_events():
+    async def tokens():
+        for token in ["Latency ", "is 40 ms"]:
+            yield token
+
+    answers = []
+
+    async def on_answer(text):
+        answers.append(text)
+
+    async def collect():
+        return [event async for event in answer_events_async(tokens, {}, on_answer=on_answer)]
+
+    assert asyncio.run(collect()) == list(answer_events(lambda: iter(["Latency ", "is 40 ms"]), {}))
+    assert answers == ["Latency is 40 ms"]
+
+
+def test_complete_returns_an_empty_answer_on_error():
+    def create():
+        raise TimeoutError("openai")
+
+    assert complete(create, "answer") == ""
@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+# Modules copied into both apps, since each Docker image is built from its app directory alone
+SHARED_MODULES = [
+    "cache.py", "instrumentation.py", "pipeline.py", "prompt_encoding.py", "resilience.py", "serving.py",
+    "singleflight.py",
+]
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IOT_DIR = os.path.join(os.path.dirname(APP_DIR), "iot-ai_tested")
+
+
+@pytest.mark.parametrize("module", SHARED_MODULES)
+def test_shared_module_copies_match(module):
+    # The tests here cover the IoT copies too, as long as they do not diverge
+    with open(os.path.join(APP_DIR, module), "rb") as nms_copy, open(os.path.join(IOT_DIR, module), "rb") as iot_copy:
+        assert nms_copy.read() == iot_copy.read(), f"iot-ai_tested/{module} differs from nms-ai_tested/{module}"
@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from resilience import DeadlineExceeded, start_deadline
+from singleflight import AsyncSingleFlight, SingleFlight, flight_key
+
+
+def test_flight_key_ignores_parameter_order():
+    assert flight_key("host.get", {"a": 1, "b": 2}) == flight_key("host.get", {"b": 2, "a": 1})
+    assert flight_key("host.get", {"a": 1}) != flight_key("item.get", {"a": 1})
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"hostid": "10084"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", fetch))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # Let every thread reach the call before it finishes
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 5 and all(result is results[0] for result in results)
+
+
+def test_waiting_callers_get_the_leader_exception():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(errors) == 2
+
+
+def test_finished_calls_are_not_cached():
+    flight = SingleFlight("test")
+    results = iter([1, 2])
+    assert flight.do("key", lambda: next(results)) == 1
+    assert flight.do("key", lambda: next(results)) == 2
+
+
+def test_waiter_stops_at_its_request_budget():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 1
+
+    leader = threading.Thread(target=lambda: flight.do("key", slow))
+    leader.start()
+    started.wait(5)
+
+    def wait():
+        start_deadline(0.05)
+        return flight.do("key", slow)
+
+    try:
+        # A fresh context, so the deadline does not outlive the test
+        with pytest.raises(DeadlineExceeded):
+            contextvars.Context().run(wait)
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_async_calls_share_one_task():
+    async def main():
+        flight = AsyncSingleFlight("test")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return ["item"]
+
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        return calls, results
+
+    calls, results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_async_call_survives_a_cancelled_waiter():
+    async def main():
+        flight = AsyncSingleFlight("test")
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitBreaker
+from stubs import StubServer, ZabbixStub
+from zabbix_client import AsyncZabbixClient, ZabbixAPIError, ZabbixClient
+
+
+class ShuffledZabbixStub(StubServer):
+    """Answers a batch in reverse order, fails item.get and leaves out trend.get."""
+
+    def handle(self, method, path, query, body):
+        if not isinstance(body, list):
+            return 200, {"jsonrpc": "2.0", "error": {"code": -32600, "message": "Invalid Request.", "data": "Not a batch"}, "id": None}
+        responses = []
+        for request in reversed(body):
+            if request["method"] == "trend.get":
+                continue
+            if request["method"] == "item.get":
+                responses.append({"jsonrpc": "2.0", "error": {"code": -32602, "message": "Invalid params.", "data": "No permissions"}, "id": request["id"]})
+            else:
+                responses.append({"jsonrpc": "2.0", "result": [{"method": request["method"]}], "id": request["id"]})
+        return 200, responses
+
+
+@pytest.fixture(scope="module")
+def shuffled():
+    stub = ShuffledZabbixStub().start()
+    yield stub
+    stub.stop()
+
+
+CALLS = [("host.get", {}), ("item.get", {}), ("problem.get", {}), ("trend.get", {})]
+
+
+def test_batch_results_follow_the_request_order(shuffled):
+    client = ZabbixClient(shuffled.url, token="t")
+    results = client.batch(CALLS, return_exceptions=True)
+
+    assert results[0] == [{"method": "host.get"}]
+    assert isinstance(results[1], ZabbixAPIError) and results[1].code == -32602
+    assert results[2] == [{"method": "problem.get"}]
+    assert isinstance(results[3], ZabbixAPIError) and "trend.get" in str(results[3])
+
+
+def test_batch_raises_the_first_failed_call(shuffled):
+    client = ZabbixClient(shuffled.url, token="t")
+    with pytest.raises(ZabbixAPIError, match="No permissions"):
+        client.batch(CALLS)
+
+
+def test_batch_error_object_fails_the_whole_batch(shuffled):
+    client = ZabbixClient(shuffled.url, token="t")
+    with pytest.raises(ZabbixAPIError, match="Not a batch"):
+        client.call("host.get", {})
+
+
+def test_async_batch_demultiplexes_like_the_sync_client(shuffled):
+    async def main():
+        client = AsyncZabbixClient(shuffled.url, token="t")
+        try:
+            return await client.batch(CALLS, return_exceptions=True)
+        finally:
+            await client.close()
+
+    results = asyncio.run(main())
+    assert results[0] == [{"method": "host.get"}] and results[2] == [{"method": "problem.get"}]
+    assert isinstance(results[1], ZabbixAPIError) and isinstance(results[3], ZabbixAPIError)
+
+
+def test_batch_is_one_http_request():
+    stub = ZabbixStub().start()
+    try:
+        client = ZabbixClient(stub.url + "/api_jsonrpc.php", token="t")
+        hosts, problems = client.batch([
+            ("host.get", {"hostids": ["13001"], "output": ["hostid"]}),
+            ("problem.get", {"hostids": ["13001"]})
+        ])
+        assert hosts[0]["hostid"] == "13001"
+        assert isinstance(problems, list)
+        assert stub.counts() == (1, 2)
+    finally:
+        stub.stop()
+
+
+def test_open_circuit_is_reported_as_an_api_error():
+    breaker = CircuitBreaker("zabbix", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    client = ZabbixClient("http://127.0.0.1:9/api_jsonrpc.php", token="t", breaker=breaker)
+    with pytest.raises(ZabbixAPIError, match="skipped"):
+        client.batch(CALLS)
@@ -0,0 +1,325 @@
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager, nullcontext
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from instrumentation import UPSTREAM_ERRORS, timed
+from resilience import CircuitOpenError, DeadlineExceeded, stage_timeout
+from singleflight import AsyncSingleFlight, SingleFlight, flight_key
+
+# ------------------ Zabbix JSON-RPC Client ------------------
+
+ZABBIX_HEADERS = {
+    "Content-Type": "application/json-rpc"
+}
+
+
+class ZabbixAPIError(Exception):
+    """Raised when the Zabbix API returns a JSON-RPC error or cannot be reached."""
+
+    def __init__(self, message, data=None, code=None):
+        super().__init__(f"{message} - {data}" if data else message)
+        self.message = message
+        self.data = data
+        self.code = code
+
+
+def _call_result(data):
+    """Extract the result of a single JSON-RPC response, raising on errors."""
+    if "error" in data:
+        error = data["error"]
+        raise ZabbixAPIError(error.get("message"), error.get("data"), error.get("code"))
+
+    return data.get("result", [])
+
+
+@contextmanager
+def _upstream_errors():
+    """Report a spent request budget or an open circuit as a ZabbixAPIError, like any failed call."""
+    try:
+        yield
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        raise ZabbixAPIError(f"Zabbix request skipped: {e}") from e
+
+
+def _batch_operation(batch_requests):
+    """Metric label of a batch: its distinct methods, e.g. "host.get+problem.get"."""
+    return "+".join(dict.fromkeys(batch_request["method"] for batch_request in batch_requests))
+
+
+def _batch_results(batch_requests, data, return_exceptions):
+    """Demultiplex a JSON-RPC batch response by id, in request order."""
+    # Zabbix answers a malformed batch with a single error object
+    if isinstance(data, dict):
+        error = data.get("error", {})
+        raise ZabbixAPIError(error.get("message", "Invalid batch response"), error.get("data"), error.get("code"))
+
+    responses = {response.get("id"): response for response in data}
+
+    results = []
+    for batch_request in batch_requests:
+        response = responses.get(batch_request["id"])
+        if response is None:
+            result = ZabbixAPIError(f"No response for {batch_request['method']}")
+        else:
+            try:
+                result = _call_result(response)
+            except ZabbixAPIError as e:
+                result = e
+
+        if isinstance(result, ZabbixAPIError):
+            UPSTREAM_ERRORS.inc(service="zabbix", operation=batch_request["method"])
+
+        if isinstance(result, ZabbixAPIError) and not return_exceptions:
+            raise result
+        results.append(result)
+
+    return results
+
+
+class ZabbixClient:
+    """
+    Pooled, keep-alive client for the Zabbix JSON-RPC API.
+
+    A single instance is shared by the whole process so that every Zabbix call
+    reuses the same TCP/TLS connections instead of opening a new one per request.
+    Identical calls made concurrently (same method, parameters and token) are
+    sent once and share the result, so many users opening the same dashboard
+    during an incident do not multiply the load on Zabbix.
+
+    Each request's read timeout is cut to what is left of the request budget
+    (see resilience.stage_timeout), and an optional circuit breaker stops
+    calls to a Zabbix server that keeps failing.
+
+    Args:
+        url: The Zabbix `api_jsonrpc.php` endpoint
+        token: Default Zabbix API token used when a call does not pass one
+        pool_size: Maximum number of pooled connections kept open to Zabbix
+        connect_timeout: Seconds to wait for a connection to be established
+        read_timeout: Seconds to wait for Zabbix to send a response
+        max_retries: Retries for connection errors and 502/503/504 responses
+        backoff_factor: Exponential backoff factor between retries
+        breaker: CircuitBreaker guarding the HTTP requests (optional)
+    """
+
+    def __init__(self, url, token=None, pool_size=10, connect_timeout=3.05,
+                 read_timeout=30, max_retries=2, backoff_factor=0.3, breaker=None):
+        self.url = url
+        self.token = token
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker
+        self._ids = itertools.count(1)
+        self._ids_lock = threading.Lock()
+        self._flight = SingleFlight("zabbix")
+
+        # JSON-RPC reads are idempotent, so POST is safe to retry here. Read
+        # timeouts are not retried: a slow Zabbix would cost the request budget
+        # once per attempt.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update(ZABBIX_HEADERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _next_id(self):
+        with self._ids_lock:
+            return next(self._ids)
+
+    def _build_request(self, method, params, token):
+        return {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params,
+            "auth": token or self.token,
+            "id": self._next_id()
+        }
+
+    def _timeouts(self):
+        """(connect, read) timeouts of the next request, cut to the request budget."""
+        read_timeout = stage_timeout(self.read_timeout)
+        return min(self.connect_timeout, read_timeout), read_timeout
+
+    def _guard(self):
+        return self.breaker.guard() if self.breaker else nullcontext()
+
+    def _post(self, payload):
+        timeout = self._timeouts()
+        try:
+            with self._guard():
+                response = self.session.post(self.url, json=payload, timeout=timeout)
+                response.raise_for_status()
+                return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise ZabbixAPIError(f"Zabbix request failed: {e}") from e
+
+    def call(self, method, params, token=None, coalesce=True):
+        """
+        Call a single Zabbix API method.
+
+        Args:
+            method: The JSON-RPC method name, e.g. "host.get"
+            params: The method parameters
+            token: Zabbix API token (defaults to the client token)
+            coalesce: Share the result of an identical call already in flight;
+                callers that modify the result must pass False
+
+        Returns:
+            The `result` member of the JSON-RPC response
+
+        Raises:
+            ZabbixAPIError: On transport failures, JSON-RPC errors, a spent
+                request budget or an open circuit
+        """
+        with _upstream_errors():
+            if coalesce:
+                key = flight_key(method, params, token or self.token)
+                return self._flight.do(key, self._call, method, params, token, operation=method)
+            return self._call(method, params, token)
+
+    def _call(self, method, params, token):
+        with timed("zabbix", method):
+            return _call_result(self._post(self._build_request(method, params, token)))
+
+    def batch(self, calls, token=None, return_exceptions=False, coalesce=True):
+        """
+        Send several Zabbix API calls as one JSON-RPC batch (a single HTTP round trip).
+
+        Args:
+            calls: List of (method, params) tuples
+            token: Zabbix API token (defaults to the client token)
+            return_exceptions: If True, a failed call yields its ZabbixAPIError
+                in the results list instead of raising
+            coalesce: Share the results of an identical batch already in flight;
+                callers that modify the results must pass False
+
+        Returns:
+            list: The `result` of each call, in the same order as `calls`
+
+        Raises:
+            ZabbixAPIError: On transport failures, a spent request budget, an open
+                circuit, or on the first failed call unless `return_exceptions` is set
+        """
+        with _upstream_errors():
+            if coalesce:
+                key = flight_key("batch", calls, token or self.token, return_exceptions)
+                operation = "+".join(dict.fromkeys(method for method, _ in calls))
+                return self._flight.do(key, self._batch, calls, token, return_exceptions, operation=operation)
+            return self._batch(calls, token, return_exceptions)
+
+    def _batch(self, calls, token, return_exceptions):
+        batch_requests = [self._build_request(method, params, token) for method, params in calls]
+        with timed("zabbix", _batch_operation(batch_requests)):
+            data = self._post(batch_requests)
+        return _batch_results(batch_requests, data, return_exceptions)
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+
+class AsyncZabbixClient(ZabbixClient):
+    """
+    Non-blocking variant of ZabbixClient for the async (ASGI) serving mode.
+
+    Uses a pooled `httpx.AsyncClient`; `call` and `batch` are coroutines with the
+    same arguments and results as their ZabbixClient counterparts. The httpx client
+    is created on first use, inside the serving event loop.
+
+    Args:
+        url: The Zabbix `api_jsonrpc.php` endpoint
+        token: Default Zabbix API token used when a call does not pass one
+        pool_size: Maximum number of pooled connections kept open to Zabbix
+        connect_timeout: Seconds to wait for a connection to be established
+        read_timeout: Seconds to wait for Zabbix to send a response
+        max_retries: Retries for failed connection attempts
+        breaker: CircuitBreaker guarding the HTTP requests (optional)
+    """
+
+    def __init__(self, url, token=None, pool_size=10, connect_timeout=3.05,
+                 read_timeout=30, max_retries=2, backoff_factor=0.3, breaker=None):
+        self.url = url
+        self.token = token
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker
+        self._ids = itertools.count(1)
+        self._ids_lock = threading.Lock()
+        self._flight = AsyncSingleFlight("zabbix")
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=ZABBIX_HEADERS,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                transport=httpx.AsyncHTTPTransport(retries=self.max_retries)
+            )
+        return self._client
+
+    async def _post(self, payload):
+        connect_timeout, read_timeout = self._timeouts()
+        try:
+            with self._guard():
+                # wait_for bounds the whole exchange, retries included
+                response = await asyncio.wait_for(
+                    self.client.post(self.url, json=payload, timeout=httpx.Timeout(read_timeout, connect=connect_timeout)),
+                    read_timeout
+                )
+                response.raise_for_status()
+                return response.json()
+        except (httpx.HTTPError, ValueError, asyncio.TimeoutError) as e:
+            raise ZabbixAPIError(f"Zabbix request failed: {e!r}") from e
+
+    async def call(self, method, params, token=None, coalesce=True):
+        """Call a single Zabbix API method (see ZabbixClient.call)."""
+        with _upstream_errors():
+            if coalesce:
+                key = flight_key(method, params, token or self.token)
+                return await self._flight.do(key, self._call, method, params, token, operation=method)
+            return await self._call(method, params, token)
+
+    async def _call(self, method, params, token):
+        with timed("zabbix", method):
+            return _call_result(await self._post(self._build_request(method, params, token)))
+
+    async def batch(self, calls, token=None, return_exceptions=False, coalesce=True):
+        """Send several Zabbix API calls as one JSON-RPC batch (see ZabbixClient.batch)."""
+        with _upstream_errors():
+            if coalesce:
+                key = flight_key("batch", calls, token or self.token, return_exceptions)
+                operation = "+".join(dict.fromkeys(method for method, _ in calls))
+                return await self._flight.do(key, self._batch, calls, token, return_exceptions, operation=operation)
+            return await self._batch(calls, token, return_exceptions)
+
+    async def _batch(self, calls, token, return_exceptions):
+        batch_requests = [self._build_request(method, params, token) for method, params in calls]
+        with timed("zabbix", _batch_operation(batch_requests)):
+            data = await self._post(batch_requests)
+        return _batch_results(batch_requests, data, return_exceptions)
+
+    async def close(self):
+        """Close all pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None